@@ -0,0 +1,747 @@
+"""Script to benchmark the catalog against a synthetic catalog, so that
+changes can be checked for performance regressions.
+
+Usage:
+    python benchmark.py generate [--items N] [--tags N] [--tags-per-item N]
+                                 [--users N] [--seed N] [--db FILE]
+    python benchmark.py run [--requests N] [--concurrency N] [--mode MODE]
+                            [--routes NAME,...] [--output FILE] [--db FILE]
+    python benchmark.py compare OLD.json NEW.json
+    python benchmark.py startup [--runs N] [--budget-ms MS]
+    python benchmark.py queries [--small N] [--large N] [--tags N]
+
+generate creates a benchmark database (benchmark.db by default, or a
+Postgres database given with --db-url) filled with a random but repeatable
+catalog: the same options and seed always give the same catalog.
+
+run sends requests to each read and write route in turn, through the Flask
+test client (--mode client) or to a local HTTP server (--mode http), from
+--concurrency threads at once. It prints the p50, p95 and p99 latencies,
+throughput and SQL statement counts for each route, and saves them as JSON
+to the --output file. The write routes change the catalog, so generate it
+again before comparing runs.
+
+compare prints the change in each route's figures between two saved runs.
+
+startup times importing the app in fresh interpreters, and fails if it
+takes longer than --budget-ms or imports modules which should be loaded
+lazily, so it can be run as a check before merging.
+
+queries generates a small and a large catalog in a temporary directory,
+counts the SQL statements each list route runs against both, and fails if
+any count differs, so that views whose queries grow with the data are
+caught before merging.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Page size used for the read routes
+PAGE_LIMIT = 50
+# Number of items created by each request to the batch route
+BATCH_SIZE = 10
+# Most requests sent to the routes which return the whole catalog, as each
+# takes seconds against a big one
+DUMP_REQUESTS = 5
+
+WORDS = ('red blue green small large old new wooden metal glass paper '
+         'round square soft hard light heavy quiet loud fast slow bright '
+         'dark warm cold sharp smooth').split()
+
+
+# Settings
+
+def write_settings(args):
+    """Write the settings for the benchmark database to a file, and point
+    the catalog at it. Must be called before the catalog is imported."""
+    path = os.path.abspath(args.db) + '.cfg'
+    settings = {
+        'DB_FILE': os.path.abspath(args.db),
+        'DB_URL': args.db_url or '',
+        'CATALOG_LOGFILE': os.path.abspath(args.db) + '.log',
+        'LOG_MAX_BYTES': 0,
+        # The SQL profiler's X-SQL-Profile header gives the SQL counts
+        'SQL_PROFILER_ENABLED': True,
+        'SQL_PROFILER_HEADER': True,
+        'SQL_PROFILER_HISTORY': 0,
+        # Logins are checked by the stand-in provider, without any network
+        'IDENTITY_PROVIDER': 'local',
+        'PAGE_CACHE_BACKEND': getattr(args, 'page_cache', 'memory'),
+    }
+    with open(path, 'w') as f:
+        for key, value in sorted(settings.items()):
+            f.write('%s = %r\n' % (key, value))
+    os.environ['CATALOG_SETTINGS'] = path
+
+
+# Generating a catalog
+
+def generate_records(rnd, args, tag_names):
+    """Yield the item records for the bulk importer. Tags are chosen with
+    a skewed distribution, so some are much bigger than others."""
+    for number in range(1, args.items + 1):
+        tags = set()
+        for _ in range(rnd.randint(0, args.tags_per_item * 2)):
+            index = int(rnd.paretovariate(1.0)) - 1
+            tags.add(tag_names[index % len(tag_names)])
+        yield {
+            'name': 'Item %d %s' % (number, rnd.choice(WORDS)),
+            'description': ' '.join(rnd.choice(WORDS)
+                                    for _ in range(rnd.randint(5, 25))),
+            'user_id': rnd.randint(1, args.users),
+            'tags': sorted(tags),
+        }
+
+def generate(args):
+    if not args.db_url and os.path.exists(args.db):
+        os.remove(args.db)
+    from catalog.database import engine, init_db
+    from catalog.models import User
+    from catalog.bulk import Importer
+    init_db()
+
+    rnd = random.Random(args.seed)
+    users = [{'id': number,
+              'name': 'User %d' % number,
+              'email': 'user%d@example.com' % number,
+              'activated': True,
+              # The first user is an admin, and makes the write requests
+              'admin': number == 1}
+             for number in range(1, args.users + 1)]
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), users)
+
+    tag_names = ['Tag %d' % number for number in range(1, args.tags + 1)]
+    start = time.time()
+    importer = Importer(engine, user_id=1, batch_size=5000)
+    count = importer.run(generate_records(rnd, args, tag_names))
+    print "Generated %d items in %.1fs: %s" % (count, time.time() - start,
+                                               engine.url)
+
+
+# Clients
+
+class TestClient(object):
+    """Sends requests through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def set_cookie(self, name, value):
+        self.client.set_cookie('localhost', name, value)
+
+    def request(self, method, path, data=None, json_body=None, headers=None):
+        if json_body is not None:
+            data = json.dumps(json_body)
+        response = self.client.open(
+            path, method=method, data=data, headers=headers,
+            content_type='application/json' if json_body is not None
+                         else None)
+        return response.status_code, response.headers, response.data
+
+
+class HTTPClient(object):
+    """Sends requests to a server over HTTP"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def set_cookie(self, name, value):
+        self.session.cookies.set(name, value)
+
+    def request(self, method, path, data=None, json_body=None, headers=None):
+        response = self.session.request(method, self.base_url + path,
+                                        data=data, json=json_body,
+                                        headers=headers,
+                                        allow_redirects=False)
+        return response.status_code, response.headers, response.content
+
+def start_server(app):
+    """Start a threaded HTTP server for app on a free local port, returning
+    the server and its base url"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_port
+
+def log_in(app, client, user):
+    """Log the client in as user, by giving it a signed session cookie"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    client.set_cookie(app.session_cookie_name,
+                      serializer.dumps({'user_id': user.id,
+                                        'username': user.name,
+                                        'email': user.email,
+                                        'picture': user.picture}))
+
+def csrf_token(client):
+    status, headers, body = client.request('GET', '/catalog/items/new/')
+    return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"',
+                     body).group(1)
+
+
+# Routes
+
+class Catalog(object):
+    """What the routes need to know about the catalog, sampled once before
+    the run"""
+
+    def __init__(self, db_session):
+        from catalog.models import Item, Tag, User
+        self.items = db_session.query(Item.id, Item.name).all()
+        self.tags = db_session.query(Tag.id, Tag.name).all()
+        self.max_id = max(item_id for item_id, name in self.items or [(0, 0)])
+        self.max_tag_id = max(tag_id for tag_id, name in self.tags or [(0, 0)])
+        self.users = db_session.query(User.email).count()
+        self.lock = threading.Lock()
+        # Items and tags created by the write routes, for the routes which
+        # edit and delete them
+        self.created = []
+        self.created_tags = []
+
+def read_routes(catalog):
+    """Returns (name, request factory, expected status) tuples for the
+    read routes. Each factory takes a Random and the client's CSRF token,
+    and returns (method, path, form data, JSON body)."""
+    def get(template, *choosers):
+        def make_request(rnd, token):
+            path = template % tuple(choose(rnd) for choose in choosers)
+            return ('GET', path, None, None)
+        return make_request
+    def item_name(rnd):
+        return rnd.choice(catalog.items).name
+    def item_id(rnd):
+        return rnd.choice(catalog.items).id
+    def tag_name(rnd):
+        return rnd.choice(catalog.tags).name
+    def word(rnd):
+        return rnd.choice(WORDS)
+    def archive_page(rnd):
+        # Archive pages hold 100 items each, and the newest is still open
+        return rnd.randint(1, max(1, (catalog.max_id - 1) // 100))
+    def item_path(template):
+        # Choose the name and id of the same item
+        def make_request(rnd, token):
+            item = rnd.choice(catalog.items)
+            return ('GET', template % (item.name, item.id), None, None)
+        return make_request
+    return [
+        ('index', get('/catalog/'), 200),
+        ('viewTag', get(u'/catalog/tags/view/%s/', tag_name), 200),
+        ('viewItem', item_path(u'/catalog/items/view/%s-%d/'), 200),
+        ('search', get('/catalog/search/?q=%s', word), 200),
+        ('browse', get(u'/catalog/browse/?tag=%s&exclude=%s',
+                       tag_name, tag_name), 200),
+        ('indexJSON', get('/catalog.json?limit=%d' % PAGE_LIMIT), 200),
+        ('indexTagsJSON', get('/catalog/tags.json?limit=%d' % PAGE_LIMIT),
+         200),
+        ('indexItemsJSON', get('/catalog/items.json?limit=%d' % PAGE_LIMIT),
+         200),
+        ('viewTagJSON', get(u'/catalog/tags/view/%s.json', tag_name), 200),
+        ('viewItemJSON', item_path(u'/catalog/items/view/%s-%d.json'), 200),
+        ('searchJSON', get('/catalog/search.json?q=%s', word), 200),
+        ('browseJSON', get(u'/catalog/browse.json?tag=%s', tag_name), 200),
+        ('recentAtom', get('/catalog/recent.atom'), 200),
+        ('archiveAtom', get('/catalog/archive/%d.atom', archive_page), 200),
+        ('dumpNDJSON', get('/catalog/items.ndjson'), 200),
+        ('dumpJSON', get('/catalog.json?all=1'), 200),
+    ]
+
+def write_routes(catalog):
+    """Returns (name, request factory, expected status) tuples for the
+    write routes, as for read_routes. The form views redirect when they
+    succeed. The tag edit route renames the tags created by newTag, and the
+    delete routes delete the items and tags created by the others. The
+    login route logs the client in as one of the generated users, so comes
+    last."""
+    def item_form(rnd, token, name):
+        return {'csrf_token': token,
+                'name': name,
+                'description': ' '.join(rnd.sample(WORDS, 5)),
+                'tags': [str(tag.id) for tag in
+                         rnd.sample(catalog.tags, min(2, len(catalog.tags)))]}
+
+    def new_item(rnd, token):
+        return ('POST', '/catalog/items/new/',
+                item_form(rnd, token, 'New %d' % rnd.randint(1, 10 ** 6)),
+                None)
+
+    def edit_item(rnd, token):
+        item = rnd.choice(catalog.items)
+        return ('POST', u'/catalog/items/edit/%s-%d/' % (item.name, item.id),
+                item_form(rnd, token, item.name), None)
+
+    def batch(rnd, token):
+        operations = [{'op': 'create',
+                       'name': 'Batch %d' % rnd.randint(1, 10 ** 6),
+                       'tags': [rnd.choice(catalog.tags).id]}
+                      for _ in range(BATCH_SIZE)]
+        return ('POST', '/catalog/items/batch.json', None,
+                {'csrf_token': token, 'operations': operations})
+
+    def delete_item(rnd, token):
+        with catalog.lock:
+            item_id, name = catalog.created.pop()
+        return ('POST', u'/catalog/items/delete/%s-%d/' % (name, item_id),
+                {'csrf_token': token}, None)
+
+    def new_tag(rnd, token):
+        return ('POST', '/catalog/tags/new/',
+                {'csrf_token': token,
+                 'tag_name': 'New tag %d' % rnd.randint(1, 10 ** 6)}, None)
+
+    def edit_tag(rnd, token):
+        # Each created tag is renamed once, so that no two requests use
+        # the same name
+        with catalog.lock:
+            tag_id, name = catalog.created_tags.pop()
+        return ('POST', u'/catalog/tags/edit/%s/' % name,
+                {'csrf_token': token, 'tag_name': 'Renamed tag %d' % tag_id},
+                None)
+
+    def delete_tag(rnd, token):
+        with catalog.lock:
+            tag_id, name = catalog.created_tags.pop()
+        return ('POST', u'/catalog/tags/delete/%s/' % name,
+                {'csrf_token': token}, None)
+
+    def login(rnd, token):
+        email = 'user%d@example.com' % rnd.randint(1, catalog.users)
+        return ('POST', '/gconnect', {'csrf_token': token, 'code': email},
+                None)
+
+    return [
+        ('newItem', new_item, 302),
+        ('editItem', edit_item, 302),
+        ('batchItemsJSON', batch, 200),
+        ('deleteItem', delete_item, 302),
+        ('newTag', new_tag, 302),
+        ('editTag', edit_tag, 302),
+        ('deleteTag', delete_tag, 302),
+        ('login', login, 200),
+    ]
+
+
+# Running
+
+def percentile(values, fraction):
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return None
+    index = max(0, int(round(fraction * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+def summarise(timings, statements, sql_ms, errors, elapsed):
+    timings = sorted(timings)
+    count = len(timings)
+    ms = lambda seconds: round(seconds * 1000, 3) \
+                         if seconds is not None else None
+    return {
+        'requests': count,
+        'errors': errors,
+        'p50_ms': ms(percentile(timings, 0.50)),
+        'p95_ms': ms(percentile(timings, 0.95)),
+        'p99_ms': ms(percentile(timings, 0.99)),
+        'mean_ms': ms(sum(timings) / count if count else None),
+        'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+        'sql_statements_mean': round(float(sum(statements)) / count, 2)
+                               if statements else None,
+        'sql_statements_max': max(statements) if statements else None,
+        'sql_time_ms_mean': round(sum(sql_ms) / count, 3)
+                            if sql_ms else None,
+    }
+
+def run_route(clients, tokens, make_request, expected, requests, seed):
+    """Send requests requests, shared between the clients, each in its own
+    thread, counting responses without the expected status as errors.
+    Returns the route's summary."""
+    results = []
+    lock = threading.Lock()
+    per_client = [requests // len(clients) + (index < requests % len(clients))
+                  for index in range(len(clients))]
+
+    def worker(index, client):
+        rnd = random.Random('%s-%d' % (seed, index))
+        for _ in range(per_client[index]):
+            method, path, data, json_body = make_request(rnd, tokens[index])
+            start = time.time()
+            status, headers, body = client.request(method, path, data=data,
+                                                   json_body=json_body)
+            seconds = time.time() - start
+            with lock:
+                results.append((seconds, status, headers.get('X-SQL-Profile')))
+
+    threads = [threading.Thread(target=worker, args=(index, client))
+               for index, client in enumerate(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    timings, statements, sql_ms, errors = [], [], [], 0
+    for seconds, status, profile in results:
+        timings.append(seconds)
+        if status != expected:
+            errors += 1
+        match = profile and re.search(r'statements=(\d+); time_ms=([\d.]+)',
+                                      profile)
+        if match:
+            statements.append(int(match.group(1)))
+            sql_ms.append(float(match.group(2)))
+    return summarise(timings, statements, sql_ms, errors, elapsed)
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    from catalog import app
+    from catalog.database import db_session, engine
+    from catalog.models import Item, Tag, User
+    from catalog.changes import get_catalog_version
+
+    catalog = Catalog(db_session)
+    user = db_session.query(User).filter_by(admin=True).first()
+    if not catalog.items or user is None:
+        print "The benchmark database is empty: run generate first."
+        sys.exit(1)
+    db_session.remove()
+
+    server = None
+    if args.mode == 'http':
+        server, base_url = start_server(app)
+        make_client = lambda: HTTPClient(base_url)
+    else:
+        make_client = lambda: TestClient(app)
+    clients = [make_client() for _ in range(args.concurrency)]
+    for client in clients:
+        log_in(app, client, user)
+    # CSRF tokens belong to the session, so each client needs its own
+    tokens = [csrf_token(client) for client in clients]
+
+    routes = read_routes(catalog) + write_routes(catalog)
+    if args.routes:
+        chosen = args.routes.split(',')
+        routes = [route for route in routes if route[0] in chosen]
+
+    results = {}
+    for name, make_request, expected in routes:
+        if name == 'deleteItem':
+            # Delete the items the other write routes created
+            catalog.created = [
+                (row.id, row.name) for row in
+                db_session.query(Item.id, Item.name)
+                          .filter(Item.id > catalog.max_id)
+                          .order_by(Item.id)
+                          .limit(args.requests)]
+            db_session.remove()
+            requests = min(args.requests, len(catalog.created))
+        elif name in ('editTag', 'deleteTag'):
+            # Rename, then delete, the tags newTag created
+            catalog.created_tags = [
+                (row.id, row.name) for row in
+                db_session.query(Tag.id, Tag.name)
+                          .filter(Tag.id > catalog.max_tag_id)
+                          .order_by(Tag.id)
+                          .limit(args.requests)]
+            db_session.remove()
+            requests = min(args.requests, len(catalog.created_tags))
+        else:
+            requests, warmup = args.requests, args.warmup
+            if name in ('dumpJSON', 'dumpNDJSON'):
+                requests = min(requests, DUMP_REQUESTS)
+                warmup = min(warmup, 1)
+            rnd = random.Random(args.seed)
+            for _ in range(warmup):
+                method, path, data, json_body = make_request(rnd, tokens[0])
+                clients[0].request(method, path, data=data,
+                                   json_body=json_body)
+        results[name] = run_route(clients, tokens, make_request, expected,
+                                  requests, args.seed)
+        print_summary(name, results[name])
+
+    if server is not None:
+        server.shutdown()
+
+    counts = db_session.query(Item).count()
+    output = {
+        'meta': {
+            'time': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'database': engine.dialect.name,
+            'mode': args.mode,
+            'concurrency': args.concurrency,
+            'requests_per_route': args.requests,
+            'seed': args.seed,
+            'page_cache': app.config['PAGE_CACHE_BACKEND'],
+            'items': counts,
+            'tags': len(catalog.tags),
+            'catalog_version': get_catalog_version(db_session)[0],
+        },
+        'routes': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print
+    print "Results saved to %s" % args.output
+
+
+# Startup
+
+# Modules which should only be imported when first needed, not when the
+# app is (see catalog/lazyviews.py)
+LAZY_MODULES = ('requests', 'werkzeug.contrib.atom', 'catalog.oauth',
+                'catalog.feeds', 'catalog.auth_views', 'catalog.feed_views',
+                'catalog.admin_views')
+
+# Run in a fresh interpreter for each measurement: imports the app, as every
+# script and worker does, then loads what the production server's master
+# preloads
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.time()
+import catalog
+imported = time.time()
+lazy = [name for name in %r if name in sys.modules]
+from catalog.server import preload
+preload(catalog.app)
+json.dump({'import': imported - start, 'preload': time.time() - imported,
+           'lazy': lazy}, sys.stdout)
+"""
+
+def startup(args):
+    """Time starting the app in fresh interpreters. Returns whether it was
+    within the budget, without importing any of the lazy modules."""
+    script = STARTUP_SCRIPT % (LAZY_MODULES,)
+    imports, preloads, lazy = [], [], set()
+    for _ in range(args.runs):
+        result = json.loads(subprocess.check_output(
+            [sys.executable, '-c', script]))
+        imports.append(result['import'])
+        preloads.append(result['preload'])
+        lazy.update(result['lazy'])
+    import_ms = percentile(sorted(imports), 0.5) * 1000
+    preload_ms = percentile(sorted(preloads), 0.5) * 1000
+    print "Importing the app:   %7.1f ms (median of %d runs, budget %d ms)" % (
+        import_ms, args.runs, args.budget_ms)
+    print "Preloading views and templates: %7.1f ms" % preload_ms
+    ok = import_ms <= args.budget_ms
+    if not ok:
+        print "Over budget"
+    if lazy:
+        print "Imported eagerly: %s" % ', '.join(sorted(lazy))
+        ok = False
+    return ok
+
+
+# Query counts
+
+# List routes whose SQL statement counts mustn't depend on the size of the
+# catalog. 'Tag 1' is the biggest tag in a generated catalog. The streamed
+# dumps read in batches, so are left out.
+QUERY_ROUTES = [
+    ('index', '/catalog/'),
+    ('viewTag', '/catalog/tags/view/Tag%201/'),
+    ('search', '/catalog/search/?q=red'),
+    ('browse', '/catalog/browse/?tag=Tag%201&exclude=Tag%202'),
+    ('indexJSON', '/catalog.json?limit=%d' % PAGE_LIMIT),
+    ('indexTagsJSON', '/catalog/tags.json?limit=%d' % PAGE_LIMIT),
+    ('indexItemsJSON', '/catalog/items.json?limit=%d' % PAGE_LIMIT),
+    ('viewTagJSON', '/catalog/tags/view/Tag%201.json'),
+    ('searchJSON', '/catalog/search.json?q=red'),
+    ('browseJSON', '/catalog/browse.json?tag=Tag%201'),
+    ('recentAtom', '/catalog/recent.atom'),
+    ('archiveAtom', '/catalog/archive/1.atom'),
+]
+
+# Run in a fresh interpreter for each catalog, as the app's database is
+# chosen when it is imported. Each route is requested once first, so that
+# what is built on first use isn't counted.
+QUERIES_SCRIPT = """
+import json, re, sys
+from catalog import app
+client = app.test_client()
+counts = {}
+for name, path in %r:
+    client.get(path)
+    response = client.get(path)
+    profile = response.headers.get('X-SQL-Profile', '')
+    match = re.search(r'statements=(\\d+)', profile)
+    counts[name] = [response.status_code,
+                    int(match.group(1)) if match else None]
+json.dump(counts, sys.stdout)
+"""
+
+def count_queries(directory, items, tags):
+    """Generate a catalog with the given numbers of items and tags, and
+    return {route name: [status, SQL statements]} for the QUERY_ROUTES"""
+    db = os.path.join(directory, 'catalog-%d.db' % items)
+    script = os.path.abspath(__file__)
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([sys.executable, script, '--db', db,
+                               'generate', '--items', str(items),
+                               '--tags', str(tags)], stdout=devnull)
+    # Render every page, rather than counting the page cache's hits
+    with open(db + '.cfg', 'a') as f:
+        f.write("PAGE_CACHE_BACKEND = 'none'\n")
+    env = dict(os.environ, CATALOG_SETTINGS=db + '.cfg')
+    return json.loads(subprocess.check_output(
+        [sys.executable, '-c', QUERIES_SCRIPT % (QUERY_ROUTES,)], env=env,
+        cwd=os.path.dirname(script)))
+
+def queries(args):
+    """Compare the SQL statement counts of the list routes against a small
+    and a large catalog. Returns whether they were all the same."""
+    directory = tempfile.mkdtemp(prefix='catalog-queries-')
+    try:
+        small = count_queries(directory, args.small, args.tags)
+        large = count_queries(directory, args.large, args.tags)
+    finally:
+        shutil.rmtree(directory)
+    print "%-16s %10s %10s" % ('route', '%d items' % args.small,
+                               '%d items' % args.large)
+    ok = True
+    for name, path in QUERY_ROUTES:
+        (small_status, small_count), (large_status, large_count) = \
+            small[name], large[name]
+        problem = ''
+        if small_status != 200 or large_status != 200:
+            problem = 'status %d, %d' % (small_status, large_status)
+        elif small_count is None or small_count != large_count:
+            problem = 'differs'
+        print "%-16s %10s %10s %s" % (name, small_count, large_count, problem)
+        ok = ok and not problem
+    return ok
+
+
+# Reporting
+
+COLUMNS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps',
+           'sql_statements_mean')
+
+def print_header():
+    print "%-16s %8s %8s %8s %8s %6s %8s" % (
+        'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors', 'sql/req')
+
+def print_summary(name, summary):
+    print "%-16s %8s %8s %8s %8s %6d %8s" % (
+        name, summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+        summary['throughput_rps'], summary['errors'],
+        summary['sql_statements_mean'])
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print "Comparing %s (%s) with %s (%s)" % (
+        args.old, old['meta'].get('commit'),
+        args.new, new['meta'].get('commit'))
+    print "%-16s %-20s %10s %10s %8s" % ('route', 'figure', 'old', 'new',
+                                         'change')
+    for name in sorted(set(old['routes']) & set(new['routes'])):
+        for column in COLUMNS:
+            before = old['routes'][name].get(column)
+            after = new['routes'][name].get(column)
+            change = ''
+            if before and after is not None:
+                change = '%+.0f%%' % ((after - before) * 100.0 / before)
+            print "%-16s %-20s %10s %10s %8s" % (name, column, before, after,
+                                                 change)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the catalog against a synthetic catalog.')
+    parser.add_argument('--db', default='benchmark.db',
+                        help='SQLite database file to use')
+    parser.add_argument('--db-url',
+                        help='Database URL to use instead of --db')
+    commands = parser.add_subparsers(dest='command')
+
+    generate_parser = commands.add_parser(
+        'generate', help='Create a synthetic catalog')
+    generate_parser.add_argument('--items', type=int, default=10000)
+    generate_parser.add_argument('--tags', type=int, default=200)
+    generate_parser.add_argument('--tags-per-item', type=int, default=3,
+                                 help='Average number of tags per item')
+    generate_parser.add_argument('--users', type=int, default=50)
+    generate_parser.add_argument('--seed', type=int, default=1)
+
+    run_parser = commands.add_parser(
+        'run', help='Benchmark the routes against the catalog')
+    run_parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per route')
+    run_parser.add_argument('--warmup', type=int, default=5,
+                            help='Unmeasured requests per route first')
+    run_parser.add_argument('--concurrency', type=int, default=1)
+    run_parser.add_argument('--mode', choices=('client', 'http'),
+                            default='client')
+    run_parser.add_argument('--routes',
+                            help='Comma separated names of the routes to run')
+    run_parser.add_argument('--page-cache', choices=('memory', 'none'),
+                            default='memory')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', default='benchmark.json')
+
+    compare_parser = commands.add_parser(
+        'compare', help='Compare the results of two runs')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    startup_parser = commands.add_parser(
+        'startup', help='Check the time taken to import the app')
+    startup_parser.add_argument('--runs', type=int, default=10)
+    startup_parser.add_argument('--budget-ms', type=int, default=1000,
+                                help='Most time importing the app may take')
+
+    queries_parser = commands.add_parser(
+        'queries', help='Check that the list routes run the same number of '
+                        'SQL statements however big the catalog is')
+    queries_parser.add_argument('--small', type=int, default=500,
+                                help='Items in the small catalog')
+    queries_parser.add_argument('--large', type=int, default=5000,
+                                help='Items in the large catalog')
+    queries_parser.add_argument('--tags', type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        compare(args)
+    elif args.command == 'queries':
+        sys.exit(0 if queries(args) else 1)
+    else:
+        write_settings(args)
+        if args.command == 'generate':
+            generate(args)
+        elif args.command == 'startup':
+            sys.exit(0 if startup(args) else 1)
+        else:
+            print_header()
+            run(args)
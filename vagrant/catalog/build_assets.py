@@ -0,0 +1,51 @@
+"""Script to vendor and build the static assets (see catalog/assets.py)
+
+Usage:
+    python build_assets.py fetch [--force]
+    python build_assets.py build [--clean]
+
+fetch downloads Bootstrap and jQuery into catalog/static/vendor, checking
+their integrity, so that pages don't need to reach any CDN. Commit them, or
+copy them to deployments without internet access. build bundles,
+fingerprints and precompresses the assets into catalog/static/build: run it
+on each deployment, after changing any static file, then restart the app.
+Bundles needing vendored files which haven't been fetched are skipped, and
+pages load those files from the CDN instead."""
+
+import argparse
+import os
+
+from catalog.assets import BUNDLES, fetch_vendor, build, missing_vendor
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'catalog', 'static')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Vendor and build the static assets.')
+    commands = parser.add_subparsers(dest='command')
+    fetch_parser = commands.add_parser('fetch',
+                                       help='Download the vendored files')
+    fetch_parser.add_argument('--force', action='store_true',
+                              help='Download files already present again')
+    build_parser = commands.add_parser('build', help='Build the assets')
+    build_parser.add_argument('--clean', action='store_true',
+                              help='Delete files from earlier builds')
+    args = parser.parse_args()
+
+    if args.command == 'fetch':
+        fetched = fetch_vendor(STATIC_FOLDER, args.force)
+        print "Fetched %d files" % len(fetched)
+    else:
+        manifest = build(STATIC_FOLDER, args.clean)
+        print "Built %d assets" % len(manifest)
+        missing = missing_vendor(STATIC_FOLDER)
+        if missing:
+            skipped = sorted(bundle for bundle in BUNDLES
+                             if bundle not in manifest)
+            print "Not fetched: %s" % ', '.join(missing)
+            if skipped:
+                print "Skipped %s: pages will load their sources, the " \
+                    "vendored ones from the CDN" % ', '.join(skipped)
+            print "Run build_assets.py fetch where there is internet " \
+                "access, and commit catalog/static/vendor"
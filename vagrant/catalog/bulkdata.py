@@ -0,0 +1,65 @@
+"""Script to import and export items in bulk, as CSV or newline delimited
+JSON (ndjson). The format is taken from the file extension unless given.
+
+Usage:
+    python bulkdata.py import FILE [--format F] [--batch-size N]
+                                   [--user-id N] [--checkpoint FILE]
+    python bulkdata.py export FILE [--format F]
+
+Use - as the file to read from stdin or write to stdout. See the bulk
+module for the record format."""
+
+from catalog.database import engine
+from catalog.bulk import (FORMATS, Importer, Checkpoint, read_records,
+                          write_records, export_records)
+import argparse
+import os
+import sys
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Import and export items in bulk.")
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="records per transaction (default 1000)")
+    parser.add_argument('--user-id', type=int, default=1,
+                        help="owner of imported items and new tags, where "
+                             "not given in the file (default 1)")
+    parser.add_argument('--checkpoint',
+                        help="file recording progress, so that an "
+                             "interrupted import can be resumed")
+    args = parser.parse_args()
+    if not args.format:
+        extension = os.path.splitext(args.file)[1].lstrip('.').lower()
+        if extension not in FORMATS:
+            parser.error("can't tell format from file name, use --format")
+        args.format = extension
+    return args
+
+def report_progress(records, rate):
+    sys.stderr.write("Imported %d records (%d records/s)\n" % (records, rate))
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    if args.command == "import":
+        f = sys.stdin if args.file == '-' else open(args.file, 'rb')
+        importer = Importer(engine,
+                            user_id=args.user_id,
+                            batch_size=args.batch_size,
+                            progress=report_progress)
+        checkpoint = None
+        if args.checkpoint:
+            checkpoint = Checkpoint(args.checkpoint, args.file)
+        total = importer.run(read_records(f, args.format), checkpoint)
+        sys.stderr.write("Done. %d records imported in total.\n" % total)
+
+    else:
+        f = sys.stdout if args.file == '-' else open(args.file, 'wb')
+        count = write_records(f, args.format, export_records(engine))
+        if f is not sys.stdout:
+            f.close()
+        sys.stderr.write("Done. %d records exported.\n" % count)
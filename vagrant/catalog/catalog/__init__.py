@@ -3,9 +3,33 @@ app = Flask(__name__, instance_relative_config=True)
 
 app.config.from_object('catalog.config')
 app.config.from_pyfile('config.py')
+# Settings for a particular run (such as the benchmarks) can be given in a
+# file named by the CATALOG_SETTINGS environment variable
+app.config.from_envvar('CATALOG_SETTINGS', silent=True)
+
+# Cache compiled templates on disk
+from .template_cache import cache_templates
+cache_templates(app)
 
 from . import views
 
+# Serve the built static assets
+from .assets import serve_assets
+serve_assets(app)
+
+# Compress responses
+from .compression import compress_responses
+compress_responses(app)
+
 # Allow logging
 from .logging_config import start_logging
-start_logging(app)
\ No newline at end of file
+start_logging(app)
+
+# Record request metrics
+from .metrics import instrument
+instrument(app)
+
+# Profile the SQL run by each request
+from .database import all_engines
+from .profiler import start_profiler
+start_profiler(app, all_engines())
@@ -0,0 +1,89 @@
+"""Views for the admin pages and metrics. Imported when first requested
+(see views.py)."""
+
+from flask import (render_template, abort, request, session, redirect,
+                   url_for, Response)
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+
+from . import app
+from .forms import BlankForm
+from .database import db_session, engine, primary_only
+from .models import User
+from .metrics import render_metrics
+from .profiler import recent_profiles
+from .auth_helpers import login_required, admin_only, forget_user_flags
+
+@primary_only
+@login_required(session)
+@admin_only(session, db_session)
+def admin():
+    users = db_session.query(User).all()
+    return render_template('admin.html', users=users, logged_in=True)
+
+@primary_only
+@login_required(session)
+@admin_only(session, db_session)
+def admin_sql():
+    """View the SQL profiles of the most recent requests"""
+    return render_template('admin_sql.html',
+                            enabled=app.config['SQL_PROFILER_ENABLED'],
+                            profiles=recent_profiles(),
+                            repeat_threshold=
+                                app.config['SQL_PROFILER_REPEAT_THRESHOLD'],
+                            logged_in=True)
+
+@primary_only
+@login_required(session)
+@admin_only(session, db_session)
+def user_activation(user_id):
+    try:
+        user = db_session.query(User).filter_by(id=user_id).one()
+    except (MultipleResultsFound, NoResultFound):
+        # If there are more or less than one items with this name and id,
+        # throw a 404.
+        abort(404)
+
+    # If user is an admin, then you aren't allowed to
+    # activate/deactivate them.
+    if user.admin:
+        abort(403)
+
+    form = BlankForm(request.form, meta={'csrf_context': session})
+
+    # Determine whether form should activate or deactivate user
+    if user.activated:
+        action = "deactivate"
+    else:
+        action = "activate"
+
+    if request.method == 'POST' and form.validate():
+        # Toggle user activation
+        user.activated = not user.activated
+        db_session.commit()
+        forget_user_flags(user.id)
+
+        return redirect(url_for('admin'))
+
+    return render_template('activationform.html',
+                            form=form,
+                            action=action,
+                            user=user,
+                            logged_in=True)
+
+@login_required(session)
+@admin_only(session, db_session)
+def admin_metrics():
+    return metrics_response()
+
+def metrics_response():
+    return Response(render_metrics(engine),
+                    mimetype='text/plain; version=0.0.4')
+
+def metrics():
+    """View request and database pool metrics in the Prometheus text
+    format. Only admins can see them unless METRICS_PUBLIC is set."""
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    if app.config['METRICS_PUBLIC']:
+        return metrics_response()
+    return admin_metrics()
@@ -0,0 +1,310 @@
+"""Static assets: vendored libraries, bundling, fingerprinting and
+precompression.
+
+Bootstrap and jQuery are vendored into static/vendor (fetched once with
+build_assets.py fetch), so pages load without reaching any CDN. The build
+step (build_assets.py build) writes to static/build:
+
+- the BUNDLES, each made by joining its sources, with the url()s in CSS
+  rewritten to point at the built copies of the files they refer to
+- a copy of every other static file
+- gzip (and, if the brotli module is installed, brotli) variants of the
+  compressible files
+
+Built files have a hash of their contents in their names, so they never
+change and can be cached by browsers indefinitely. manifest.json maps each
+source name to its built file. Templates get URLs with asset_url (for a
+single file) and asset_urls (for a bundle). A bundle which hasn't been
+built gives the URLs of its sources instead. Each file which hasn't been
+built falls back to the source file, or for vendored files which haven't
+been fetched, their CDN URL.
+
+The static view serves built files with immutable cache headers, and picks
+a precompressed variant when the client accepts it."""
+
+from io import BytesIO
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import threading
+
+from flask import request, url_for, send_from_directory
+
+
+# Vendored files: (path under static, URL to fetch from, SRI hash or None)
+BOOTSTRAP_CDN = 'https://maxcdn.bootstrapcdn.com/bootstrap/3.3.6/'
+VENDOR = [
+    ('vendor/bootstrap/css/bootstrap.min.css',
+     BOOTSTRAP_CDN + 'css/bootstrap.min.css',
+     'sha384-1q8mTJOASx8j1Au+a5WDVnPi2lkFfwwEAa8hDDdjZlpLegxhjVME1fgjWPGmkzs7'),
+    ('vendor/bootstrap/css/bootstrap-theme.min.css',
+     BOOTSTRAP_CDN + 'css/bootstrap-theme.min.css',
+     'sha384-fLW2N01lMqjakBkx3l/M9EahuwpSfeNvV63J5ezn3uZzapT0u7EYsXMjQV+0En5r'),
+    ('vendor/bootstrap/js/bootstrap.min.js',
+     BOOTSTRAP_CDN + 'js/bootstrap.min.js',
+     'sha384-0mSbJDEHialfmuBBQP6A4Qrprq5OVfW37PRR3j5ELqxss1yVqOtnepnHVP9aJ7xS'),
+    ('vendor/jquery/jquery.min.js',
+     'https://ajax.googleapis.com/ajax/libs/jquery/1.11.3/jquery.min.js',
+     None),
+] + [('vendor/bootstrap/fonts/glyphicons-halflings-regular.' + extension,
+      BOOTSTRAP_CDN + 'fonts/glyphicons-halflings-regular.' + extension,
+      None)
+     for extension in ('eot', 'svg', 'ttf', 'woff', 'woff2')]
+
+# Bundles, by name, with their sources in order
+BUNDLES = {
+    'css/catalog.css': ['vendor/bootstrap/css/bootstrap.min.css',
+                        'vendor/bootstrap/css/bootstrap-theme.min.css',
+                        'css/theme.css'],
+    'js/catalog.js': ['vendor/jquery/jquery.min.js',
+                      'vendor/bootstrap/js/bootstrap.min.js'],
+}
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+# Types worth compressing: the rest (images, web fonts other than these)
+# are compressed already
+COMPRESSIBLE = ('.css', '.js', '.svg', '.eot', '.ttf', '.json', '.txt')
+
+# Precompressed variants, in order of preference: (encoding, extension)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Built files never change, so can be cached for a year
+BUILT_MAX_AGE = 365 * 24 * 3600
+
+
+def integrity(data):
+    """Subresource integrity hash of data"""
+    return 'sha384-' + base64.b64encode(hashlib.sha384(data).digest())
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+# Fetching
+
+def fetch_vendor(static_folder, force=False):
+    """Download the vendored files which are missing (or all of them, with
+    force), checking their integrity. Returns the paths fetched."""
+    import requests
+    fetched = []
+    for path, url, expected in VENDOR:
+        target = os.path.join(static_folder, path)
+        if os.path.exists(target) and not force:
+            continue
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        if expected and integrity(response.content) != expected:
+            raise ValueError('Integrity check failed for %s' % url)
+        _write(target, response.content)
+        fetched.append(path)
+    return fetched
+
+
+def missing_vendor(static_folder):
+    """Paths of the vendored files which haven't been fetched"""
+    return [path for path, url, sri in VENDOR
+            if not os.path.exists(os.path.join(static_folder, path))]
+
+
+# Building
+
+def fingerprinted(name, data):
+    """name with a hash of data added before its extension"""
+    root, extension = posixpath.splitext(name)
+    return '%s.%s%s' % (root, hashlib.md5(data).hexdigest()[:12], extension)
+
+def compress(data):
+    """Returns the precompressed variants of data, by extension, leaving
+    out those which aren't any smaller"""
+    variants = {}
+    buf = BytesIO()
+    # No file name or time, so that builds are repeatable
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0,
+                       compresslevel=9) as f:
+        f.write(data)
+    variants['.gz'] = buf.getvalue()
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants['.br'] = brotli.compress(data)
+    return dict((extension, compressed)
+                for extension, compressed in variants.items()
+                if len(compressed) < len(data))
+
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_SOURCE_MAP = re.compile(r'/\*# sourceMappingURL=[^*]*\*/')
+
+def rewrite_css(data, source, bundle, manifest):
+    """Point the relative url()s in source's CSS at the built files they
+    refer to, relative to where bundle is built"""
+    def replace(match):
+        url = match.group(2)
+        if re.match(r'^(?:[a-z]+:|/|#)', url):
+            return match.group(0)
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        name = posixpath.normpath(posixpath.join(posixpath.dirname(source),
+                                                 path))
+        if name not in manifest:
+            return match.group(0)
+        relative = posixpath.relpath(
+            manifest[name], posixpath.dirname(posixpath.join(BUILD_DIR,
+                                                             bundle)))
+        return 'url(%s%s)' % (relative, suffix)
+    return _CSS_URL.sub(replace, _SOURCE_MAP.sub('', data))
+
+def source_files(static_folder):
+    """Names of the files under static_folder, other than built ones"""
+    for directory, dirnames, filenames in os.walk(static_folder):
+        relative = os.path.relpath(directory, static_folder)
+        if relative == BUILD_DIR:
+            dirnames[:] = []
+            continue
+        for filename in filenames:
+            name = posixpath.normpath(posixpath.join(
+                relative.replace(os.sep, '/'), filename))
+            yield name
+
+def build(static_folder, clean=False):
+    """Build every asset, writing the manifest last so that files are in
+    place before pages refer to them. Bundles with missing sources (vendored
+    files which haven't been fetched) are skipped. Files from earlier builds
+    are kept, for pages still referring to them, unless clean is set.
+    Returns the manifest."""
+    build_folder = os.path.join(static_folder, BUILD_DIR)
+    if clean and os.path.isdir(build_folder):
+        shutil.rmtree(build_folder)
+
+    manifest = {}
+
+    def emit(name, data):
+        built = posixpath.join(BUILD_DIR, fingerprinted(name, data))
+        target = os.path.join(static_folder, built)
+        if not os.path.exists(target):
+            _write(target, data)
+            if name.endswith(COMPRESSIBLE):
+                for extension, compressed in compress(data).items():
+                    _write(target + extension, compressed)
+        manifest[name] = built
+
+    # Single files first, so that bundled CSS can refer to them
+    for name in sorted(source_files(static_folder)):
+        emit(name, _read(os.path.join(static_folder, name)))
+
+    for bundle, sources in sorted(BUNDLES.items()):
+        missing = [source for source in sources
+                   if not os.path.exists(os.path.join(static_folder, source))]
+        if missing:
+            # Left out of the manifest, so pages use its sources, from the
+            # CDN where they haven't been fetched
+            continue
+        parts = []
+        for source in sources:
+            data = _read(os.path.join(static_folder, source))
+            if bundle.endswith('.css'):
+                data = rewrite_css(data, source, bundle, manifest)
+            parts.append(data.rstrip())
+        # Semicolons keep scripts which don't end with one separate
+        separator = '\n;\n' if bundle.endswith('.js') else '\n'
+        emit(bundle, separator.join(parts) + '\n')
+
+    data = json.dumps(manifest, indent=2, sort_keys=True)
+    temporary = os.path.join(build_folder, MANIFEST + '.tmp')
+    _write(temporary, data)
+    os.rename(temporary, os.path.join(build_folder, MANIFEST))
+    return manifest
+
+
+# Serving
+
+_manifest = [None]
+_manifest_lock = threading.Lock()
+
+def get_manifest(app):
+    """Returns the build manifest, loaded once per process, or an empty one
+    if the assets haven't been built or ASSETS_USE_BUILD is off"""
+    if _manifest[0] is None:
+        with _manifest_lock:
+            if _manifest[0] is None:
+                manifest = {}
+                path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+                if app.config['ASSETS_USE_BUILD'] and os.path.exists(path):
+                    with open(path) as f:
+                        manifest = json.load(f)
+                _manifest[0] = manifest
+    return _manifest[0]
+
+def serve_assets(app):
+    """Add the asset_url and asset_urls template functions, and serve built
+    files with immutable caching and precompression"""
+    vendor_urls = dict((path, (url, sri)) for path, url, sri in VENDOR)
+
+    def source_url(name):
+        """(URL, SRI hash) for a static file: its built copy if it has one,
+        otherwise the file itself, or its CDN URL if it is vendored but
+        hasn't been fetched"""
+        built = get_manifest(app).get(name)
+        if built is not None:
+            return url_for('static', filename=built), None
+        if name in vendor_urls and not os.path.exists(
+                os.path.join(app.static_folder, name)):
+            return vendor_urls[name]
+        return url_for('static', filename=name), None
+
+    @app.template_global()
+    def asset_url(name):
+        """URL of a static file"""
+        return source_url(name)[0]
+
+    @app.template_global()
+    def asset_urls(bundle):
+        """(URL, SRI hash or None) for the built bundle, or for each of its
+        sources (built separately where they can be) if it hasn't been
+        built"""
+        built = get_manifest(app).get(bundle)
+        if built is not None:
+            return [(url_for('static', filename=built), None)]
+        return [source_url(name) for name in BUNDLES[bundle]]
+
+    def static(filename):
+        if not filename.startswith(BUILD_DIR + '/'):
+            return app.send_static_file(filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = None
+        for encoding, extension in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(
+                    os.path.join(app.static_folder, filename + extension)):
+                response = send_from_directory(app.static_folder,
+                                               filename + extension,
+                                               mimetype=mimetype,
+                                               cache_timeout=BUILT_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(app.static_folder, filename,
+                                           mimetype=mimetype,
+                                           cache_timeout=BUILT_MAX_AGE)
+        if filename.endswith(COMPRESSIBLE):
+            response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = (
+            'public, max-age=%d, immutable' % BUILT_MAX_AGE)
+        return response
+
+    app.view_functions['static'] = static
@@ -1,10 +1,70 @@
+from collections import namedtuple
 from functools import wraps
-from flask import url_for, redirect, url_for, request, abort
+import threading
+import time
+from flask import url_for, redirect, url_for, request, abort, g, current_app
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from urlparse import urlparse, urljoin
 
 from models import User, Tag, Item
 
+# Current user
+
+# The parts of the logged in user needed to decide what they can do. Views
+# pass this to templates as user, as it has the same attributes they use.
+UserFlags = namedtuple('UserFlags', ['id', 'activated', 'admin'])
+
+# Process wide cache of UserFlags by user id, holding (expiry time, flags)
+_user_flags_cache = {}
+_user_flags_lock = threading.Lock()
+
+def get_current_user(login_session, db_session):
+    """Returns the logged in User, or None if not logged in. The user is
+    only loaded from the database once per request."""
+    user_id = login_session.get('user_id')
+    if user_id is None:
+        return None
+    user = g.get('current_user')
+    if user is None or user.id != user_id:
+        user = db_session.query(User).filter_by(id=user_id).one()
+        g.current_user = user
+    return user
+
+def get_current_user_flags(login_session, db_session):
+    """Returns the activation and admin flags of the logged in user, or None
+    if not logged in. If USER_FLAGS_CACHE_TTL is set, the flags are cached
+    for that many seconds, so most requests don't need to query the user
+    at all."""
+    user_id = login_session.get('user_id')
+    if user_id is None:
+        return None
+    flags = g.get('current_user_flags')
+    if flags is not None and flags.id == user_id:
+        return flags
+
+    ttl = current_app.config['USER_FLAGS_CACHE_TTL']
+    now = time.time()
+    if ttl:
+        with _user_flags_lock:
+            expires, flags = _user_flags_cache.get(user_id, (0, None))
+        if expires <= now:
+            flags = None
+
+    if flags is None:
+        user = get_current_user(login_session, db_session)
+        flags = UserFlags(user.id, user.activated, user.admin)
+        if ttl:
+            with _user_flags_lock:
+                _user_flags_cache[user_id] = (now + ttl, flags)
+
+    g.current_user_flags = flags
+    return flags
+
+def forget_user_flags(user_id):
+    """Remove a user's flags from the cache, for when they have changed"""
+    with _user_flags_lock:
+        _user_flags_cache.pop(user_id, None)
+
 # Decorators
 
 def login_required(login_session):
@@ -24,8 +84,7 @@ def activated_user_required(login_session, db_session):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            logged_in_user_id = login_session['user_id']
-            logged_in_user = db_session.query(User).filter_by(id=logged_in_user_id).one()
+            logged_in_user = get_current_user_flags(login_session, db_session)
 
             # Check if user is activated and throw 403 if not
             if logged_in_user.activated:
@@ -45,7 +104,7 @@ def owner_only(login_session, db_session, object_class):
             logged_in_user_id = login_session['user_id']
             
             # Check if admin, in which case let through
-            logged_in_user = db_session.query(User).filter_by(id=logged_in_user_id).one()
+            logged_in_user = get_current_user_flags(login_session, db_session)
             if logged_in_user.admin:
                 return f(*args, **kwargs)
 
@@ -75,10 +134,8 @@ def admin_only(login_session, db_session):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            logged_in_user_id = login_session['user_id']
-            
             # Check if admin, in which case let through
-            logged_in_user = db_session.query(User).filter_by(id=logged_in_user_id).one()
+            logged_in_user = get_current_user_flags(login_session, db_session)
             if logged_in_user.admin:
                 return f(*args, **kwargs)
             else:
@@ -0,0 +1,97 @@
+"""Views for logging in and out. Imported when first requested (see
+views.py), along with the HTTP client used to verify logins."""
+
+import json
+
+from flask import (render_template, request, session, url_for, flash,
+                   make_response)
+
+from . import app
+from .forms import LoginCSRFForm
+from .database import db_session
+from .models import User
+from .oauth import identity_provider, OAuthError
+from .auth_helpers import login_required, make_url_relative
+
+def json_response(data, status=200):
+    response = make_response(json.dumps(data), status)
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+def showLogin():
+    next = request.values.get('next')
+    if not next:
+        next = request.referrer
+    if not next:
+        next = url_for('index')
+    next = make_url_relative(next)
+    form = LoginCSRFForm(request.form, meta={'csrf_context': session})
+    provider = identity_provider()
+    return render_template('login.html',
+                            form=form,
+                            next=next,
+                            provider=provider.name,
+                            client_id=provider.client_id)
+
+@login_required(session)
+def showLogout():
+    return render_template('logout.html')
+
+def gconnect():
+    """View to log in using Google's Oauth2 service (or the local stand-in
+    identity provider)"""
+    form = LoginCSRFForm(request.form, meta={'csrf_context': session})
+    form.validate()
+    if form.csrf_token.errors:
+        app.logger.warning("CSRF error detected at login")
+        return json_response('Invalid CSRF token', 401)
+    try:
+        identity = identity_provider().verify(form.code.data)
+    except OAuthError as e:
+        app.logger.warning("Login failed: {}".format(e.message))
+        return json_response(e.message, e.status)
+
+    stored_credentials = session.get('access_token')
+    stored_gplus_id = session.get('gplus_id')
+    if stored_credentials is not None and identity.subject == stored_gplus_id:
+        return json_response('Current user is already connected.')
+
+    # Store the access token in the session for later use.
+    session['access_token'] = identity.access_token
+    session['gplus_id'] = identity.subject
+    session['username'] = identity.name
+    session['picture'] = identity.picture
+    session['email'] = identity.email
+
+    # See if user exists in database, otherwise add them
+    user_id = User.getIDByEmail(session['email'], db_session)
+    if not user_id:
+        user_id = User.createForID(session, db_session)
+    session['user_id'] = user_id
+
+    output = ''
+    output += 'Welcome'
+    if session['username']:
+        output += ', '
+        output += session['username']
+    output += '.'
+    flash("you are now logged in as %s" % session['username'])
+    return json_response(output)
+
+
+def gdisconnect():
+    access_token = session.get('access_token')
+    if access_token is None:
+        return json_response('Current user not connected.', 401)
+    try:
+        revoked = identity_provider().revoke(access_token)
+    except OAuthError as e:
+        app.logger.warning("Failed to revoke token: {}".format(e.message))
+        revoked = False
+    if revoked:
+        for key in ('access_token', 'gplus_id', 'username', 'email',
+                    'picture', 'user_id'):
+            session.pop(key, None)
+        return json_response('Successfully disconnected.')
+    else:
+        return json_response('Failed to revoke token for given user.', 400)
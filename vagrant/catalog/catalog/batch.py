@@ -0,0 +1,217 @@
+"""Applying batches of item create, update and delete operations, for the
+batch JSON API.
+
+A batch is a list of operations, each a dict with an 'op' of 'create',
+'update' or 'delete'. Creates and updates take the ItemForm fields (name,
+description, picture_url and tags, a list of tag ids), and updates and
+deletes take the id of the item. Updates only change the fields given.
+
+Every operation is validated with the same rules as the item forms, and
+the tags and items they refer to are each loaded in a single query. The
+operations are only applied if they are all valid, and then in a single
+transaction."""
+
+from sqlalchemy.orm import selectinload
+from werkzeug.datastructures import MultiDict
+
+from .cache import invalidate, item_namespaces
+from .forms import ItemForm
+from .models import Item, Tag
+
+OPERATIONS = ('create', 'update', 'delete')
+ITEM_FIELDS = ('name', 'description', 'picture_url')
+
+
+class BatchError(Exception):
+    """Raised when a batch as a whole is malformed"""
+    pass
+
+
+def _tag_ids(operation):
+    tags = operation.get('tags')
+    if not isinstance(tags, list):
+        return []
+    try:
+        return [int(tag_id) for tag_id in tags]
+    except (TypeError, ValueError):
+        return []
+
+def _item_id(operation):
+    try:
+        return int(operation['id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _type_errors(operation):
+    """Errors for fields of a create or update which aren't of the right
+    type for ItemForm to validate: a string (or null) for the item fields
+    and a list for tags"""
+    errors = {}
+    for field in ITEM_FIELDS:
+        value = operation.get(field)
+        if value is not None and not isinstance(value, basestring):
+            errors[field] = ['Must be a string']
+    tags = operation.get('tags')
+    if tags is not None and not isinstance(tags, list):
+        errors['tags'] = ['Must be a list of tag ids']
+    return errors
+
+def _validate_fields(operation, item, tags):
+    """Validate the item fields of a create or update with ItemForm,
+    falling back to the item's current values for fields not given.
+    Tag ids given more than once are only kept once. Returns the form."""
+    data = MultiDict()
+    for field in ITEM_FIELDS:
+        if field in operation:
+            value = operation[field]
+        else:
+            value = getattr(item, field, None) if item else None
+        data[field] = value if value is not None else u''
+    if 'tags' in operation:
+        tag_ids = [unicode(tag_id) for tag_id in operation['tags'] or []]
+    else:
+        tag_ids = [unicode(tag.id) for tag in item.tags] if item else []
+    unique_ids = []
+    for tag_id in tag_ids:
+        if tag_id not in unique_ids:
+            unique_ids.append(tag_id)
+    data.setlist('tags', unique_ids)
+
+    form = ItemForm(data, meta={'csrf': False})
+    form.tags.choices = [(unicode(tag.id), tag.name) for tag in tags]
+    form.validate()
+    return form
+
+
+class Batch(object):
+    """A batch of operations, made on behalf of a user. user is the user's
+    UserFlags, as returned by get_current_user_flags."""
+
+    def __init__(self, db_session, operations, user, max_operations):
+        if not isinstance(operations, list) or not operations:
+            raise BatchError('operations must be a non-empty list')
+        if len(operations) > max_operations:
+            raise BatchError('At most %d operations are allowed per batch'
+                             % max_operations)
+        if not all(isinstance(operation, dict) for operation in operations):
+            raise BatchError('Each operation must be an object')
+        self.db_session = db_session
+        self.operations = operations
+        self.user = user
+
+    def _load(self):
+        """Load every item the operations refer to, along with its tags, and
+        every other tag they refer to, in one query each. The items' current
+        tags are needed to validate updates which leave out tags."""
+        tag_ids = set()
+        item_ids = set()
+        for operation in self.operations:
+            tag_ids.update(_tag_ids(operation))
+            if operation.get('op') in ('update', 'delete'):
+                item_ids.add(_item_id(operation))
+        item_ids.discard(None)
+
+        items = {}
+        if item_ids:
+            items = dict((item.id, item) for item in
+                         self.db_session.query(Item)
+                                        .options(selectinload(Item.tags))
+                                        .filter(Item.id.in_(item_ids)))
+        tags = dict((tag.id, tag) for item in items.values()
+                    for tag in item.tags)
+        tag_ids.difference_update(tags)
+        if tag_ids:
+            tags.update((tag.id, tag) for tag in
+                        self.db_session.query(Tag)
+                                       .filter(Tag.id.in_(tag_ids)))
+        return tags, items
+
+    def _check_item(self, operation, items, deleted):
+        """Returns (item, error) for an update or delete"""
+        item_id = _item_id(operation)
+        item = items.get(item_id)
+        if item is None or item_id in deleted:
+            return None, 'Item not found'
+        if item.user_id != self.user.id and not self.user.admin:
+            return None, 'Not the owner of this item'
+        return item, None
+
+    def apply(self):
+        """Validate the operations and, if they are all valid, apply them and
+        commit. Returns (success, results), where results holds a dict for
+        each operation, in order."""
+        tags, items = self._load()
+        results = []
+        changes = []
+        deleted = set()
+
+        for index, operation in enumerate(self.operations):
+            op = operation.get('op')
+            result = {'index': index, 'op': op}
+            results.append(result)
+            if op not in OPERATIONS:
+                result['errors'] = {'op': ['Must be one of: %s'
+                                           % ', '.join(OPERATIONS)]}
+                continue
+
+            item = None
+            if op != 'create':
+                item, error = self._check_item(operation, items, deleted)
+                result['id'] = _item_id(operation)
+                if error:
+                    result['errors'] = {'id': [error]}
+                    continue
+            if op == 'delete':
+                deleted.add(item.id)
+                changes.append((result, op, item, None))
+                continue
+
+            errors = _type_errors(operation)
+            if errors:
+                result['errors'] = errors
+                continue
+            form = _validate_fields(operation, item, tags.values())
+            if form.errors:
+                result['errors'] = form.errors
+                continue
+            changes.append((result, op, item, form))
+
+        if any('errors' in result for result in results):
+            for result in results:
+                if 'errors' not in result:
+                    result['status'] = 'not applied'
+                else:
+                    result['status'] = 'invalid'
+            return False, results
+
+        stale_pages = []
+        new_items = []
+        changed_items = []
+        for result, op, item, form in changes:
+            if op == 'delete':
+                stale_pages.extend(item_namespaces(item))
+                self.db_session.delete(item)
+                result['status'] = 'deleted'
+                continue
+            if op == 'create':
+                item = Item(user_id=self.user.id)
+                self.db_session.add(item)
+                new_items.append((result, item))
+                result['status'] = 'created'
+            else:
+                stale_pages.extend(item_namespaces(item))
+                result['status'] = 'updated'
+            item.name = form.name.data
+            item.description = form.description.data
+            item.picture_url = form.picture_url.data
+            item.tags = [tags[int(tag_id)] for tag_id in form.tags.data]
+            changed_items.append(item)
+
+        self.db_session.flush()
+        for result, item in new_items:
+            result['id'] = item.id
+        for item in changed_items:
+            stale_pages.extend(item_namespaces(item))
+        self.db_session.commit()
+        invalidate(*stale_pages)
+        return True, results
@@ -0,0 +1,330 @@
+"""Bulk import and export of items, as CSV or newline delimited JSON.
+
+Imports bypass the ORM: rows are inserted with executemany in batches, one
+transaction per batch, with tag names resolved through an in-memory map of
+tag name to id. Item and tag ids are allocated up front, so that the
+item_tag rows can be inserted in the same way. After each batch is
+committed, the number of rows done is written to an optional checkpoint
+file, so an interrupted import can be resumed where it left off. Just
+before the commit, the batch is recorded in the checkpoint as pending, so
+that if the import stops in between, resuming can tell from the database
+whether the batch was committed, rather than importing it twice.
+
+Imports assume nothing else is creating items or tags at the same time.
+
+Each record holds an item's name, description, picture_url and a list of
+tag names, and optionally its id, user_id, created_on and updated_on.
+Exports write the same records, in id order, so that an export can be
+imported into an empty database to copy a catalog."""
+
+import csv
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+
+from .models import Item, Tag, CatalogMeta, association_table
+from .search import index_items
+from .counters import apply_counts
+
+FORMATS = ('ndjson', 'csv')
+CSV_FIELDS = ['id', 'name', 'description', 'picture_url', 'user_id',
+              'created_on', 'updated_on', 'tags']
+# Separates tag names within the tags column of CSV files
+CSV_TAG_SEPARATOR = '|'
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+# Reading and writing records
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    return datetime.strptime(value[:19], DATETIME_FORMAT)
+
+def _format_datetime(value):
+    if value is None:
+        return None
+    return value.strftime(DATETIME_FORMAT)
+
+def read_records(f, format):
+    """Yield records from an open file in the given format"""
+    if format == 'ndjson':
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    elif format == 'csv':
+        for row in csv.DictReader(f):
+            record = dict((key, value.decode('utf-8'))
+                          for key, value in row.items()
+                          if key and value)
+            record['tags'] = [name for name in
+                              record.get('tags', u'').split(CSV_TAG_SEPARATOR)
+                              if name]
+            yield record
+    else:
+        raise ValueError('Unknown format: %r' % format)
+
+def write_records(f, format, records):
+    """Write records to an open file in the given format. Returns the
+    number written."""
+    count = 0
+    if format == 'ndjson':
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+            count += 1
+    elif format == 'csv':
+        writer = csv.DictWriter(f, CSV_FIELDS)
+        writer.writeheader()
+        for record in records:
+            record = dict(record,
+                          tags=CSV_TAG_SEPARATOR.join(record['tags']))
+            writer.writerow(dict(
+                (key, value.encode('utf-8')
+                      if isinstance(value, unicode) else value)
+                for key, value in record.items()))
+            count += 1
+    else:
+        raise ValueError('Unknown format: %r' % format)
+    return count
+
+
+# Export
+
+def export_records(engine, batch_size=1000):
+    """Yield a record for every item, in id order, reading batch_size items
+    at a time"""
+    items = Item.__table__
+    tags = Tag.__table__
+    last_id = 0
+    with engine.connect() as connection:
+        while True:
+            rows = connection.execute(
+                items.select().where(items.c.id > last_id)
+                              .order_by(items.c.id)
+                              .limit(batch_size)).fetchall()
+            if not rows:
+                return
+            ids = [row.id for row in rows]
+            tag_names = dict((item_id, []) for item_id in ids)
+            for link in connection.execute(
+                    select([association_table.c.item_id, tags.c.name])
+                        .select_from(association_table.join(tags))
+                        .where(association_table.c.item_id.in_(ids))
+                        .order_by(association_table.c.item_id,
+                                  tags.c.name)):
+                tag_names[link.item_id].append(link.name)
+            for row in rows:
+                yield {
+                    'id': row.id,
+                    'name': row.name,
+                    'description': row.description,
+                    'picture_url': row.picture_url,
+                    'user_id': row.user_id,
+                    'created_on': _format_datetime(row.created_on),
+                    'updated_on': _format_datetime(row.updated_on),
+                    'tags': tag_names[row.id],
+                }
+            last_id = ids[-1]
+
+
+# Import
+
+class BulkImportError(Exception):
+    pass
+
+
+def _highest_item_id(connection):
+    """Returns the highest item id ever allocated, counting deleted items,
+    whose ids mustn't be reused (see the feeds module)"""
+    highest = connection.execute(
+        select([func.max(Item.__table__.c.id)])).scalar() or 0
+    if connection.dialect.name == 'sqlite':
+        allocated = connection.execute(text(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'item'")).scalar()
+    elif connection.dialect.name == 'postgresql':
+        allocated = connection.execute(text(
+            "SELECT pg_sequence_last_value("
+            "pg_get_serial_sequence('item', 'id')::regclass)")).scalar()
+    else:
+        allocated = None
+    return max(highest, allocated or 0)
+
+
+class Checkpoint(object):
+    """Records how many records of a source file have been imported"""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+
+    def load(self, committed):
+        """Returns the number of records already imported from the source.
+        If a batch was pending, committed is called with the id of its
+        first item, and should return whether that item exists."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            data = json.load(f)
+        if data['source'] != self.source:
+            raise BulkImportError(
+                'Checkpoint %s is for a different file: %s'
+                % (self.path, data['source']))
+        pending = data.get('pending')
+        if pending and committed(pending['item_id']):
+            return pending['records']
+        return data['records']
+
+    def save(self, records, pending=None):
+        """Record that records have been imported, and optionally, as a
+        (records, first item id) tuple, a batch about to be committed"""
+        if not self.path:
+            return
+        data = {'source': self.source, 'records': records}
+        if pending:
+            data['pending'] = {'records': pending[0], 'item_id': pending[1]}
+        # Write then rename, so the checkpoint is never left half written
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.rename(temp_path, self.path)
+
+
+class Importer(object):
+    """Imports records in batches. Tags which don't exist yet are created,
+    owned by user_id, as are items without a user_id of their own."""
+
+    def __init__(self, engine, user_id=1, batch_size=1000, progress=None):
+        self.engine = engine
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.progress = progress
+        self.tag_ids = {}
+        self.next_item_id = self.next_tag_id = 1
+
+    def _load_state(self):
+        """Load the tag name map and find the next free ids"""
+        tags = Tag.__table__
+        with self.engine.connect() as connection:
+            self.tag_ids = dict(
+                (row.name, row.id) for row in
+                connection.execute(select([tags.c.name, tags.c.id])))
+            self.next_tag_id = (connection.execute(
+                select([func.max(tags.c.id)])).scalar() or 0) + 1
+            self.next_item_id = _highest_item_id(connection) + 1
+
+    def _tag_id(self, name, new_tags):
+        tag_id = self.tag_ids.get(name)
+        if tag_id is None:
+            tag_id = self.tag_ids[name] = self.next_tag_id
+            self.next_tag_id += 1
+            new_tags.append({'id': tag_id, 'name': name,
+                             'user_id': self.user_id})
+        return tag_id
+
+    def _item_exists(self, item_id):
+        items = Item.__table__
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select([items.c.id]).where(items.c.id == item_id)).first() \
+                is not None
+
+    def _insert_batch(self, records, before_commit=None):
+        """Insert a batch of records in a single transaction. before_commit
+        is called with the id of the first item inserted, just before the
+        transaction is committed."""
+        now = datetime.utcnow().replace(microsecond=0)
+        items, links, new_tags = [], [], []
+        for record in records:
+            if not record.get('name'):
+                raise BulkImportError('Record without a name: %r'
+                                      % (record,))
+            item_id = record.get('id')
+            if item_id:
+                item_id = int(item_id)
+            else:
+                item_id = self.next_item_id
+            self.next_item_id = max(self.next_item_id, item_id + 1)
+            items.append({
+                'id': item_id,
+                'name': record['name'],
+                'description': record.get('description'),
+                'picture_url': record.get('picture_url'),
+                'user_id': int(record.get('user_id') or self.user_id),
+                'created_on': _parse_datetime(record.get('created_on')) or now,
+                'updated_on': _parse_datetime(record.get('updated_on')) or now,
+            })
+            for tag_id in set(self._tag_id(name, new_tags)
+                              for name in record.get('tags', [])):
+                links.append({'item_id': item_id, 'tag_id': tag_id})
+
+        with self.engine.begin() as connection:
+            if new_tags:
+                connection.execute(Tag.__table__.insert(), new_tags)
+            connection.execute(Item.__table__.insert(), items)
+            if links:
+                connection.execute(association_table.insert(), links)
+            index_items(connection, [item['id'] for item in items])
+            apply_counts(connection,
+                         Counter(link['tag_id'] for link in links),
+                         Counter(item['user_id'] for item in items),
+                         items=len(items),
+                         tags=len(new_tags))
+            connection.execute(
+                CatalogMeta.__table__.update()
+                    .values(version=CatalogMeta.version + 1,
+                            updated_on=func.now()))
+            if before_commit:
+                before_commit(items[0]['id'])
+
+    def _fix_sequences(self):
+        """Move Postgres' id sequences past the ids we have allocated,
+        never back"""
+        if self.engine.dialect.name != 'postgresql':
+            return
+        with self.engine.begin() as connection:
+            for table in ('item', 'tag'):
+                connection.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                    "GREATEST((SELECT max(id) FROM %s), COALESCE("
+                    "pg_sequence_last_value(pg_get_serial_sequence("
+                    "'%s', 'id')::regclass), 1)))" % (table, table, table)))
+
+    def run(self, records, checkpoint=None):
+        """Import records, skipping any already imported according to the
+        checkpoint. Returns the total number of records imported."""
+        self._load_state()
+        done = checkpoint.load(self._item_exists) if checkpoint else 0
+        start = time.time()
+        imported = 0
+        batch = []
+
+        def flush():
+            before_commit = None
+            if checkpoint:
+                before_commit = lambda item_id: checkpoint.save(
+                    done + imported - len(batch), (done + imported, item_id))
+            self._insert_batch(batch, before_commit)
+            del batch[:]
+            if checkpoint:
+                checkpoint.save(done + imported)
+            if self.progress:
+                elapsed = time.time() - start
+                self.progress(done + imported,
+                              imported / elapsed if elapsed else 0)
+
+        for index, record in enumerate(records):
+            if index < done:
+                continue
+            batch.append(record)
+            imported += 1
+            if len(batch) >= self.batch_size:
+                flush()
+        if batch:
+            flush()
+
+        self._fix_sequences()
+        return done + imported
@@ -0,0 +1,225 @@
+"""Cache for rendered pages.
+
+Pages are cached under keys made from the view, the request path, who is
+looking at the page, and the current version of each namespace the page
+depends on. Namespaces are named after the data a page shows, e.g.
+'catalog' for the index page, 'tag:Books' for a tag page and 'item:3' for
+an item page. Invalidating a namespace just throws away its version, so a
+new one is made the next time it is needed and every page depending on it
+misses the cache. This works the same way with any backend, and stale
+pages simply age out."""
+
+from collections import OrderedDict
+from functools import wraps
+import threading
+import time
+import uuid
+
+from flask import request
+
+from . import app
+from .database import use_primary
+from .models import Tag, association_table
+
+
+# Backends
+
+# Every backend has the same methods: get(key) returns the value stored
+# under key, or None if it is missing, set(key, value, ttl=None) stores it,
+# for ttl seconds if given, and delete(key) and clear() remove one or every
+# value. Values are unicode strings.
+
+class NullCache(object):
+    """Backend which stores nothing, for disabling the cache"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(object):
+    """Thread-safe in-process cache, holding at most max_entries values and
+    discarding the least recently used first. Each process has its own, so
+    other processes only see invalidations once their entries expire."""
+
+    def __init__(self, max_entries=1000, default_ttl=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires is not None and expires <= time.time():
+                return None
+            # Move to the most recently used end
+            self._entries[key] = (expires, value)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.default_ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache(object):
+    """Cache shared between processes and hosts, stored in Redis"""
+
+    def __init__(self, url, default_ttl=None, prefix='catalog:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return value.decode('utf-8')
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.default_ttl
+        value = value.encode('utf-8')
+        if ttl:
+            self.client.setex(self.prefix + key, ttl, value)
+        else:
+            self.client.set(self.prefix + key, value)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = self.client.keys(self.prefix + '*')
+        if keys:
+            self.client.delete(*keys)
+
+
+def make_cache(config):
+    """Create the page cache backend selected in the config"""
+    backend = config['PAGE_CACHE_BACKEND']
+    ttl = config['PAGE_CACHE_TTL']
+    if backend == 'memory':
+        return LRUCache(config['PAGE_CACHE_MAX_ENTRIES'], ttl)
+    if backend == 'redis':
+        return RedisCache(config['PAGE_CACHE_REDIS_URL'], ttl)
+    if backend in (None, 'none'):
+        return NullCache()
+    raise ValueError('Unknown PAGE_CACHE_BACKEND: %r' % backend)
+
+page_cache = make_cache(app.config)
+
+
+# Namespaces
+
+def namespace_version(namespace):
+    """Returns the current version of a namespace, making a new one if it
+    has none. Versions end with the time they were made."""
+    key = 'ns:' + namespace
+    version = page_cache.get(key)
+    if version is None:
+        version = u'%s-%d' % (uuid.uuid4().hex[:12], time.time())
+        page_cache.set(key, version, ttl=0)
+    return version
+
+def made_since(version, seconds):
+    """Whether a namespace version was made in the last seconds seconds,
+    and so may follow an invalidation the read replicas haven't caught up
+    with"""
+    try:
+        made = int(version.rsplit('-', 1)[1])
+    except (IndexError, ValueError):
+        return False
+    return made > time.time() - seconds
+
+def invalidate(*namespaces):
+    """Invalidate every cached page depending on any of the namespaces"""
+    for namespace in set(namespaces):
+        page_cache.delete('ns:' + namespace)
+
+def item_namespaces(item):
+    """Namespaces of the pages showing an item: its own page, the index,
+    and the pages of its tags"""
+    return (['catalog', 'item:%s' % item.id] +
+            ['tag:' + tag.name for tag in item.tags])
+
+def tag_namespaces(db_session, tag):
+    """Namespaces of the pages showing a tag: the index, its own page, and
+    the pages of its items, along with the pages of their other tags, which
+    show links to it. Found with two queries on the item_tag table, rather
+    than by loading the items, as a tag can have any number of them."""
+    item_ids = db_session.query(association_table.c.item_id) \
+                         .filter(association_table.c.tag_id == tag.id)
+    tag_names = db_session.query(Tag.name).distinct() \
+                          .join(association_table,
+                                association_table.c.tag_id == Tag.id) \
+                          .filter(association_table.c.item_id.in_(
+                              item_ids.subquery()))
+    namespaces = ['catalog', 'tag:' + tag.name]
+    namespaces.extend('item:%s' % item_id for (item_id,) in item_ids)
+    namespaces.extend('tag:' + name for (name,) in tag_names)
+    return namespaces
+
+
+# Decorator
+
+def cached_page(namespaces, user_variant):
+    """Decorator to cache the page rendered by a view. namespaces is called
+    with the view's arguments, and returns the namespaces the page depends
+    on. user_variant is called with no arguments and returns a string
+    identifying how the page varies for the logged in user. Only GET
+    requests which render successfully are cached.
+
+    Pages are rendered from the primary database for DB_REPLICA_STALENESS
+    seconds after any of their namespaces is invalidated, so that a page
+    read from a replica which hasn't caught up isn't cached as the new
+    version."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+
+            versions = [namespace_version(namespace)
+                        for namespace in namespaces(*args, **kwargs)]
+            key = 'page:%s:%s:%s:%s' % (request.endpoint,
+                                        request.full_path,
+                                        user_variant(),
+                                        '.'.join(versions))
+            page = page_cache.get(key)
+            if page is None:
+                staleness = app.config['DB_REPLICA_STALENESS']
+                if any(made_since(version, staleness)
+                       for version in versions):
+                    use_primary()
+                page = f(*args, **kwargs)
+                if isinstance(page, basestring):
+                    page_cache.set(key, page)
+            return page
+        return decorated_function
+    return decorator
@@ -0,0 +1,52 @@
+"""Tracking of changes to the catalog.
+
+Whenever a flush adds, changes or deletes an item or tag, the version in
+the catalog_meta table is increased in the same transaction. Readers can
+then tell whether anything has changed with a single primary key lookup."""
+
+from sqlalchemy import event, func
+
+from .database import DBSession
+from .models import Item, Tag, CatalogMeta
+
+CATALOG_META_ID = 1
+
+def catalog_changed(session):
+    """Returns True if the pending changes in session touch any item or
+    tag"""
+    for obj in session.new:
+        if isinstance(obj, (Item, Tag)):
+            return True
+    for obj in session.deleted:
+        if isinstance(obj, (Item, Tag)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, (Item, Tag)) and session.is_modified(obj):
+            return True
+    return False
+
+@event.listens_for(DBSession, 'before_flush')
+def bump_catalog_version(session, flush_context, instances):
+    if catalog_changed(session):
+        session.execute(
+            CatalogMeta.__table__.update()
+                .where(CatalogMeta.id == CATALOG_META_ID)
+                .values(version=CatalogMeta.version + 1,
+                        updated_on=func.now()))
+
+def seed_catalog_meta(connection):
+    """Insert the catalog_meta row if it doesn't exist yet"""
+    table = CatalogMeta.__table__
+    exists = connection.execute(
+        table.select().where(table.c.id == CATALOG_META_ID)).first()
+    if exists is None:
+        connection.execute(table.insert().values(id=CATALOG_META_ID,
+                                                 version=0))
+
+def get_catalog_version(db_session):
+    """Returns a (version, updated_on) tuple for the catalog"""
+    row = db_session.query(CatalogMeta.version, CatalogMeta.updated_on) \
+                    .filter(CatalogMeta.id == CATALOG_META_ID).first()
+    if row is None:
+        return 0, None
+    return row.version, row.updated_on
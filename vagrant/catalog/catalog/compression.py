@@ -0,0 +1,140 @@
+"""Compression of dynamic responses.
+
+HTML, JSON, Atom and other text responses of at least COMPRESS_MIN_SIZE
+bytes are compressed with brotli (if the brotli module is installed) or
+gzip, whichever the client prefers. Streamed responses are compressed as
+they are sent.
+
+Compressing the same body again for every polling client would waste most
+of the time compression takes, so compressed bodies are kept in a cache,
+bounded by COMPRESS_CACHE_MAX_BYTES. Entries are keyed by the response's
+ETag when it has one, so they are replaced when the catalog changes, or
+otherwise by a hash of the body. The weak ETags from the conditional module
+stay the same for every encoding, so 304 responses work as before."""
+
+from collections import OrderedDict
+import hashlib
+import threading
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressedCache(object):
+    """Thread safe LRU cache of compressed bodies, holding at most
+    max_bytes of them"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                key, old = self._entries.popitem(last=False)
+                self.size -= len(old)
+
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    # wbits 31 writes the gzip header and trailer
+    compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'],
+                                  zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(chunks, encoding, config):
+    """Compress an iterable of chunks, yielding output as the compressor
+    produces it"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(
+            quality=config['COMPRESS_BROTLI_QUALITY'])
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'],
+                                      zlib.DEFLATED, 31)
+        compress_chunk, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            output = compress_chunk(chunk)
+            if output:
+                yield output
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+# The CompressedCache in use, once compress_responses has been called
+compressed_cache = None
+
+def compress_responses(app):
+    """Compress the app's responses, if COMPRESS_ENABLED is set"""
+    if not app.config['COMPRESS_ENABLED']:
+        return
+    global compressed_cache
+    compressed_cache = CompressedCache(app.config['COMPRESS_CACHE_MAX_BYTES'])
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200
+                or response.mimetype not in mimetypes
+                # Files, and responses which are already compressed
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+        config = app.config
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding,
+                                                config)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            return response
+
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+        etag, weak = response.get_etag()
+        key = (etag or hashlib.sha1(body).hexdigest(), len(body), encoding)
+        compressed = compressed_cache.get(key)
+        if compressed is None:
+            compressed = compress(body, encoding, config)
+            compressed_cache.set(key, compressed)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,61 @@
+"""Conditional GET support for the JSON and Atom endpoints.
+
+Responses get an ETag made from the catalog version (see the changes
+module) and the request URL, and a Last-Modified header from the time of
+the last change. Both are known before the view runs, so when a client
+already has the current version it gets a 304 Not Modified response
+without the catalog being queried or serialized at all."""
+
+from functools import wraps
+import hashlib
+
+from flask import request, make_response
+
+from . import app
+from .changes import get_catalog_version
+from .database import db_session
+
+
+def cache_control_for(endpoint):
+    """Returns the Cache-Control header configured for an endpoint"""
+    return app.config['CACHE_CONTROL'].get(endpoint,
+                                           app.config['DEFAULT_CACHE_CONTROL'])
+
+def catalog_etag(version):
+    """ETag for the current request's URL at the given catalog version"""
+    url_hash = hashlib.sha1(request.url.encode('utf-8')).hexdigest()[:16]
+    return '%s-%s' % (version, url_hash)
+
+def not_modified(etag, last_modified):
+    """Returns True if the client's copy, as described by the request's
+    conditional headers, is still current"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control_for(request.endpoint)
+    return response
+
+def conditional(f):
+    """Decorator for views whose response only depends on the request URL
+    and the contents of the catalog, adding validators and answering
+    conditional requests with 304 Not Modified"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        version, last_modified = get_catalog_version(db_session)
+        etag = catalog_etag(version)
+
+        if not_modified(etag, last_modified):
+            response = app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        return set_validators(response, etag, last_modified)
+    return decorated_function
@@ -7,8 +7,176 @@ CSRF_SECRET_KEY = b'development csrf key'
 # Non-standard, specific to this app
 CATALOG_LOGFILE = 'catalog.log'
 
+# Log file rotation. With LOG_ROTATE = 'size' the file is rotated when it
+# reaches LOG_MAX_BYTES, and with 'time' at the interval given by
+# LOG_ROTATE_WHEN (see logging.handlers.TimedRotatingFileHandler), keeping
+# LOG_BACKUP_COUNT old files. With 'external' the file is reopened when
+# something else, such as logrotate, moves it: use this when several
+# processes share the file (the production server switches to it when it
+# runs more than one worker). LOG_FORMAT is 'json' for one JSON object per
+# line, or 'text'. Records wait on a queue of up to LOG_QUEUE_SIZE to be
+# written, and are dropped if it is full.
+LOG_ROTATE = 'size'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = 'midnight'
+LOG_BACKUP_COUNT = 10
+LOG_FORMAT = 'json'
+LOG_QUEUE_SIZE = 10000
+
 # Default sqlite database
 
 DB_FILE = 'catalog.db'
 
-DB_URL = ''
\ No newline at end of file
+DB_URL = ''
+
+# Connection pool. DB_POOL_SIZE and DB_MAX_OVERFLOW limit the number of
+# connections held open by each process (they are ignored for SQLite).
+# Connections older than DB_POOL_RECYCLE seconds are replaced, and if
+# DB_POOL_PRE_PING is set, connections are tested before being used.
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_RECYCLE = 3600
+DB_POOL_PRE_PING = True
+
+# Number of seconds to cache the logged in user's activation and admin
+# flags for, saving a query on each request. Changes made by an admin take
+# up to this long to apply in other processes. 0 disables the cache.
+USER_FLAGS_CACHE_TTL = 0
+
+# Cache for rendered pages. PAGE_CACHE_BACKEND is 'memory' for a cache in
+# each process, 'redis' for one shared between processes, using
+# PAGE_CACHE_REDIS_URL, or 'none' to disable caching. Pages are kept for at
+# most PAGE_CACHE_TTL seconds, which also limits how long other processes
+# can show stale pages when using the in-process cache.
+PAGE_CACHE_BACKEND = 'memory'
+PAGE_CACHE_TTL = 60
+PAGE_CACHE_MAX_ENTRIES = 1000
+PAGE_CACHE_REDIS_URL = 'redis://localhost:6379/0'
+
+# Cache-Control headers for the JSON and Atom endpoints, by endpoint name.
+# These responses carry validators, so by default clients are asked to
+# check with us (cheaply) before reusing a copy.
+DEFAULT_CACHE_CONTROL = 'no-cache'
+CACHE_CONTROL = {
+    'recentAtom': 'public, max-age=300',
+    # Archived feed pages never change
+    'archiveAtom': 'public, max-age=31536000, immutable',
+}
+
+# Atom feed. The head feed shows the FEED_HEAD_SIZE most recently updated
+# items, along with the items not archived yet. Items are archived in pages
+# of FEED_ARCHIVE_SIZE, by id.
+FEED_HEAD_SIZE = 10
+FEED_ARCHIVE_SIZE = 100
+
+# Full text search. SEARCH_LANGUAGE is the text search configuration used
+# on Postgres.
+SEARCH_ENABLED = True
+SEARCH_LANGUAGE = 'english'
+
+# Request metrics, served at /metrics in the Prometheus text format. Only
+# admins can see them unless METRICS_PUBLIC is set, which lets a Prometheus
+# server scrape them (restrict access to /metrics in the web server
+# instead). METRICS_BUCKETS are the upper bounds, in seconds, of the
+# latency histogram buckets.
+METRICS_ENABLED = True
+METRICS_PUBLIC = False
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0)
+
+# SQL profiling, for finding requests which run too many queries. When
+# enabled, each response gets an X-SQL-Profile header (if
+# SQL_PROFILER_HEADER is set), and requests which run more than
+# SQL_PROFILER_MAX_STATEMENTS statements, spend more than
+# SQL_PROFILER_MAX_TIME_MS in the database, or run the same statement
+# SQL_PROFILER_REPEAT_THRESHOLD or more times are logged. The last
+# SQL_PROFILER_HISTORY profiles are shown on the admin SQL profile page.
+SQL_PROFILER_ENABLED = False
+SQL_PROFILER_HEADER = True
+SQL_PROFILER_MAX_STATEMENTS = 20
+SQL_PROFILER_MAX_TIME_MS = 100
+SQL_PROFILER_REPEAT_THRESHOLD = 5
+SQL_PROFILER_HISTORY = 50
+
+# Logging in. IDENTITY_PROVIDER is 'google', using the client secrets in
+# instance/client_secrets.json, or 'local', which accepts any email address
+# without checking it, for development and load testing only. Calls to the
+# provider time out after OAUTH_TIMEOUT seconds (to connect, and to read),
+# going through a pool of up to OAUTH_POOL_SIZE connections per process,
+# and failures to connect are retried OAUTH_RETRIES times.
+# Token info is cached for OAUTH_TOKENINFO_CACHE_TTL seconds.
+# LOCAL_IDENTITY_LATENCY_MS is added to each call to the local provider.
+IDENTITY_PROVIDER = 'google'
+OAUTH_TIMEOUT = (3.05, 10)
+OAUTH_POOL_SIZE = 10
+OAUTH_RETRIES = 1
+OAUTH_TOKENINFO_CACHE_TTL = 60
+OAUTH_TOKENINFO_CACHE_SIZE = 1000
+LOCAL_IDENTITY_LATENCY_MS = 0
+
+# Production server (serve.py). SERVER_WORKERS processes are started, or
+# one per CPU if it is 0, each handling up to SERVER_THREADS requests at
+# once (keep this within DB_POOL_SIZE + DB_MAX_OVERFLOW). Clients have
+# SERVER_TIMEOUT seconds to send each request. When stopping or restarting,
+# workers get SERVER_GRACEFUL_TIMEOUT seconds to finish their requests.
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8000
+SERVER_WORKERS = 0
+SERVER_THREADS = 8
+SERVER_TIMEOUT = 30
+SERVER_GRACEFUL_TIMEOUT = 30
+
+# Static assets. Once built with build_assets.py, pages use the bundled,
+# fingerprinted and precompressed files, unless ASSETS_USE_BUILD is off
+# (for editing the CSS without rebuilding).
+ASSETS_USE_BUILD = True
+
+# Compression of dynamic responses of the COMPRESS_MIMETYPES which are at
+# least COMPRESS_MIN_SIZE bytes, with gzip at COMPRESS_GZIP_LEVEL (1-9), or
+# brotli at COMPRESS_BROTLI_QUALITY (0-11) if the brotli module is
+# installed. Up to COMPRESS_CACHE_MAX_BYTES of compressed bodies are kept
+# in each process, to save compressing the same responses again.
+COMPRESS_ENABLED = True
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+COMPRESS_CACHE_MAX_BYTES = 32 * 1024 * 1024
+COMPRESS_MIMETYPES = ('text/html', 'text/plain', 'application/json',
+                      'application/x-ndjson', 'application/atom+xml')
+
+# Compiled templates are cached in TEMPLATE_BYTECODE_CACHE_DIR (by default
+# instance/template_cache), shared by every process, if
+# TEMPLATE_BYTECODE_CACHE is set. With SERVER_WARMUP set, each production
+# server worker compiles the templates and requests WARMUP_PATHS before it
+# accepts connections.
+TEMPLATE_BYTECODE_CACHE = True
+TEMPLATE_BYTECODE_CACHE_DIR = ''
+SERVER_WARMUP = True
+WARMUP_PATHS = ('/catalog/', '/catalog/browse/', '/catalog/search/?q=a',
+                '/catalog.json')
+
+# URLs of read replicas of the database. GET and HEAD requests read from
+# one of them, except for clients which have written to the database in the
+# last DB_REPLICA_STALENESS seconds, who read from the primary so that they
+# see their changes. Set the window to more than the replicas usually lag.
+DB_REPLICA_URLS = ()
+DB_REPLICA_STALENESS = 5
+
+# Number of tags offered for narrowing down the results when browsing
+# items by tag. Each process keeps the tag bitmaps browsing uses (see
+# catalog/facets.py) and only updates them for its own writes, so with
+# several server workers, every write makes the other workers rebuild them
+# from the item_tag table when they next browse.
+BROWSE_FACETS = 20
+
+# Maximum number of operations in a request to the batch JSON API
+BATCH_MAX_OPERATIONS = 1000
+
+# Pagination. Page size can be chosen by clients with the limit parameter,
+# up to MAX_PAGE_SIZE.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Number of rows read from the database at a time when streaming full
+# catalog dumps
+STREAM_BATCH_SIZE = 1000
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""Denormalized item counts.
+
+Each tag and user holds the number of items it has, and the catalog_meta
+row holds the total numbers of items and tags, so that pages can show them
+without loading or counting the items. The counts are kept up to date in
+the same transaction as the changes to the items, by session events which
+work out how each flush changes them. Bulk imports, which bypass the
+session, call apply_counts themselves.
+
+If the counts ever drift from the real numbers (for example after editing
+the database by hand), reconcile_counts.py puts them right."""
+
+from collections import defaultdict
+
+from sqlalchemy import event, func, inspect, select, bindparam
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.orm.util import identity_key
+
+from .database import DBSession
+from .models import Item, Tag, User, CatalogMeta, association_table
+from .changes import CATALOG_META_ID
+
+# Columns holding counts, so migratedb.py knows to fill them in when adding
+# them to an older database
+COUNTER_COLUMNS = (('tag', 'item_count'),
+                   ('user', 'item_count'),
+                   ('catalog_meta', 'item_count'),
+                   ('catalog_meta', 'tag_count'))
+
+
+class CountChanges(object):
+    """The changes a flush makes to the counts. Tags are held as objects
+    rather than ids, as new tags don't have their ids until after the
+    flush, and likewise for the users of new items."""
+
+    def __init__(self):
+        self.tags = defaultdict(int)
+        self.user_ids = defaultdict(int)
+        self.new_items = []
+        self.items = 0
+        self.tag_total = 0
+
+    def tag_deltas(self):
+        return dict((tag.id, delta) for tag, delta in self.tags.items()
+                    if delta and tag.id is not None)
+
+    def user_deltas(self):
+        deltas = self.user_ids.copy()
+        for item in self.new_items:
+            deltas[item.user_id] += 1
+        deltas.pop(None, None)
+        return dict((user_id, delta) for user_id, delta in deltas.items()
+                    if delta)
+
+
+def _collect_changes(session, changes):
+    for obj in session.new:
+        if isinstance(obj, Item):
+            changes.items += 1
+            changes.new_items.append(obj)
+            for tag in obj.tags:
+                changes.tags[tag] += 1
+        elif isinstance(obj, Tag):
+            changes.tag_total += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Item):
+            changes.items -= 1
+            user_history = get_history(obj, 'user_id')
+            for user_id in user_history.unchanged or user_history.deleted:
+                changes.user_ids[user_id] -= 1
+            tag_history = get_history(obj, 'tags')
+            for tag in tag_history.sum():
+                if tag not in tag_history.added:
+                    changes.tags[tag] -= 1
+        elif isinstance(obj, Tag):
+            changes.tag_total -= 1
+
+    for obj in session.dirty:
+        if not isinstance(obj, Item):
+            continue
+        tag_history = get_history(obj, 'tags')
+        for tag in tag_history.added:
+            changes.tags[tag] += 1
+        for tag in tag_history.deleted:
+            changes.tags[tag] -= 1
+        user_history = get_history(obj, 'user_id')
+        if user_history.added:
+            for user_id in user_history.deleted:
+                changes.user_ids[user_id] -= 1
+            for user_id in user_history.added:
+                changes.user_ids[user_id] += 1
+
+def apply_counts(connection, tag_deltas, user_deltas, items=0, tags=0):
+    """Add the given deltas to the counts. tag_deltas and user_deltas map
+    tag and user ids to the change in their number of items."""
+    for table, deltas in ((Tag.__table__, tag_deltas),
+                          (User.__table__, user_deltas)):
+        if deltas:
+            connection.execute(
+                table.update()
+                     .where(table.c.id == bindparam('row_id'))
+                     .values(item_count=table.c.item_count
+                                        + bindparam('delta')),
+                [{'row_id': row_id, 'delta': delta}
+                 for row_id, delta in deltas.items()])
+    if items or tags:
+        meta = CatalogMeta.__table__
+        connection.execute(
+            meta.update()
+                .where(meta.c.id == CATALOG_META_ID)
+                .values(item_count=meta.c.item_count + items,
+                        tag_count=meta.c.tag_count + tags))
+
+def _expire_counts(session, changes):
+    """Expire the counts of loaded objects, which the updates have made
+    stale"""
+    for tag in changes.tags:
+        if inspect(tag).persistent:
+            session.expire(tag, ['item_count'])
+    loaded = [(identity_key(User, user_id), ['item_count'])
+              for user_id in changes.user_deltas()]
+    loaded.append((identity_key(CatalogMeta, CATALOG_META_ID),
+                   ['item_count', 'tag_count']))
+    for key, attributes in loaded:
+        obj = session.identity_map.get(key)
+        if obj is not None:
+            session.expire(obj, attributes)
+
+@event.listens_for(DBSession, 'before_flush')
+def collect_count_changes(session, flush_context, instances):
+    changes = session.info.setdefault('count_changes', CountChanges())
+    _collect_changes(session, changes)
+
+@event.listens_for(DBSession, 'after_flush_postexec')
+def update_counts(session, flush_context):
+    changes = session.info.pop('count_changes', None)
+    if changes is None:
+        return
+    apply_counts(session.connection(),
+                 changes.tag_deltas(),
+                 changes.user_deltas(),
+                 changes.items,
+                 changes.tag_total)
+    _expire_counts(session, changes)
+
+
+@event.listens_for(DBSession, 'after_soft_rollback')
+def discard_count_changes(session, previous_transaction):
+    # A flush which failed leaves its changes behind, which mustn't be added
+    # to the next one
+    session.info.pop('count_changes', None)
+
+
+# Reading the counts
+
+def get_catalog_counts(db_session):
+    """Returns the total numbers of items and tags, as a dict"""
+    row = db_session.query(CatalogMeta.item_count, CatalogMeta.tag_count) \
+                    .filter(CatalogMeta.id == CATALOG_META_ID).first()
+    if row is None:
+        return {'items': 0, 'tags': 0}
+    return {'items': row.item_count, 'tags': row.tag_count}
+
+def get_user_item_count(db_session, user_id):
+    return db_session.query(User.item_count) \
+                     .filter(User.id == user_id).scalar() or 0
+
+
+# Reconciliation
+
+def _actual_counts():
+    """Returns (table, count column, correlated subquery of the real count)
+    for each counter"""
+    items = Item.__table__
+    tags = Tag.__table__
+    users = User.__table__
+    meta = CatalogMeta.__table__
+    count = select([func.count()])
+    return [
+        (tags, tags.c.item_count,
+         count.where(association_table.c.tag_id == tags.c.id).as_scalar()),
+        (users, users.c.item_count,
+         count.where(items.c.user_id == users.c.id).as_scalar()),
+        (meta, meta.c.item_count, count.select_from(items).as_scalar()),
+        (meta, meta.c.tag_count, count.select_from(tags).as_scalar()),
+    ]
+
+def reconcile_counts(connection, dry_run=False):
+    """Compare every count with the real number, and correct those which
+    have drifted unless dry_run is set. Returns a list of (table, column,
+    row id, stored count, real count) tuples for the counts which were
+    wrong."""
+    drift = []
+    for table, column, actual in _actual_counts():
+        rows = connection.execute(
+            select([table.c.id, column, actual.label('actual')])
+                .where(column != actual))
+        drift.extend((table.name, column.name, row.id, row[1], row.actual)
+                     for row in rows)
+        if not dry_run:
+            connection.execute(table.update()
+                                    .where(column != actual)
+                                    .values({column: actual}))
+    return drift
@@ -2,9 +2,17 @@
 the db_session used for querying the database, and the init_db function for creating our 
 database tables."""
 
+from functools import wraps
+import random
+import time
+
+from flask import g, request, has_request_context
+from flask import session as login_session
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from sqlalchemy.sql.dml import UpdateBase
 from catalog import app
 
 dbfilename = app.config.get('DB_FILE')
@@ -12,14 +20,109 @@ db_url = app.config.get('DB_URL')
 if not db_url:
     db_url = 'sqlite:///' + dbfilename
 
-engine = create_engine(db_url)
+def engine_options(url):
+    """Connection pool settings for create_engine, taken from the config"""
+    options = {
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    }
+    # SQLite uses its own pool classes, which don't take a size
+    if not make_url(url).drivername.startswith('sqlite'):
+        options['pool_size'] = app.config['DB_POOL_SIZE']
+        options['max_overflow'] = app.config['DB_MAX_OVERFLOW']
+    return options
+
+engine = create_engine(db_url, **engine_options(db_url))
+
+# Read replicas of the database, if any. Safe (GET and HEAD) requests read
+# from one of them, chosen at random for each request, unless they need to
+# read their own writes (see read_engine).
+replica_engines = [create_engine(url, **engine_options(url))
+                   for url in app.config['DB_REPLICA_URLS']]
+
+def all_engines():
+    """The primary database's engine, then the replicas'"""
+    return [engine] + replica_engines
+
+
+# Routing reads to the replicas
+
+def use_primary():
+    """Send the rest of the current request's queries to the primary
+    database, to read what has just been written"""
+    if has_request_context():
+        g.db_use_primary = True
+
+def primary_only(f):
+    """Decorator for views whose reads must be up to date, such as forms
+    for changing what they show"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        use_primary()
+        return f(*args, **kwargs)
+    return decorated_function
+
+def read_engine():
+    """Returns the engine the current request should read from. Requests
+    which aren't safe, requests from clients which wrote to the database in
+    the last DB_REPLICA_STALENESS seconds (so the replicas may not have the
+    changes yet), and anything run outside a request, use the primary."""
+    if not replica_engines or not has_request_context():
+        return engine
+    if request.method not in ('GET', 'HEAD') or g.get('db_use_primary'):
+        return engine
+    written = login_session.get('db_written')
+    if written and time.time() - written < app.config['DB_REPLICA_STALENESS']:
+        g.db_use_primary = True
+        return engine
+    replica = g.get('db_replica')
+    if replica is None:
+        replica = g.db_replica = random.choice(replica_engines)
+    return replica
+
+
+class RoutingSession(Session):
+    """Session which writes, and reads in transactions which have written,
+    to the primary database, and otherwise reads from read_engine()"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (self._flushing or isinstance(clause, UpdateBase)
+                or self.info.get('db_written')):
+            return engine
+        return read_engine()
+
+
+DBSession = sessionmaker(bind=engine, class_=RoutingSession)
+
+@event.listens_for(DBSession, 'after_flush')
+def record_write(session, flush_context):
+    session.info['db_written'] = True
+    if replica_engines and has_request_context():
+        # Read this client's writes from the primary, for the rest of this
+        # request and for the staleness window after it
+        g.db_use_primary = True
+        login_session['db_written'] = time.time()
+
+@event.listens_for(DBSession, 'after_commit')
+@event.listens_for(DBSession, 'after_rollback')
+def forget_write(session):
+    session.info.pop('db_written', None)
 
+# Imported by view module to make queries. Each thread gets its own session,
+# which is thrown away at the end of each request.
+db_session = scoped_session(DBSession)
 
-DBSession = sessionmaker(bind=engine)
-db_session = DBSession() # Imported by view module to make queries
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    db_session.remove()
 
 Base = declarative_base() # Imported by the models module as base class for models
 
 def init_db():
     import catalog.models
-    Base.metadata.create_all(engine)    
\ No newline at end of file
+    from catalog.changes import seed_catalog_meta
+    from catalog.search import create_search_index
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        seed_catalog_meta(connection)
+        create_search_index(connection)
@@ -0,0 +1,250 @@
+"""Faceted browsing of items by tag, using in-memory tag bitmaps.
+
+Each tag's items are held as a bitmap, a Python long with bit n set if
+item n has the tag, so that the items with some tags but not others can be
+found with a few bitwise operations instead of joins, and the number of
+matching items in every other tag (the facet counts) by counting bits.
+
+Each process builds the bitmaps from the item_tag table when they are
+first needed, and keeps them up to date with its own writes, applying the
+changes made by each transaction once it commits. The bitmaps record the
+catalog version (see the changes module) they reflect: if the catalog has
+been changed by anything else, such as another process or a bulk import,
+the versions no longer match and the bitmaps are built again."""
+
+import threading
+
+from sqlalchemy import event, select
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
+
+from .database import DBSession
+from .models import Item, Tag, CatalogMeta, association_table
+from .changes import CATALOG_META_ID, catalog_changed, get_catalog_version
+
+
+def bit_count(bits):
+    """Number of set bits in bits"""
+    return bin(bits).count('1')
+
+def bit_ids(bits, offset=0, limit=None):
+    """Returns the ids of the set bits in bits, highest first, skipping the
+    first offset of them"""
+    digits = bin(bits)[2:]
+    top = len(digits) - 1
+    ids = []
+    position = digits.find('1')
+    while position != -1 and (limit is None or len(ids) < limit):
+        if offset:
+            offset -= 1
+        else:
+            ids.append(top - position)
+        position = digits.find('1', position + 1)
+    return ids
+
+
+# Most filters whose facet counts are kept by each TagBitmaps
+FACET_CACHE_SIZE = 256
+
+
+class TagBitmaps(object):
+    """The items of every tag, as bitmaps, at a catalog version. Never
+    changed once built: applying changes returns new TagBitmaps, so readers
+    in other threads always see a consistent set. The number of items in
+    each tag is kept alongside, so facet counts for the whole catalog need
+    no counting, and the facet counts of other filters are kept until the
+    catalog changes."""
+
+    def __init__(self, version, items, members, tag_ids, counts=None):
+        self.version = version
+        self.items = items        # Bitmap of every item
+        self.members = members    # {tag id: bitmap of the tag's items}
+        self.tag_ids = tag_ids    # {tag name: tag id}
+        if counts is None:
+            counts = dict((tag_id, bit_count(bits))
+                          for tag_id, bits in members.items())
+        self.counts = counts      # {tag id: number of items in the tag}
+        # {bitmap: facet counts}, for the filters browsed since the bitmaps
+        # were made
+        self._facet_counts = {}
+
+    @classmethod
+    def build(cls, connection):
+        """Build the bitmaps from the database"""
+        # Read the version first, so that anything changed while building
+        # makes the bitmaps look stale rather than fresh
+        version = connection.execute(
+            select([CatalogMeta.version])
+                .where(CatalogMeta.id == CATALOG_META_ID)).scalar() or 0
+        tags = Tag.__table__
+        tag_ids = dict((row.name, row.id) for row in
+                       connection.execute(select([tags.c.name, tags.c.id])))
+        members = dict((tag_id, 0) for tag_id in tag_ids.values())
+        items = 0
+        for row in connection.execute(select([Item.__table__.c.id])):
+            items |= 1 << row.id
+        for row in connection.execute(select([association_table.c.tag_id,
+                                              association_table.c.item_id])):
+            members[row.tag_id] = members.get(row.tag_id, 0) | 1 << row.item_id
+        return cls(version, items, members, tag_ids)
+
+    def apply(self, changes, version):
+        """Returns new bitmaps with changes applied. changes is a list of
+        (operation, arguments) tuples, as recorded by record_changes."""
+        items = self.items
+        members = self.members.copy()
+        tag_ids = self.tag_ids.copy()
+        counts = self.counts.copy()
+        for operation, args in changes:
+            if operation == 'add_item':
+                items |= 1 << args[0]
+            elif operation == 'remove_item':
+                bit = 1 << args[0]
+                items &= ~bit
+                for tag_id, bits in members.items():
+                    if bits & bit:
+                        members[tag_id] = bits & ~bit
+                        counts[tag_id] -= 1
+            elif operation == 'tag_item':
+                tag_id, item_id = args
+                bits = members.get(tag_id, 0)
+                if not bits & 1 << item_id:
+                    members[tag_id] = bits | 1 << item_id
+                    counts[tag_id] = counts.get(tag_id, 0) + 1
+            elif operation == 'untag_item':
+                tag_id, item_id = args
+                bits = members.get(tag_id, 0)
+                if bits & 1 << item_id:
+                    members[tag_id] = bits & ~(1 << item_id)
+                    counts[tag_id] -= 1
+            elif operation == 'add_tag':
+                tag_id, name = args
+                tag_ids[name] = tag_id
+                members.setdefault(tag_id, 0)
+                counts.setdefault(tag_id, 0)
+            elif operation == 'remove_tag':
+                tag_id, name = args
+                tag_ids.pop(name, None)
+                members.pop(tag_id, None)
+                counts.pop(tag_id, None)
+            elif operation == 'rename_tag':
+                tag_id, old_name, new_name = args
+                tag_ids.pop(old_name, None)
+                tag_ids[new_name] = tag_id
+        return TagBitmaps(version, items, members, tag_ids, counts)
+
+    def matching(self, include=(), exclude=()):
+        """Returns the bitmap of items with every tag in include and none
+        in exclude, given as tag ids"""
+        bits = self.items
+        for tag_id in include:
+            bits &= self.members.get(tag_id, 0)
+        for tag_id in exclude:
+            bits &= ~self.members.get(tag_id, 0)
+        return bits
+
+    def facet_counts(self, bits):
+        """Returns {tag id: number of items in bits with the tag}, leaving
+        out tags with none"""
+        if bits == self.items:
+            return dict((tag_id, count)
+                        for tag_id, count in self.counts.items() if count)
+        counts = self._facet_counts.get(bits)
+        if counts is None:
+            counts = {}
+            for tag_id, members in self.members.items():
+                count = bit_count(bits & members)
+                if count:
+                    counts[tag_id] = count
+            if len(self._facet_counts) >= FACET_CACHE_SIZE:
+                self._facet_counts.clear()
+            self._facet_counts[bits] = counts
+        return dict(counts)
+
+
+_lock = threading.Lock()
+_current = [None]
+
+def get_tag_bitmaps(db_session):
+    """Returns bitmaps which are up to date with the catalog, building
+    them if needed"""
+    version, updated_on = get_catalog_version(db_session)
+    bitmaps = _current[0]
+    if bitmaps is None or bitmaps.version != version:
+        with _lock:
+            bitmaps = _current[0]
+            if bitmaps is None or bitmaps.version != version:
+                bitmaps = TagBitmaps.build(db_session.connection())
+                _current[0] = bitmaps
+    return bitmaps
+
+
+# Keeping the bitmaps up to date with this process's writes
+
+def _flush_changes(session):
+    """Returns the changes to the bitmaps made by a flush, as a list of
+    (operation, arguments) tuples. Called after the flush, so that new
+    items and tags have their ids."""
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Item):
+            changes.append(('add_item', (obj.id,)))
+            changes.extend(('tag_item', (tag.id, obj.id)) for tag in obj.tags)
+        elif isinstance(obj, Tag):
+            changes.append(('add_tag', (obj.id, obj.name)))
+    for obj in session.dirty:
+        if isinstance(obj, Item):
+            history = get_history(obj, 'tags', passive=PASSIVE_NO_INITIALIZE)
+            changes.extend(('tag_item', (tag.id, obj.id))
+                           for tag in history.added)
+            changes.extend(('untag_item', (tag.id, obj.id))
+                           for tag in history.deleted)
+        elif isinstance(obj, Tag):
+            history = get_history(obj, 'name')
+            if history.deleted:
+                changes.append(('rename_tag', (obj.id, history.deleted[0],
+                                               obj.name)))
+    for obj in session.deleted:
+        if isinstance(obj, Item):
+            changes.append(('remove_item', (obj.id,)))
+        elif isinstance(obj, Tag):
+            changes.append(('remove_tag', (obj.id, obj.name)))
+    return changes
+
+@event.listens_for(DBSession, 'after_flush')
+def record_changes(session, flush_context):
+    # Each flush which changes the catalog increases its version by one
+    if catalog_changed(session):
+        flushes = session.info.get('facet_flushes', 0)
+        session.info['facet_flushes'] = flushes + 1
+        session.info.setdefault('facet_changes', []).extend(
+            _flush_changes(session))
+
+@event.listens_for(DBSession, 'after_flush_postexec')
+def record_version(session, flush_context):
+    if 'facet_flushes' in session.info:
+        session.info['facet_version'] = session.execute(
+            select([CatalogMeta.version])
+                .where(CatalogMeta.id == CATALOG_META_ID)).scalar()
+
+def _forget_changes(session):
+    for key in ('facet_flushes', 'facet_changes', 'facet_version'):
+        session.info.pop(key, None)
+
+@event.listens_for(DBSession, 'after_commit')
+def apply_changes(session):
+    flushes = session.info.get('facet_flushes')
+    version = session.info.get('facet_version')
+    changes = session.info.get('facet_changes', [])
+    _forget_changes(session)
+    if not flushes or version is None:
+        return
+    with _lock:
+        bitmaps = _current[0]
+        # Only apply the changes if the bitmaps were up to date when the
+        # transaction started, otherwise they are rebuilt when next used
+        if bitmaps is not None and bitmaps.version == version - flushes:
+            _current[0] = bitmaps.apply(changes, version)
+
+@event.listens_for(DBSession, 'after_rollback')
+def discard_changes(session):
+    _forget_changes(session)
@@ -0,0 +1,26 @@
+"""Views for the Atom feed. Imported when first requested (see
+views.py), as building feeds needs werkzeug's Atom support."""
+
+from flask import request, abort, Response
+
+from .database import db_session
+from .conditional import conditional, cache_control_for
+from .changes import get_catalog_version
+from .feeds import head_feed, archive_page
+
+@conditional
+def recentAtom():
+    """View the head of the Atom feed, linking back to the archive pages"""
+    version, last_modified = get_catalog_version(db_session)
+    return Response(head_feed(version), mimetype='application/atom+xml')
+
+def archiveAtom(page):
+    """View a closed page of the Atom feed archive. These never change,
+    so can be cached indefinitely."""
+    body = archive_page(page)
+    if body is None:
+        abort(404)
+    response = Response(body, mimetype='application/atom+xml')
+    response.headers['Cache-Control'] = cache_control_for('archiveAtom')
+    response.add_etag()
+    return response.make_conditional(request)
@@ -0,0 +1,160 @@
+"""Paged and archived Atom feeds, following RFC 5005.
+
+Items are split into archive pages by id, FEED_ARCHIVE_SIZE items to a
+page, so page 1 holds items 1 to FEED_ARCHIVE_SIZE and so on. Item ids are
+never reused (see Item), so once an item exists beyond the end of a page,
+nothing more can be added to it, and the page is closed. Closed pages are
+rendered once, stored in the feed_archive table, and served from there
+forever after. Feed readers which fall behind can walk back through them
+using the prev-archive links. Stored pages have no next-archive link, as
+they would need it added when the following page closes.
+
+The head feed (the subscription document) holds the items of the page
+which is still open, along with the most recently updated items, so that
+edits to archived items are seen too. It is only rendered again when the
+catalog version changes."""
+
+from flask import url_for, request
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.contrib.atom import AtomFeed
+
+from . import app
+from .cache import page_cache
+from .database import db_session, use_primary
+from .loading import with_strategy
+from .models import Item, FeedArchive
+
+HISTORY_NAMESPACE = 'http://purl.org/syndication/history/1.0'
+
+
+class ArchiveFeed(AtomFeed):
+    """Atom feed marked as an archive document, with <fh:archive/>"""
+
+    def generate(self):
+        for chunk in AtomFeed.generate(self):
+            if chunk.startswith(u'<feed '):
+                chunk = chunk.replace(
+                    u'<feed ', u'<feed xmlns:fh="%s" ' % HISTORY_NAMESPACE, 1)
+                chunk += u'  <fh:archive/>\n'
+            yield chunk
+
+
+def add_item_entry(feed, item):
+    """Add an entry for item to feed. The item's tags should already be
+    loaded."""
+    categories = [{'term': tag.name.lower(),
+                   'label': tag.name} for tag in item.tags]
+    feed.add(title=item.name,
+             url=url_for('viewItem',
+                         item_name=item.name,
+                         item_id=item.id,
+                         _external=True),
+             updated=item.updated_on,
+             published=item.created_on,
+             content_type='text',
+             content=unicode(item.description),
+             categories=categories,
+             author={'name':"Random dude",
+                     'email':'bob@example.com'})
+             # Replace with user once auth in place
+
+def archive_url(page):
+    return url_for('archiveAtom', page=page, _external=True)
+
+def last_closed_page():
+    """Returns the number of the newest closed archive page, or 0 if there
+    are none. Stored pages stay closed even if the newest items are
+    deleted."""
+    max_id = db_session.query(func.max(Item.id)).scalar() or 0
+    stored = db_session.query(func.max(FeedArchive.page)).scalar() or 0
+    return max(stored, (max_id - 1) // app.config['FEED_ARCHIVE_SIZE'])
+
+
+# Head feed
+
+def render_head_feed():
+    """Render the subscription document"""
+    size = app.config['FEED_ARCHIVE_SIZE']
+    closed = last_closed_page()
+
+    links = []
+    if closed:
+        links.append({'href': archive_url(closed), 'rel': 'prev-archive'})
+    feed = AtomFeed(title="Recent Items",
+                    feed_url=request.url,
+                    url=request.host_url,
+                    subtitle="The most recently created catalog items.",
+                    links=links)
+
+    recently_updated = db_session.query(Item.id)                    \
+                                 .order_by(Item.updated_on.desc(),
+                                           Item.id.desc())           \
+                                 .limit(app.config['FEED_HEAD_SIZE'])
+    items = with_strategy(db_session.query(Item), 'items_with_tags')  \
+                .filter(or_(Item.id > closed * size,
+                            Item.id.in_(recently_updated.subquery())))  \
+                .order_by(Item.updated_on.desc(), Item.id.desc())
+    for item in items:
+        add_item_entry(feed, item)
+    return feed.to_string()
+
+def head_feed(version):
+    """Returns the subscription document for the given catalog version,
+    only rendering it if it isn't in the cache already"""
+    key = 'feed:head:%s:%s' % (version, request.url)
+    body = page_cache.get(key)
+    if body is None:
+        body = render_head_feed()
+        page_cache.set(key, body)
+    return body
+
+
+# Archive pages
+
+def render_archive_page(page):
+    """Render a closed archive page"""
+    size = app.config['FEED_ARCHIVE_SIZE']
+    links = [{'href': url_for('recentAtom', _external=True),
+              'rel': 'current'}]
+    if page > 1:
+        links.append({'href': archive_url(page - 1), 'rel': 'prev-archive'})
+    feed = ArchiveFeed(title="Catalog Items, page %d" % page,
+                       feed_url=archive_url(page),
+                       id=archive_url(page),
+                       url=request.host_url,
+                       subtitle="Archived catalog items.",
+                       links=links)
+
+    items = with_strategy(db_session.query(Item), 'items_with_tags') \
+                .filter(Item.id > (page - 1) * size,
+                        Item.id <= page * size)                      \
+                .order_by(Item.id)
+    for item in items:
+        add_item_entry(feed, item)
+    return feed.to_string()
+
+def archive_page(page):
+    """Returns the stored archive page, generating and storing it first if
+    needed. Returns None if the page isn't closed yet."""
+    archive = db_session.query(FeedArchive).filter_by(page=page).first()
+    if archive is not None:
+        return archive.body
+
+    if page < 1 or page > last_closed_page():
+        return None
+
+    body = render_archive_page(page)
+    try:
+        # Inserted without a flush, so that storing the page isn't taken as
+        # the reader writing to the catalog (see database.record_write)
+        db_session.execute(FeedArchive.__table__.insert()
+                                      .values(page=page, body=body))
+        db_session.commit()
+    except IntegrityError:
+        # Another request stored it first, so use theirs, from the primary
+        # as the replicas may not have it yet
+        db_session.rollback()
+        use_primary()
+        return db_session.query(FeedArchive).filter_by(page=page).one().body
+    return body
@@ -0,0 +1,37 @@
+"""Views whose URLs are registered when the app starts, but whose modules
+are only imported when one of them is first requested, so that what they
+depend on doesn't slow down starting the app or the scripts which use it.
+Based on http://flask.pocoo.org/docs/0.12/patterns/lazyloading/"""
+
+from werkzeug.utils import import_string, cached_property
+
+from . import app
+
+
+class LazyView(object):
+    """Imports the view named by import_name when first called"""
+
+    def __init__(self, import_name):
+        self.__module__, self.__name__ = import_name.rsplit('.', 1)
+        self.import_name = import_name
+
+    @cached_property
+    def view(self):
+        return import_string(self.import_name)
+
+    def __call__(self, *args, **kwargs):
+        return self.view(*args, **kwargs)
+
+
+def lazy_url(rule, import_name, **options):
+    """Route rule to the view named by import_name, with the view's name as
+    its endpoint"""
+    app.add_url_rule(rule, import_name.rsplit('.', 1)[1],
+                     view_func=LazyView(import_name), **options)
+
+def load_lazy_views():
+    """Import every lazily loaded view now, for processes which would
+    rather pay for it up front, such as the production server's master"""
+    for view in app.view_functions.values():
+        if isinstance(view, LazyView):
+            view.view
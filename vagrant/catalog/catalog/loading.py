@@ -0,0 +1,24 @@
+"""Relationship loading strategies for the views.
+
+The tags and items relationships are lazy loaded by default, which means
+that walking them for each object in a list runs one query per object.
+Views which are going to walk a relationship choose one of the strategies
+below, so that the related objects for the whole list are fetched in a
+single batched "SELECT ... WHERE id IN (...)" query instead. The number of
+queries a view makes then no longer depends on the number of rows."""
+
+from sqlalchemy.orm import selectinload
+
+from .models import Item
+
+STRATEGIES = {
+    # Items along with their tags, for item lists showing tag links and
+    # for Item.serialize(include_tags=True)
+    'items_with_tags': (selectinload(Item.tags),),
+}
+
+def with_strategy(query, strategy):
+    """Apply the named loading strategy to a query"""
+    if strategy is None:
+        return query
+    return query.options(*STRATEGIES[strategy])
@@ -1,10 +1,218 @@
-from logging.handlers import RotatingFileHandler
+"""Logging to the catalog log file.
+
+Request threads never write to the file themselves: log records are put on
+a bounded queue by a QueueHandler, and written out (and the file rotated) by
+a background thread. If the queue is full, because the writer can't keep
+up, records are dropped rather than holding up requests, and the number
+dropped is logged once the writer catches up.
+
+Records are written as one JSON object per line, holding the message along
+with the logged in user, the route, the id of the object acted on (given
+with extra={'object_id': ...}) and the time since the request started."""
+
+from logging.handlers import (RotatingFileHandler, TimedRotatingFileHandler,
+                              WatchedFileHandler)
+from datetime import datetime
+import Queue
+import atexit
+import json
 import logging
+import threading
+import time
 
-def start_logging(app):
-    formatter = logging.Formatter('%(asctime)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+from flask import g, request, session, has_request_context
+
+# Fields added to each record, which the JSON formatter writes when set
+RECORD_FIELDS = ('user_id', 'route', 'method', 'path', 'remote_addr',
+                 'object_id', 'latency_ms')
+
+# The running QueueListener, once start_logging has been called
+log_listener = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds details of the current request, if any, to each record. Runs
+    in the thread which logged the record, where the request is known."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.user_id = session.get('user_id')
+            record.route = request.endpoint
+            record.method = request.method
+            record.path = request.path
+            record.remote_addr = request.remote_addr
+            started = g.get('request_started')
+            if started is not None:
+                record.latency_ms = round((time.time() - started) * 1000, 1)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a single line JSON object"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.utcfromtimestamp(record.created)
+                            .strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in RECORD_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=unicode)
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue without waiting, counting those dropped
+    because the queue is full"""
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        """Render the parts of the record which can't safely be left to
+        another thread: the message arguments and the exception"""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """Background thread which takes records off the queue and passes them
+    to the handlers"""
+
+    _stop = object()
+
+    def __init__(self, queue, handlers, queue_handler=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.queue_handler = queue_handler
+        self.reported_drops = 0
+        self._thread = None
+
+    def start(self):
+        """Start the writer thread, unless it is already running"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='catalog-log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Write out the records still queued, then stop the thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(self._stop)
+            self._thread.join()
+        self._thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _report_drops(self):
+        if self.queue_handler is None:
+            return
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported_drops:
+            record = logging.LogRecord(
+                'catalog.logging', logging.WARNING, __file__, 0,
+                'Log queue full: dropped %d records',
+                (dropped - self.reported_drops,), None)
+            self.reported_drops = dropped
+            self.handle(record)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._stop:
+                break
+            self.handle(record)
+            if self.queue.empty():
+                self._report_drops()
+        self._report_drops()
+
+
+def file_handler(app):
+    """Returns a handler for the log file, rotated by size or time, or
+    externally, as set in the config"""
     logfile = app.config['CATALOG_LOGFILE']
-    handler = RotatingFileHandler(logfile, maxBytes=10000, backupCount=1) # Rotates files when they get too large
+    if app.config['LOG_ROTATE'] == 'external':
+        handler = WatchedFileHandler(logfile)
+    elif app.config['LOG_ROTATE'] == 'time':
+        handler = TimedRotatingFileHandler(
+            logfile,
+            when=app.config['LOG_ROTATE_WHEN'],
+            backupCount=app.config['LOG_BACKUP_COUNT'],
+            utc=True)
+    else:
+        handler = RotatingFileHandler(
+            logfile,
+            maxBytes=app.config['LOG_MAX_BYTES'],
+            backupCount=app.config['LOG_BACKUP_COUNT'])
+    if app.config['LOG_FORMAT'] == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s: %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p'))
     handler.setLevel(logging.INFO)
-    handler.setFormatter(formatter)
-    app.logger.addHandler(handler)
\ No newline at end of file
+    return handler
+
+def replace_file_handler(app):
+    """Write the log file through a new handler made from the current
+    config, once the records already queued are written"""
+    if log_listener is None:
+        return
+    log_listener.stop()
+    for handler in log_listener.handlers:
+        handler.close()
+    log_listener.handlers = [file_handler(app)]
+    log_listener.start()
+
+def start_logging(app):
+    """Start writing the app's log records to the log file, through the
+    queue. Returns the QueueListener."""
+    queue = Queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+    queue_handler = QueueHandler(queue)
+    queue_handler.setLevel(logging.INFO)
+    queue_handler.addFilter(RequestContextFilter())
+
+    listener = QueueListener(queue, [file_handler(app)], queue_handler)
+    listener.start()
+    # Write out whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.time()
+
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(queue_handler)
+
+    global log_listener
+    log_listener = listener
+    return listener
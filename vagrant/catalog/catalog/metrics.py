@@ -0,0 +1,223 @@
+"""Request metrics, exposed in the Prometheus text format.
+
+For each endpoint, records a histogram of request latencies, counts of
+requests by status and of errors, and the number of requests in flight.
+Also reports the state of the database connection pool, the number of
+log records dropped and the use of the compressed response cache.
+Recording a request costs two clock reads and two short lock holds.
+
+Metrics are kept in memory by each process, so when running several
+processes (such as the workers of serve.py) each one reports its own. Every
+series has a worker label holding the process id, so that scrapes reaching
+different workers give separate series, which can be summed, rather than
+counters which seem to go backwards."""
+
+from bisect import bisect_left
+import os
+import threading
+import time
+
+from flask import g, request
+
+from . import compression, logging_config
+
+
+def _labels(**labels):
+    labels['worker'] = os.getpid()
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\')
+                                     .replace('"', r'\"'))
+        for name, value in sorted(labels.items()))
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class RequestMetrics(object):
+    """Latency histograms, request and error counters and in-flight gauges,
+    by endpoint. buckets are the upper bounds, in seconds, of the latency
+    histogram buckets."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # {(endpoint, method): [bucket counts..., sum, count]}
+        self.latencies = {}
+        # {(endpoint, method, status): count}
+        self.requests = {}
+        # {endpoint: count}
+        self.errors = {}
+        self.in_flight = {}
+
+    def started(self, endpoint):
+        with self.lock:
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+
+    def finished(self, endpoint, method, status, seconds, error=False):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.in_flight[endpoint] -= 1
+            histogram = self.latencies.get((endpoint, method))
+            if histogram is None:
+                histogram = self.latencies[(endpoint, method)] = \
+                    [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def render(self):
+        """Returns the metrics as lines of the Prometheus text format"""
+        with self.lock:
+            latencies = dict((key, list(value))
+                             for key, value in self.latencies.items())
+            requests = self.requests.copy()
+            errors = self.errors.copy()
+            in_flight = self.in_flight.copy()
+
+        name = 'catalog_http_request_duration_seconds'
+        lines = ['# HELP %s Time taken to handle requests.' % name,
+                 '# TYPE %s histogram' % name]
+        for (endpoint, method), histogram in sorted(latencies.items()):
+            # Bucket counts are cumulative, ending with every request
+            cumulative = 0
+            bounds = []
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                bounds.append((_number(bound), cumulative))
+            bounds.append(('+Inf', histogram[-1]))
+            for bound, count in bounds:
+                lines.append('%s_bucket%s %d' % (
+                    name,
+                    _labels(endpoint=endpoint, method=method, le=bound),
+                    count))
+            labels = _labels(endpoint=endpoint, method=method)
+            lines.append('%s_sum%s %s' % (name, labels,
+                                          _number(histogram[-2])))
+            lines.append('%s_count%s %d' % (name, labels, histogram[-1]))
+
+        name = 'catalog_http_requests_total'
+        lines += ['# HELP %s Requests handled, by status.' % name,
+                  '# TYPE %s counter' % name]
+        for (endpoint, method, status), count in sorted(requests.items()):
+            lines.append('%s%s %d' % (name, _labels(endpoint=endpoint,
+                                                    method=method,
+                                                    status=status),
+                                      count))
+
+        name = 'catalog_http_request_errors_total'
+        lines += ['# HELP %s Requests which raised an exception or returned '
+                  'a 5xx status.' % name,
+                  '# TYPE %s counter' % name]
+        for endpoint, count in sorted(errors.items()):
+            lines.append('%s%s %d' % (name, _labels(endpoint=endpoint),
+                                      count))
+
+        name = 'catalog_http_requests_in_flight'
+        lines += ['# HELP %s Requests being handled.' % name,
+                  '# TYPE %s gauge' % name]
+        for endpoint, count in sorted(in_flight.items()):
+            lines.append('%s%s %d' % (name, _labels(endpoint=endpoint),
+                                      count))
+        return lines
+
+
+def pool_metrics(engine):
+    """Returns lines describing the state of the engine's connection pool.
+    Only pools which keep connections (not SQLite's default) report
+    anything."""
+    pool = engine.pool
+    gauges = [('size', 'Connections the pool keeps open.', 'size'),
+              ('checked_out', 'Connections in use.', 'checkedout'),
+              ('checked_in', 'Idle connections in the pool.', 'checkedin'),
+              ('overflow', 'Connections open beyond the pool size.',
+               'overflow')]
+    lines = []
+    for name, description, method in gauges:
+        if not hasattr(pool, method):
+            continue
+        name = 'catalog_db_pool_' + name
+        lines += ['# HELP %s %s' % (name, description),
+                  '# TYPE %s gauge' % name,
+                  # QueuePool counts unused overflow as negative
+                  '%s%s %d' % (name, _labels(),
+                               max(0, getattr(pool, method)()))]
+    return lines
+
+def log_metrics():
+    listener = logging_config.log_listener
+    if listener is None or listener.queue_handler is None:
+        return []
+    name = 'catalog_log_records_dropped_total'
+    return ['# HELP %s Log records dropped because the log queue was full.'
+            % name,
+            '# TYPE %s counter' % name,
+            '%s%s %d' % (name, _labels(), listener.queue_handler.dropped)]
+
+
+def compression_metrics():
+    cache = compression.compressed_cache
+    if cache is None:
+        return []
+    lines = []
+    for name, description, value in [
+            ('hits', 'Responses compressed from the cache.', cache.hits),
+            ('misses', 'Responses compressed and added to the cache.',
+             cache.misses)]:
+        name = 'catalog_compression_cache_%s_total' % name
+        lines += ['# HELP %s %s' % (name, description),
+                  '# TYPE %s counter' % name,
+                  '%s%s %d' % (name, _labels(), value)]
+    name = 'catalog_compression_cache_bytes'
+    return lines + ['# HELP %s Size of the compressed bodies cached.' % name,
+                    '# TYPE %s gauge' % name,
+                    '%s%s %d' % (name, _labels(), cache.size)]
+
+
+# The RequestMetrics being recorded, once instrument has been called
+request_metrics = None
+
+def instrument(app):
+    """Record metrics for every request the app handles, if METRICS_ENABLED
+    is set"""
+    if not app.config['METRICS_ENABLED']:
+        return
+    global request_metrics
+    request_metrics = RequestMetrics(app.config['METRICS_BUCKETS'])
+
+    @app.before_request
+    def start_metrics():
+        g.metrics_endpoint = request.endpoint or 'none'
+        g.metrics_started = time.time()
+        request_metrics.started(g.metrics_endpoint)
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_metrics(exception=None):
+        started = g.get('metrics_started')
+        if started is None:
+            return
+        status = g.get('metrics_status', 500)
+        if exception is not None:
+            status = 500
+        request_metrics.finished(g.metrics_endpoint,
+                                 request.method,
+                                 status,
+                                 time.time() - started,
+                                 error=status >= 500)
+
+def render_metrics(engine):
+    """Returns every metric, in the Prometheus text format"""
+    lines = []
+    if request_metrics is not None:
+        lines += request_metrics.render()
+    lines += pool_metrics(engine) + log_metrics() + compression_metrics()
+    return '\n'.join(lines) + '\n'
@@ -1,21 +1,38 @@
 from sqlalchemy import (Column, ForeignKey, Integer, String, Boolean,
-                        Table, DateTime, func)
+                        Table, DateTime, Index, Text, func)
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import sqlite
 
 from .database import Base
 
+# SQLite's CURRENT_TIMESTAMP, used for the server defaults below, has no
+# fractional seconds, but SQLAlchemy binds datetimes with microseconds by
+# default. Store and bind them in the same format, so that timestamps
+# compare correctly (needed when paginating by updated_on).
+Timestamp = DateTime().with_variant(
+    sqlite.DATETIME(
+        storage_format='%(year)04d-%(month)02d-%(day)02d '
+                       '%(hour)02d:%(minute)02d:%(second)02d',
+        regexp=r'(\d+)-(\d+)-(\d+) (\d+):(\d+):(\d+)'),
+    'sqlite')
+
 # Association table needed to create many-to-many relationship
 # between items and tags
 association_table = Table('item_tag', Base.metadata,
     Column('item_id', Integer, ForeignKey('item.id')),
-    Column('tag_id', Integer, ForeignKey('tag.id'))
+    Column('tag_id', Integer, ForeignKey('tag.id')),
+    # Used to find the tags for an item, and stops an item being given
+    # the same tag twice
+    Index('ix_item_tag_item_id_tag_id', 'item_id', 'tag_id', unique=True),
+    # Used to find the items for a tag
+    Index('ix_item_tag_tag_id_item_id', 'tag_id', 'item_id')
 )
 
 class Item(Base):
     __tablename__ = 'item'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(250), nullable=False)
+    name = Column(String(250), nullable=False, index=True)
     description = Column(String(250))
     picture_url = Column(String(250))
     tags = relationship(
@@ -27,15 +44,21 @@ class Item(Base):
         back_populates="items")
 
     # Columns for atom feed API
-    created_on = Column(DateTime, server_default=func.now())
-    updated_on = Column(DateTime,
+    created_on = Column(Timestamp, server_default=func.now())
+    updated_on = Column(Timestamp,
                         server_default=func.now(),
                         onupdate=func.now())
 
     # Columns for dealing with authorisation
-    user_id = Column(Integer,ForeignKey('user.id'))
+    user_id = Column(Integer,ForeignKey('user.id'), index=True)
     user = relationship('User')
 
+    # The index is used for the recent items feed and for paginating items.
+    # AUTOINCREMENT stops SQLite reusing the ids of deleted items, which
+    # would put new items into closed feed archive pages.
+    __table_args__ = (Index('ix_item_updated_on_id', 'updated_on', 'id'),
+                      {'sqlite_autoincrement': True})
+
     def __repr__(self):
         """Method to provide pretty printing for items"""
         return "<Item: name='%s', id=%s>" % (self.name, self.id)
@@ -67,19 +90,21 @@ class Tag(Base):
     user_id = Column(Integer,ForeignKey('user.id'))
     user = relationship('User')
 
+    # Number of items with this tag, kept up to date by the counters module
+    item_count = Column(Integer, nullable=False, default=0, server_default='0')
+
     def __repr__(self):
         """Method to provide pretty printing for tags"""
         return "<Tag: name='%s', id=%s>" % (self.name, self.id)
 
-    def serialize(self, include_items=False):
-        """Returns object data in serializeable format"""
-        result = {
+    def serialize(self):
+        """Returns object data in serializeable format. The tag's items are
+        left out, as there can be any number of them."""
+        return {
             'name': self.name,
             'id': self.id,
+            'item_count': self.item_count,
         }
-        if include_items:
-            result['items'] = [item.serialize() for item in self.items]
-        return result
 
 
 class User(Base):
@@ -87,10 +112,13 @@ class User(Base):
 
     id = Column(Integer, primary_key = True)
     name = Column(String(80), nullable = False)
-    email = Column(String(80), nullable = False)
+    email = Column(String(80), nullable = False, index = True)
     picture = Column(String(80))
     activated = Column(Boolean, default=True)
     admin = Column(Boolean, default=False)
+    # Number of items owned by the user, kept up to date by the counters
+    # module
+    item_count = Column(Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return "<User: name='%s', email='%s', id=%s, activated=%s, admin=%s>" \
@@ -117,4 +145,39 @@ class User(Base):
         db_session.add(newUser)
         db_session.commit()
         user = db_session.query(cls).filter_by(email=login_session['email']).one()
-        return user.id
\ No newline at end of file
+        return user.id
+
+
+class CatalogMeta(Base):
+    """Single row table holding a version number for the catalog, which is
+    increased whenever an item or tag changes (see the changes module). Used
+    to tell clients whether their copy of the catalog is still fresh
+    without having to look at the catalog itself. Also holds the total
+    numbers of items and tags (see the counters module)."""
+    __tablename__ = 'catalog_meta'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    item_count = Column(Integer, nullable=False, default=0, server_default='0')
+    tag_count = Column(Integer, nullable=False, default=0, server_default='0')
+    updated_on = Column(Timestamp,
+                        server_default=func.now(),
+                        onupdate=func.now())
+
+    def __repr__(self):
+        return "<CatalogMeta: version=%s, updated_on=%s>" \
+                % (self.version, self.updated_on)
+
+
+class FeedArchive(Base):
+    """A closed page of the archived Atom feed, stored once it has been
+    rendered, as its contents can no longer change (see the feeds module)"""
+    __tablename__ = 'feed_archive'
+
+    page = Column(Integer, primary_key=True, autoincrement=False)
+    body = Column(Text, nullable=False)
+    generated_on = Column(Timestamp, server_default=func.now())
+
+    def __repr__(self):
+        return "<FeedArchive: page=%s, generated_on=%s>" \
+                % (self.page, self.generated_on)
\ No newline at end of file
@@ -0,0 +1,335 @@
+"""Verifying users' identities with an identity provider when they log in.
+
+Calls to the provider are made through one pooled HTTP session per
+process, so connections to it are reused, and every call has a timeout.
+Once the authorisation code has been exchanged for an access token, the
+token info and user info, which are independent, are fetched at the same
+time. Token info is cached for OAUTH_TOKENINFO_CACHE_TTL seconds.
+
+IDENTITY_PROVIDER chooses Google, or a local stand-in which needs no
+network access, for development and load testing the login views. The
+local provider lets anyone log in as anyone, so must never be used in
+production."""
+
+from collections import OrderedDict, namedtuple
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import requests
+
+
+class OAuthError(Exception):
+    """Verification failed. status is the HTTP status to respond with."""
+
+    def __init__(self, message, status=401):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status = status
+
+
+# The details of a verified user
+Identity = namedtuple('Identity', ['subject', 'name', 'email', 'picture',
+                                   'access_token'])
+
+# The result of exchanging an authorisation code
+Credentials = namedtuple('Credentials', ['access_token', 'subject'])
+
+
+# HTTP
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def http_session():
+    """Returns the process's pooled HTTP session, creating it if needed"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            # Only retry failures to connect: a request which timed out
+            # reading the response may already have been handled
+            retries = Retry(total=current_app.config['OAUTH_RETRIES'],
+                            read=False)
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=current_app.config['OAUTH_POOL_SIZE'],
+                max_retries=retries)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+def _call(method, url, **kwargs):
+    """Make a request through the pooled session, returning the response.
+    Failures to reach the provider are raised as OAuthErrors."""
+    kwargs.setdefault('timeout', current_app.config['OAUTH_TIMEOUT'])
+    try:
+        return http_session().request(method, url, **kwargs)
+    except requests.Timeout:
+        raise OAuthError('Timed out contacting the identity provider.', 504)
+    except requests.RequestException:
+        raise OAuthError('Failed to contact the identity provider.', 502)
+
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        raise OAuthError('Invalid response from the identity provider.', 502)
+
+def in_parallel(*calls):
+    """Run the functions at the same time, each in its own thread (the last
+    in this one), returning their results. The first exception raised by
+    any of them is raised again here. The other threads run in the current
+    app's context."""
+    app = current_app._get_current_object()
+    results = [None] * len(calls)
+    errors = [None] * len(calls)
+
+    def call(index):
+        try:
+            results[index] = calls[index]()
+        except Exception as e:
+            errors[index] = e
+
+    def run(index):
+        with app.app_context():
+            call(index)
+
+    threads = [threading.Thread(target=run, args=(index,))
+               for index in range(len(calls) - 1)]
+    for thread in threads:
+        thread.start()
+    call(len(calls) - 1)
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
+# Token info cache
+
+class TTLCache(object):
+    """Small thread safe cache, whose entries expire, holding up to size
+    entries (the oldest are dropped first)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            expires, value = self.entries.get(key, (0, None))
+            if expires > time.time():
+                return value
+            self.entries.pop(key, None)
+            return None
+
+    def set(self, key, value, ttl):
+        if ttl <= 0 or self.size <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+_tokeninfo_cache = None
+
+def tokeninfo_cache():
+    global _tokeninfo_cache
+    if _tokeninfo_cache is None:
+        _tokeninfo_cache = TTLCache(
+            current_app.config['OAUTH_TOKENINFO_CACHE_SIZE'])
+    return _tokeninfo_cache
+
+def _token_key(access_token):
+    # Keep the tokens themselves out of memory where possible
+    return hashlib.sha256(access_token).hexdigest()
+
+
+# Providers
+
+class IdentityProvider(object):
+    """Verifies authorisation codes. Subclasses make the calls to the
+    provider, with these methods:
+
+    - exchange(code) returns the Credentials for an authorisation code
+    - tokeninfo(access_token) returns a dict with the user_id and issued_to
+      of an access token, and the seconds until it expires_in
+    - userinfo(access_token) returns a dict with the name, email and
+      picture of the user
+    - revoke(access_token) revokes the access token, returning whether it
+      worked"""
+
+    name = None
+    client_id = None
+
+    def cached_tokeninfo(self, access_token):
+        cache = tokeninfo_cache()
+        key = _token_key(access_token)
+        result = cache.get(key)
+        if result is None:
+            result = self.tokeninfo(access_token)
+            if result.get('error') is None:
+                ttl = current_app.config['OAUTH_TOKENINFO_CACHE_TTL']
+                expires_in = result.get('expires_in')
+                if expires_in is not None:
+                    ttl = min(ttl, int(expires_in))
+                cache.set(key, result, ttl)
+        return result
+
+    def verify(self, code):
+        """Exchange the authorisation code, check the access token was
+        issued to this app for the same user, and return their Identity.
+        Raises OAuthError if anything doesn't match."""
+        credentials = self.exchange(code)
+        access_token = credentials.access_token
+        tokeninfo, userinfo = in_parallel(
+            lambda: self.cached_tokeninfo(access_token),
+            lambda: self.userinfo(access_token))
+
+        if tokeninfo.get('error') is not None:
+            raise OAuthError(tokeninfo.get('error'), 500)
+        # Verify that the access token is used for the intended user.
+        if tokeninfo.get('user_id') != credentials.subject:
+            raise OAuthError("Token's user ID doesn't match given user ID.")
+        # Verify that the access token is valid for this app.
+        if tokeninfo.get('issued_to') != self.client_id:
+            raise OAuthError("Token's client ID does not match app's.")
+        if not userinfo.get('email'):
+            raise OAuthError("The identity provider gave no email address.")
+
+        return Identity(credentials.subject,
+                        userinfo.get('name'),
+                        userinfo['email'],
+                        userinfo.get('picture'),
+                        access_token)
+
+
+class GoogleProvider(IdentityProvider):
+    """Google's OAuth2 service, using the client secrets downloaded from the
+    Google developers console"""
+
+    name = 'google'
+    tokeninfo_url = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+    userinfo_url = 'https://www.googleapis.com/oauth2/v1/userinfo'
+    revoke_url = 'https://accounts.google.com/o/oauth2/revoke'
+
+    def __init__(self, secrets_file):
+        with open(secrets_file, 'r') as f:
+            self.secrets = json.load(f)['web']
+        self.client_id = self.secrets['client_id']
+
+    def exchange(self, code):
+        response = _call('POST', self.secrets['token_uri'], data={
+            'grant_type': 'authorization_code',
+            'code': code,
+            'client_id': self.client_id,
+            'client_secret': self.secrets['client_secret'],
+            'redirect_uri': 'postmessage',
+        })
+        result = _json(response)
+        if response.status_code != 200 or 'access_token' not in result:
+            raise OAuthError('Failed to upgrade the authorization code.')
+        try:
+            # The ID token came straight from the provider over TLS, so
+            # its claims can be read without checking the signature
+            payload = result['id_token'].split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            subject = json.loads(base64.urlsafe_b64decode(
+                payload.encode('ascii')))['sub']
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise OAuthError('Failed to upgrade the authorization code.')
+        return Credentials(result['access_token'], subject)
+
+    def tokeninfo(self, access_token):
+        return _json(_call('GET', self.tokeninfo_url,
+                           params={'access_token': access_token}))
+
+    def userinfo(self, access_token):
+        response = _call('GET', self.userinfo_url,
+                         params={'access_token': access_token, 'alt': 'json'})
+        if response.status_code != 200:
+            raise OAuthError('Failed to get user info.')
+        return _json(response)
+
+    def revoke(self, access_token):
+        response = _call('GET', self.revoke_url,
+                         params={'token': access_token})
+        return response.status_code == 200
+
+
+class LocalProvider(IdentityProvider):
+    """Stand-in provider which accepts any email address as the
+    authorisation code, without making any network calls. Each call waits
+    LOCAL_IDENTITY_LATENCY_MS, to stand in for the real provider's
+    latency."""
+
+    name = 'local'
+    client_id = 'local'
+
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000.0
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def exchange(self, code):
+        self._wait()
+        email = (code or '').strip().lower()
+        if '@' not in email:
+            raise OAuthError('Failed to upgrade the authorization code.')
+        return Credentials('local:' + email, email)
+
+    def tokeninfo(self, access_token):
+        self._wait()
+        if not access_token.startswith('local:'):
+            return {'error': 'invalid_token'}
+        return {'user_id': access_token[len('local:'):],
+                'issued_to': self.client_id,
+                'expires_in': 3600}
+
+    def userinfo(self, access_token):
+        self._wait()
+        email = access_token[len('local:'):]
+        return {'name': email.split('@')[0], 'email': email, 'picture': ''}
+
+    def revoke(self, access_token):
+        self._wait()
+        return True
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+def identity_provider():
+    """Returns the configured IdentityProvider, loading the client secrets
+    the first time it is needed"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            config = current_app.config
+            if config['IDENTITY_PROVIDER'] == 'local':
+                current_app.logger.warning(
+                    'Using the local identity provider: anyone can log in '
+                    'as any user')
+                _provider = LocalProvider(config['LOCAL_IDENTITY_LATENCY_MS'])
+            else:
+                _provider = GoogleProvider(os.path.join(
+                    current_app.instance_path, 'client_secrets.json'))
+        return _provider
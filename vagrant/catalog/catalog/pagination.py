@@ -0,0 +1,186 @@
+"""Keyset (cursor based) pagination helpers.
+
+Rather than using OFFSET, which makes the database walk past every skipped
+row, pages are selected by comparing against the sort key of the last row
+seen. Cursors are opaque url-safe strings holding that key and the
+direction of travel, so the cost of fetching a page stays the same however
+deep into the table it is."""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import request, abort
+from sqlalchemy import and_, or_, DateTime, Integer, String
+
+from . import app
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class Page(object):
+    """A single page of results, along with the cursors needed to fetch
+    the pages either side of it. A cursor is None if there is no page in
+    that direction."""
+
+    def __init__(self, rows, next_cursor, prev_cursor, limit):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.limit = limit
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def paging(self):
+        """Returns the paging information in serializeable format, for
+        inclusion in JSON responses"""
+        return {
+            'next': self.next_cursor,
+            'prev': self.prev_cursor,
+            'limit': self.limit,
+        }
+
+
+# Cursor encoding
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.strftime(DATETIME_FORMAT)}
+    return value
+
+def _decode_value(value, column):
+    """Decode a value from a cursor, checking that it suits the column it
+    is compared with. Raises ValueError if not."""
+    # Variants (such as models.Timestamp) wrap the generic type
+    column_type = getattr(column.type, 'impl', column.type)
+    if isinstance(column_type, DateTime):
+        if not isinstance(value, dict):
+            raise ValueError('Invalid cursor')
+        return datetime.strptime(value['dt'], DATETIME_FORMAT)
+    if isinstance(column_type, Integer):
+        if isinstance(value, bool) or not isinstance(value, (int, long)):
+            raise ValueError('Invalid cursor')
+        return value
+    if isinstance(column_type, String):
+        if not isinstance(value, basestring):
+            raise ValueError('Invalid cursor')
+        return value
+    raise ValueError('Invalid cursor')
+
+def encode_cursor(direction, key):
+    """Encode a direction ('next' or 'prev') and a row's sort key as an
+    opaque cursor string"""
+    data = json.dumps({'d': direction,
+                       'k': [_encode_value(value) for value in key]},
+                      separators=(',', ':'))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor string for a query ordered by columns, returning a
+    (direction, key) tuple. Raises ValueError if the cursor is malformed."""
+    try:
+        padded = str(cursor) + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded))
+        direction = data['d']
+        values = data['k']
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('Invalid cursor')
+        key = [_decode_value(value, column)
+               for value, column in zip(values, columns)]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise ValueError('Invalid cursor')
+    if direction not in ('next', 'prev'):
+        raise ValueError('Invalid cursor')
+    return direction, key
+
+
+# Query building
+
+def _after(columns, key, descending):
+    """Build a filter selecting the rows strictly after the given key in
+    the sort order. Expanded rather than using tuple comparison, so that it
+    works on every database we support."""
+    column, value = columns[0], key[0]
+    if descending:
+        beyond = column < value
+    else:
+        beyond = column > value
+    if len(columns) == 1:
+        return beyond
+    return or_(beyond,
+               and_(column == value, _after(columns[1:], key[1:], descending)))
+
+def _row_key(row, columns):
+    return [getattr(row, column.key) for column in columns]
+
+def paginate(query, columns, cursor=None, limit=20, descending=False,
+             row_key=None):
+    """Return a Page of results from query, ordered by the given columns.
+    The final column must be unique (normally the primary key) so that the
+    ordering is total. row_key returns a row's values for the columns, for
+    columns which aren't attributes of the rows."""
+    direction = 'next'
+    key = None
+    if cursor:
+        direction, key = decode_cursor(cursor, columns)
+
+    # When paging backwards, walk the index in reverse and flip the
+    # rows round afterwards.
+    reverse = (direction == 'prev')
+    query_descending = descending != reverse
+    if key is not None:
+        query = query.filter(_after(columns, key, query_descending))
+    if query_descending:
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*columns)
+
+    # Fetch one extra row to find out if there is another page after this one
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if reverse:
+        rows.reverse()
+
+    if row_key is None:
+        row_key = lambda row: _row_key(row, columns)
+    next_cursor = prev_cursor = None
+    if rows:
+        if reverse:
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, key is not None
+        if has_next:
+            next_cursor = encode_cursor('next', row_key(rows[-1]))
+        if has_prev:
+            prev_cursor = encode_cursor('prev', row_key(rows[0]))
+
+    return Page(rows, next_cursor, prev_cursor, limit)
+
+
+# Request helpers
+
+def page_limit():
+    """Read the page size from the request, clamped to the configured
+    maximum"""
+    default = app.config['PAGE_SIZE']
+    maximum = app.config['MAX_PAGE_SIZE']
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, maximum))
+
+def paginate_request(query, columns, cursor_arg='cursor', descending=False,
+                     row_key=None):
+    """Paginate query using the cursor and limit from the current request.
+    Throws a 400 if the cursor is invalid."""
+    try:
+        return paginate(query, columns,
+                        cursor=request.args.get(cursor_arg),
+                        limit=page_limit(),
+                        descending=descending,
+                        row_key=row_key)
+    except ValueError:
+        abort(400)
@@ -0,0 +1,146 @@
+"""Opt-in profiling of the SQL run by each request.
+
+When SQL_PROFILER_ENABLED is set, engine events record every statement a
+request runs, with its duration. Statements are grouped by shape (the SQL
+with its IN lists and literal numbers collapsed), so that the same query
+being run once per row of a loop, the N+1 pattern, shows up as a shape
+repeated many times.
+
+Each profiled response gets an X-SQL-Profile header summarising it, and
+requests which run too many statements, spend too long in the database or
+repeat a shape too often are logged as warnings. The most recent profiles
+are kept for the admin SQL profile page."""
+
+from collections import deque
+import re
+import threading
+import time
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+# Collapse the parts of statements which vary between otherwise identical
+# queries: lists of placeholders (from IN clauses and multi-row inserts)
+# and literal numbers
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,)+'
+                               r'\s*(?:\?|%\(\w+\)s|:\w+)\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_WHITESPACE = re.compile(r'\s+')
+
+def statement_shape(statement):
+    shape = _PLACEHOLDER_LIST.sub('(...)', statement)
+    shape = _NUMBER.sub('N', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class SQLProfile(object):
+    """The statements run while handling a single request"""
+
+    def __init__(self, endpoint, method, path):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.statements = 0
+        self.seconds = 0.0
+        # {shape: [count, total seconds]}
+        self.shapes = {}
+        self.problems = []
+
+    def record(self, statement, seconds):
+        self.statements += 1
+        self.seconds += seconds
+        totals = self.shapes.setdefault(statement_shape(statement), [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+    def repeated(self, threshold):
+        """Returns (shape, count, seconds) for the shapes run at least
+        threshold times, most repeated first"""
+        return sorted(((shape, count, seconds)
+                       for shape, (count, seconds) in self.shapes.items()
+                       if count >= threshold),
+                      key=lambda repeat: -repeat[1])
+
+    def check(self, config):
+        """Note which of the configured thresholds the request went over"""
+        if self.statements > config['SQL_PROFILER_MAX_STATEMENTS']:
+            self.problems.append('%d statements' % self.statements)
+        if self.seconds * 1000 > config['SQL_PROFILER_MAX_TIME_MS']:
+            self.problems.append('%.1f ms in the database'
+                                 % (self.seconds * 1000))
+        for shape, count, seconds in self.repeated(
+                config['SQL_PROFILER_REPEAT_THRESHOLD']):
+            self.problems.append('%d times: %s' % (count, shape))
+        return self.problems
+
+    def header(self):
+        """Summary for the X-SQL-Profile header"""
+        repeated = max([count for count, seconds in self.shapes.values()]
+                       or [0])
+        return 'statements=%d; time_ms=%.1f; shapes=%d; max_repeat=%d' % (
+            self.statements, self.seconds * 1000, len(self.shapes), repeated)
+
+
+# Recent profiles, newest first, for the admin page
+_recent = deque()
+_recent_lock = threading.Lock()
+
+def recent_profiles():
+    with _recent_lock:
+        return list(_recent)
+
+def _remember(profile, size):
+    with _recent_lock:
+        _recent.appendleft(profile)
+        while len(_recent) > size:
+            _recent.pop()
+
+
+def _current_profile():
+    if has_request_context():
+        return g.get('sql_profile')
+    return None
+
+def start_profiler(app, engines):
+    """Profile the SQL run by each request on any of engines, if
+    SQL_PROFILER_ENABLED is set"""
+    if not app.config['SQL_PROFILER_ENABLED']:
+        return
+
+    def start_statement(conn, cursor, statement, parameters, context,
+                        executemany):
+        if _current_profile() is not None:
+            conn.info.setdefault('sql_profile_started', []).append(
+                time.time())
+
+    def finish_statement(conn, cursor, statement, parameters, context,
+                         executemany):
+        profile = _current_profile()
+        started = conn.info.get('sql_profile_started')
+        if profile is not None and started:
+            profile.record(statement, time.time() - started.pop())
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', start_statement)
+        event.listen(engine, 'after_cursor_execute', finish_statement)
+
+    @app.before_request
+    def start_request_profile():
+        g.sql_profile = SQLProfile(request.endpoint, request.method,
+                                   request.path)
+
+    @app.after_request
+    def finish_request_profile(response):
+        profile = g.pop('sql_profile', None)
+        if profile is None:
+            return response
+        if profile.check(app.config):
+            app.logger.warning(
+                "SQL profile over limits for {} {}: {}".format(
+                    profile.method, profile.path,
+                    '; '.join(profile.problems)))
+        if app.config['SQL_PROFILER_HEADER']:
+            response.headers['X-SQL-Profile'] = profile.header()
+        _remember(profile, app.config['SQL_PROFILER_HISTORY'])
+        return response
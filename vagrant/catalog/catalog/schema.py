@@ -0,0 +1,179 @@
+"""Schema migration helpers, for bringing an existing database up to date
+with the models without losing its data.
+
+init_db only creates tables which don't exist yet, so columns and indexes
+added to the models later are missing from older databases. upgrade_schema
+compares the database with the models and adds whatever is missing. It
+never drops or alters anything, so it is safe to run repeatedly."""
+
+import time
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from .database import Base
+
+
+def _existing_columns(inspector, table_name):
+    return set(column['name'] for column in inspector.get_columns(table_name))
+
+def _existing_indexes(inspector, table_name):
+    return set(index['name'] for index in inspector.get_indexes(table_name))
+
+def _missing_autoincrement(engine, table):
+    """Whether table is declared with sqlite_autoincrement but the SQLite
+    database's copy was created without it"""
+    if (engine.dialect.name != 'sqlite'
+            or not table.dialect_options['sqlite']['autoincrement']):
+        return False
+    sql = engine.execute(
+        text("SELECT sql FROM sqlite_master "
+             "WHERE type = 'table' AND name = :name"),
+        name=table.name).scalar()
+    return sql is not None and 'AUTOINCREMENT' not in sql.upper()
+
+def _rebuild_table(connection, table):
+    """Recreate table as the models declare it, keeping its rows, for
+    changes SQLite can't make with ALTER TABLE. The new table is created
+    under another name then renamed, so that references to the table from
+    other tables still hold."""
+    preparer = connection.dialect.identifier_preparer
+    name = preparer.format_table(table)
+    rebuilt = preparer.quote(table.name + '_rebuilt')
+    ddl = unicode(CreateTable(table).compile(dialect=connection.dialect))
+    connection.execute(text(ddl.replace(u'CREATE TABLE %s ' % name,
+                                        u'CREATE TABLE %s ' % rebuilt, 1)))
+    columns = ', '.join(preparer.quote(column) for column in
+                        _existing_columns(inspect(connection), table.name)
+                        if column in table.columns)
+    connection.execute(text('INSERT INTO %s (%s) SELECT %s FROM %s'
+                            % (rebuilt, columns, columns, name)))
+    connection.execute(text('DROP TABLE %s' % name))
+    connection.execute(text('ALTER TABLE %s RENAME TO %s' % (rebuilt, name)))
+    for index in table.indexes:
+        index.create(connection)
+
+def upgrade_schema(engine, dry_run=False):
+    """Create any tables, columns and indexes declared by the models but
+    missing from the database. Returns a list of (description, error)
+    tuples, where error is None if the change succeeded."""
+    import catalog.models
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+    added_columns = set()
+
+    def apply_change(description, statement):
+        error = None
+        if not dry_run:
+            try:
+                with engine.begin() as connection:
+                    statement(connection)
+            except DBAPIError as e:
+                error = str(e.orig)
+        changes.append((description, error))
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            added_columns.update((table.name, column.name)
+                                 for column in table.columns)
+            # Creating the table also creates its indexes
+            apply_change('Create table %s' % table.name,
+                         lambda conn, table=table: table.create(conn))
+            continue
+
+        columns = _existing_columns(inspector, table.name)
+        for column in table.columns:
+            if column.name not in columns:
+                added_columns.add((table.name, column.name))
+                ddl = 'ALTER TABLE %s ADD COLUMN %s' % (
+                    table.name,
+                    CreateColumn(column).compile(dialect=engine.dialect))
+                apply_change('Add column %s.%s' % (table.name, column.name),
+                             lambda conn, ddl=ddl: conn.execute(text(ddl)))
+
+        indexes = _existing_indexes(inspector, table.name)
+        for index in table.indexes:
+            if index.name not in indexes:
+                apply_change('Create index %s' % index.name,
+                             lambda conn, index=index: index.create(conn))
+
+    # Item ids must never be reused (see the feeds module), which SQLite
+    # only ensures for tables created with AUTOINCREMENT. Archive pages
+    # stored before then may hold items whose ids were reused, so they are
+    # deleted, to be rendered again when next requested.
+    from .models import Item, FeedArchive
+    if _missing_autoincrement(engine, Item.__table__):
+        def rebuild_items(connection):
+            _rebuild_table(connection, Item.__table__)
+            connection.execute(FeedArchive.__table__.delete())
+        apply_change('Rebuild table item with AUTOINCREMENT', rebuild_items)
+
+    from .search import SEARCH_TABLE, create_search_index, \
+                        rebuild_search_index
+    if SEARCH_TABLE not in existing_tables:
+        def create_and_fill(connection):
+            create_search_index(connection)
+            rebuild_search_index(connection)
+        apply_change('Create and fill search index %s' % SEARCH_TABLE,
+                     create_and_fill)
+
+    if not dry_run:
+        from .changes import seed_catalog_meta
+        with engine.begin() as connection:
+            seed_catalog_meta(connection)
+
+    # Newly added counters start at zero, so count what they should hold
+    from .counters import COUNTER_COLUMNS, reconcile_counts
+    if added_columns & set(COUNTER_COLUMNS):
+        apply_change('Fill in item and tag counts',
+                     lambda conn: reconcile_counts(conn))
+
+    return changes
+
+
+# Query plans for the hot lookups, to show the effect of the indexes
+
+def hot_queries():
+    """Returns (description, query) pairs for the lookups the views make
+    most often. Only the columns the indexes serve are selected, so that
+    the queries also run on a database which hasn't been upgraded yet."""
+    from .models import Item, User, association_table
+    return [
+        ('viewItem/owner_only: item by name and id',
+         select([Item.id, Item.name]).where(Item.name == 'Chair')
+                                     .where(Item.id == 2)),
+        ('Item name lookup',
+         select([Item.id]).where(Item.name == 'Chair')),
+        ('getIDByEmail: user by email',
+         select([User.id]).where(User.email == 'bob@example.com')),
+        ('recentAtom/index: items by updated_on',
+         select([Item.id, Item.updated_on])
+             .order_by(Item.updated_on.desc(), Item.id.desc())
+             .limit(10)),
+        ('Tag.items: items for a tag',
+         select([association_table.c.item_id])
+             .where(association_table.c.tag_id == 1)),
+        ('Item.tags: tags for an item',
+         select([association_table.c.tag_id])
+             .where(association_table.c.item_id == 1)),
+    ]
+
+def explain(engine, query):
+    """Returns the database's query plan for query, as a list of lines"""
+    sql = str(query.compile(dialect=engine.dialect,
+                            compile_kwargs={'literal_binds': True}))
+    if engine.dialect.name == 'sqlite':
+        rows = engine.execute(text('EXPLAIN QUERY PLAN ' + sql))
+        return [row[-1] for row in rows]
+    rows = engine.execute(text('EXPLAIN ' + sql))
+    return [row[0] for row in rows]
+
+def time_query(engine, query, repeat=100):
+    """Returns the mean time in milliseconds taken to run query"""
+    with engine.connect() as connection:
+        start = time.time()
+        for _ in range(repeat):
+            connection.execute(query).fetchall()
+        return (time.time() - start) * 1000 / repeat
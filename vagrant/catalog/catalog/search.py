@@ -0,0 +1,205 @@
+"""Full text search over items.
+
+Each item's name, description and tag names are kept in a search index
+table: an FTS5 virtual table on SQLite, or a table of tsvectors with a GIN
+index on Postgres. The index is kept up to date in the same transaction as
+the changes to the items, by a session event which reindexes every item
+touched by a flush (including items whose tags were renamed or deleted).
+
+The table is not one of the models, as SQLAlchemy can't create virtual
+tables, so create_search_index is called by init_db and migratedb.py
+instead."""
+
+import re
+
+from sqlalchemy import event, inspect, text, bindparam
+from sqlalchemy.orm.attributes import get_history
+
+from . import app
+from .database import DBSession
+from .models import Item, Tag, association_table
+
+SEARCH_TABLE = 'item_search'
+
+
+# Index maintenance
+
+def _items_documents(connection, item_ids):
+    """Returns {item id: (name, description, tag names)} for the items
+    which still exist"""
+    if not item_ids:
+        return {}
+    items = Item.__table__
+    rows = connection.execute(
+        items.select().with_only_columns([items.c.id, items.c.name,
+                                          items.c.description])
+             .where(items.c.id.in_(item_ids)))
+    documents = dict((row.id, (row.name, row.description or u'', []))
+                     for row in rows)
+    tags = Tag.__table__
+    rows = connection.execute(
+        association_table.join(tags).select()
+            .with_only_columns([association_table.c.item_id, tags.c.name])
+            .where(association_table.c.item_id.in_(item_ids)))
+    for row in rows:
+        documents[row.item_id][2].append(row.name)
+    return documents
+
+def index_items(connection, item_ids):
+    """Bring the search index up to date for the given items, removing any
+    which no longer exist"""
+    item_ids = list(item_ids)
+    if not item_ids or not app.config['SEARCH_ENABLED']:
+        return
+    documents = _items_documents(connection, item_ids)
+    rows = [{'item_id': item_id,
+             'name': name,
+             'description': description,
+             'tags': u' '.join(tag_names)}
+            for item_id, (name, description, tag_names)
+            in documents.items()]
+
+    if connection.dialect.name == 'postgresql':
+        connection.execute(
+            text('DELETE FROM item_search WHERE item_id IN :ids')
+                .bindparams(bindparam('ids', expanding=True)),
+            ids=item_ids)
+        if rows:
+            connection.execute(text(
+                "INSERT INTO item_search (item_id, document) VALUES "
+                "(:item_id, "
+                " setweight(to_tsvector(:language, :name), 'A') || "
+                " setweight(to_tsvector(:language, :tags), 'B') || "
+                " setweight(to_tsvector(:language, :description), 'C'))"),
+                [dict(row, language=app.config['SEARCH_LANGUAGE'])
+                 for row in rows])
+    else:
+        connection.execute(
+            text('DELETE FROM item_search WHERE rowid IN :ids')
+                .bindparams(bindparam('ids', expanding=True)),
+            ids=item_ids)
+        if rows:
+            connection.execute(text(
+                "INSERT INTO item_search (rowid, name, description, tags) "
+                "VALUES (:item_id, :name, :description, :tags)"), rows)
+
+def create_search_index(connection):
+    """Create the search index table if it doesn't exist. Returns True if
+    it was created, in which case it needs filling with rebuild_search_index.
+    """
+    if SEARCH_TABLE in inspect(connection).get_table_names():
+        return False
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            'CREATE TABLE item_search ('
+            ' item_id INTEGER PRIMARY KEY REFERENCES item (id)'
+            '  ON DELETE CASCADE,'
+            ' document TSVECTOR NOT NULL)'))
+        connection.execute(text(
+            'CREATE INDEX ix_item_search_document ON item_search '
+            'USING GIN (document)'))
+    else:
+        connection.execute(text(
+            'CREATE VIRTUAL TABLE item_search '
+            'USING fts5(name, description, tags)'))
+    return True
+
+def rebuild_search_index(connection, batch_size=1000):
+    """Reindex every item"""
+    items = Item.__table__
+    last_id = 0
+    while True:
+        ids = [row.id for row in connection.execute(
+            items.select().with_only_columns([items.c.id])
+                 .where(items.c.id > last_id)
+                 .order_by(items.c.id)
+                 .limit(batch_size))]
+        if not ids:
+            return
+        index_items(connection, ids)
+        last_id = ids[-1]
+
+
+# Keeping the index in sync with the session
+
+def _touched_before_flush(session):
+    """Ids of the items affected by deleted items, and by deleted or renamed
+    tags, found before the flush changes the tags' items"""
+    item_ids = set()
+    for obj in session.deleted:
+        if isinstance(obj, Item):
+            item_ids.add(obj.id)
+        elif isinstance(obj, Tag):
+            item_ids.update(item.id for item in obj.items)
+    for obj in session.dirty:
+        if isinstance(obj, Tag) and get_history(obj, 'name').deleted:
+            item_ids.update(item.id for item in obj.items)
+    return item_ids
+
+def _touched_after_flush(session):
+    """Ids of the new and changed items, found after the flush has given
+    the new items their ids"""
+    item_ids = set()
+    for obj in session.new:
+        if isinstance(obj, Item):
+            item_ids.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Item) and session.is_modified(obj):
+            item_ids.add(obj.id)
+    return item_ids
+
+@event.listens_for(DBSession, 'before_flush')
+def collect_touched_items_before(session, flush_context, instances):
+    if app.config['SEARCH_ENABLED']:
+        touched = session.info.setdefault('search_touched_items', set())
+        touched.update(_touched_before_flush(session))
+
+@event.listens_for(DBSession, 'after_flush')
+def collect_touched_items_after(session, flush_context):
+    if app.config['SEARCH_ENABLED']:
+        touched = session.info.setdefault('search_touched_items', set())
+        touched.update(_touched_after_flush(session))
+
+@event.listens_for(DBSession, 'after_flush_postexec')
+def reindex_touched_items(session, flush_context):
+    touched = session.info.pop('search_touched_items', None)
+    if touched:
+        touched.discard(None)
+        index_items(session.connection(), touched)
+
+
+# Searching
+
+def search_terms(query):
+    """Split a user's search query into words"""
+    return re.findall(r'\w+', query, re.UNICODE)
+
+def _fts5_query(terms):
+    """Build an FTS5 query matching all of the words"""
+    # Quote each word so that FTS5 doesn't treat any of them as operators,
+    # and match the last one as a prefix, for searching as you type
+    quoted = [u'"%s"' % term for term in terms]
+    quoted[-1] += u'*'
+    return u' '.join(quoted)
+
+def search_item_ids(connection, query, limit, offset=0):
+    """Returns the ids of the items best matching query, best first"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if connection.dialect.name == 'postgresql':
+        rows = connection.execute(text(
+            "SELECT item_id FROM item_search, "
+            " plainto_tsquery(:language, :query) AS query "
+            "WHERE document @@ query "
+            "ORDER BY ts_rank(document, query) DESC, item_id "
+            "LIMIT :limit OFFSET :offset"),
+            language=app.config['SEARCH_LANGUAGE'],
+            query=u' '.join(terms), limit=limit, offset=offset)
+    else:
+        rows = connection.execute(text(
+            "SELECT rowid FROM item_search WHERE item_search MATCH :query "
+            "ORDER BY bm25(item_search, 10.0, 1.0, 5.0), rowid "
+            "LIMIT :limit OFFSET :offset"),
+            query=_fts5_query(terms), limit=limit, offset=offset)
+    return [row[0] for row in rows]
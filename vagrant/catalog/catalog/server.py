@@ -0,0 +1,329 @@
+"""Pre-forking HTTP server for running the catalog in production.
+
+The master process loads the app, its views and templates, opens the
+listening socket, then forks SERVER_WORKERS worker processes which share
+the socket. Each worker serves requests from a pool of SERVER_THREADS
+threads, with its own database connection pool and log writer thread.
+
+The master restarts workers which die, and handles these signals:
+
+    TERM, INT   stop accepting connections, let the workers finish the
+                requests they have (for up to SERVER_GRACEFUL_TIMEOUT
+                seconds), then exit
+    HUP         start a new set of workers, then drain and stop the old
+                ones, without refusing any connections
+    TTIN, TTOU  add or remove a worker
+
+Workers exit, after draining, on TERM or INT, or if the master dies. With
+SERVER_WARMUP set, each worker makes its first requests (see the
+template_cache module) before it starts accepting connections."""
+
+import Queue
+import errno
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import sys
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from .template_cache import compile_templates, warm_up
+
+log = logging.getLogger('catalog.server')
+
+
+class RequestHandler(WSGIRequestHandler):
+    # Seconds a client has to send its request, so that slow clients can't
+    # hold on to threads
+    timeout = 30
+
+
+class WorkerServer(BaseWSGIServer):
+    """WSGI server whose requests are handled by a fixed pool of threads.
+    While every thread is busy, new connections are left for the other
+    workers to accept."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads):
+        BaseWSGIServer.__init__(self, host, port, app,
+                                handler=RequestHandler)
+        self.threads = threads
+        self.requests = None
+        self.pool = []
+        # Every worker waits on the same socket, and only one of them gets
+        # each connection, so the others mustn't block in accept
+        self.socket.setblocking(0)
+
+    def start_threads(self):
+        self.requests = Queue.Queue(maxsize=self.threads)
+        self.pool = [threading.Thread(target=self._work,
+                                      name='catalog-request-%d' % index)
+                     for index in range(self.threads)]
+        for thread in self.pool:
+            thread.daemon = True
+            thread.start()
+
+    def stop_threads(self, timeout):
+        """Let the threads finish the queued requests, waiting up to timeout
+        seconds. Returns whether they all finished."""
+        for _ in self.pool:
+            self.requests.put(None)
+        deadline = time.time() + timeout
+        for thread in self.pool:
+            thread.join(max(0, deadline - time.time()))
+        return not any(thread.is_alive() for thread in self.pool)
+
+    def get_request(self):
+        connection, address = self.socket.accept()
+        connection.setblocking(1)
+        return connection, address
+
+    def process_request(self, request, client_address):
+        # Blocks while every thread is busy and the queue is full
+        self.requests.put((request, client_address))
+
+    def _work(self):
+        while True:
+            job = self.requests.get()
+            if job is None:
+                return
+            request, client_address = job
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+def preload(app):
+    """Load what the workers share before forking, so that it is only done
+    once and its memory is shared: the lazily loaded views and the
+    templates"""
+    from .lazyviews import load_lazy_views
+    load_lazy_views()
+    compile_templates(app)
+
+def before_fork(app):
+    """Close what the workers mustn't share: database connections, and the
+    log writer thread, whose queue lock could be held at the fork"""
+    from .database import all_engines
+    from . import logging_config
+    for engine in all_engines():
+        engine.dispose()
+    if logging_config.log_listener is not None:
+        logging_config.log_listener.stop()
+
+def after_fork(app):
+    """Set up the state each process needs its own copy of"""
+    from .database import all_engines
+    from . import logging_config
+    for engine in all_engines():
+        engine.dispose()
+    random.seed()
+    if logging_config.log_listener is not None:
+        logging_config.log_listener.start()
+
+
+def run_worker(app, server, master_pid, graceful_timeout):
+    """Serve requests until told to stop, then drain and exit. Never
+    returns."""
+    def stop(signum=None, frame=None):
+        # shutdown waits for serve_forever to return, so can't be called
+        # from the thread running it
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for signum in (signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+        signal.signal(signum, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    def watch_master():
+        while os.getppid() == master_pid:
+            time.sleep(1)
+        log.warning('Master %d has gone, stopping', master_pid)
+        stop()
+
+    status = 0
+    try:
+        after_fork(app)
+        if app.config['SERVER_WARMUP']:
+            failed = warm_up(app)
+            if failed:
+                log.warning('Worker %d warm up failed for %s', os.getpid(),
+                            ', '.join(failed))
+        server.start_threads()
+        watchdog = threading.Thread(target=watch_master)
+        watchdog.daemon = True
+        watchdog.start()
+        # Closes the listening socket once it returns
+        server.serve_forever()
+        if not server.stop_threads(graceful_timeout):
+            log.warning('Worker %d stopped with requests unfinished',
+                        os.getpid())
+    except Exception:
+        log.exception('Worker %d failed', os.getpid())
+        status = 1
+    finally:
+        from . import logging_config
+        if logging_config.log_listener is not None:
+            logging_config.log_listener.stop()
+        os._exit(status)
+
+
+class Master(object):
+    """Forks the workers and keeps the right number of them running"""
+
+    def __init__(self, app, server, workers, graceful_timeout):
+        self.app = app
+        self.server = server
+        self.count = workers
+        self.graceful_timeout = graceful_timeout
+        # {pid: generation}. Workers from earlier generations are draining.
+        self.workers = {}
+        self.generation = 0
+        self.signals = []
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.app, self.server, self.pid, self.graceful_timeout)
+        self.workers[pid] = self.generation
+        log.info('Started worker %d', pid)
+
+    def current(self):
+        return [pid for pid, generation in self.workers.items()
+                if generation == self.generation]
+
+    def spawn_workers(self):
+        missing = self.count - len(self.current())
+        if missing <= 0:
+            return
+        before_fork(self.app)
+        try:
+            for _ in range(missing):
+                self.spawn()
+        finally:
+            after_fork(self.app)
+
+    def signal_workers(self, signum, pids=None):
+        for pid in (self.workers.keys() if pids is None else pids):
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def reap(self):
+        """Forget the workers which have exited"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation and status != 0:
+                log.warning('Worker %d exited unexpectedly (status %d)',
+                            pid, status)
+
+    def handle(self, signum, frame):
+        self.signals.append(signum)
+
+    def stop(self):
+        """Stop every worker, waiting for them to drain, and killing those
+        still running after the graceful timeout"""
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self.workers and time.time() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        if self.workers:
+            log.warning('Killing %d workers which did not stop',
+                        len(self.workers))
+            self.signal_workers(signal.SIGKILL)
+            while self.workers:
+                time.sleep(0.1)
+                self.reap()
+
+    def restart(self):
+        """Start a new generation of workers, then drain the old ones. The
+        new ones are accepting connections before the old ones stop."""
+        old = self.current()
+        self.generation += 1
+        self.spawn_workers()
+        self.signal_workers(signal.SIGTERM, old)
+
+    def run(self):
+        self.pid = os.getpid()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP,
+                       signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, self.handle)
+        log.info('Listening at http://%s:%d with %d workers of %d threads',
+                 self.server.host, self.server.port, self.count,
+                 self.server.threads)
+        self.spawn_workers()
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    log.info('Stopping')
+                    self.stop()
+                    self.server.server_close()
+                    return
+                elif signum == signal.SIGHUP:
+                    log.info('Restarting workers')
+                    self.restart()
+                elif signum == signal.SIGTTIN:
+                    self.count += 1
+                elif signum == signal.SIGTTOU and self.count > 1:
+                    self.count -= 1
+                    current = self.current()
+                    self.signal_workers(signal.SIGTERM, current[:1])
+                    self.workers[current[0]] = self.generation - 1
+            self.reap()
+            self.spawn_workers()
+            # Interrupted by signals
+            time.sleep(0.5)
+
+
+def serve(app, host=None, port=None, workers=None, threads=None):
+    """Run the app with the given number of worker processes (by default
+    SERVER_WORKERS, or one per CPU) and threads per worker, until
+    stopped by a signal"""
+    config = app.config
+    host = host or config['SERVER_HOST']
+    port = port or config['SERVER_PORT']
+    workers = workers or config['SERVER_WORKERS'] \
+                      or multiprocessing.cpu_count()
+    threads = threads or config['SERVER_THREADS']
+
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(
+            '[%(asctime)s] [%(process)d] %(message)s'))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+    if workers > 1 and config['LOG_ROTATE'] != 'external':
+        # Workers rotating the file they share would lose records, so leave
+        # rotation to logrotate
+        from .logging_config import replace_file_handler
+        log.warning("Several workers share the log file, so LOG_ROTATE is "
+                    "set to 'external': rotate it with logrotate")
+        config['LOG_ROTATE'] = 'external'
+        replace_file_handler(app)
+
+    RequestHandler.timeout = config['SERVER_TIMEOUT']
+    preload(app)
+    server = WorkerServer(host, port, app, threads)
+    server.multiprocess = workers > 1
+    Master(app, server, workers, config['SERVER_GRACEFUL_TIMEOUT']).run()
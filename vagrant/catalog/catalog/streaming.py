@@ -0,0 +1,100 @@
+"""Helpers for streaming large JSON responses.
+
+Full catalog dumps can contain millions of rows, so rather than building
+the whole structure in memory and passing it to jsonify, rows are read in
+fixed size batches (walking an index) and encoded one at a
+time as the response is sent. Each batch is expunged from the session once
+it has been written, so memory use stays flat however big the table is."""
+
+from flask import Response, stream_with_context, json
+
+from . import app
+from .database import db_session
+from .loading import with_strategy
+
+
+def iter_batches(query, column, row_key, batch_size=None):
+    """Yield the rows of query in lists of batch_size rows, in order of
+    column, whose values must be unique. row_key returns a row's value of
+    column."""
+    if batch_size is None:
+        batch_size = app.config['STREAM_BATCH_SIZE']
+    last_key = None
+    while True:
+        batch_query = query
+        if last_key is not None:
+            batch_query = batch_query.filter(column > last_key)
+        batch = batch_query.order_by(column).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_key = row_key(batch[-1])
+
+def iter_rows(model, strategy=None, batch_size=None):
+    """Yield every row of model in primary key order, loading batch_size
+    rows (and their related objects, using the named loading strategy)
+    at a time"""
+    query = with_strategy(db_session.query(model), strategy)
+    for batch in iter_batches(query, model.id, lambda row: row.id,
+                              batch_size):
+        for row in batch:
+            yield row
+        # Forget about the batch so the identity map doesn't keep growing
+        db_session.expunge_all()
+
+class EncodedJSON(object):
+    """An element of a streamed array which is already encoded, as an
+    iterable of chunks, for elements too big to encode in one go"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+def iter_json_array(objects):
+    """Encode an iterable as a JSON array, one element at a time"""
+    yield '['
+    first = True
+    for obj in objects:
+        if not first:
+            yield ','
+        first = False
+        if isinstance(obj, EncodedJSON):
+            for chunk in obj.chunks:
+                yield chunk
+        else:
+            yield json.dumps(obj)
+    yield ']'
+
+def iter_json_object(sections, fields=None):
+    """Encode a JSON object whose values are streamed arrays. Takes a list
+    of (key, iterable) pairs, and optionally a dict of other fields, which
+    come first."""
+    yield '{'
+    first = True
+    for key, value in sorted((fields or {}).items()):
+        if not first:
+            yield ','
+        first = False
+        yield json.dumps(key) + ':' + json.dumps(value)
+    for key, objects in sections:
+        if not first:
+            yield ','
+        first = False
+        yield json.dumps(key) + ':'
+        for chunk in iter_json_array(objects):
+            yield chunk
+    yield '}'
+
+def iter_ndjson(objects):
+    """Encode an iterable as newline delimited JSON"""
+    for obj in objects:
+        yield json.dumps(obj) + '\n'
+
+def stream_json(sections):
+    """Response streaming a JSON object made up of the given sections"""
+    return Response(stream_with_context(iter_json_object(sections)),
+                    mimetype='application/json')
+
+def stream_ndjson(objects):
+    """Response streaming the given objects as newline delimited JSON"""
+    return Response(stream_with_context(iter_ndjson(objects)),
+                    mimetype='application/x-ndjson')
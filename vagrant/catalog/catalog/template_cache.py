@@ -0,0 +1,81 @@
+"""Compiled templates, kept on disk so they are only compiled once.
+
+With TEMPLATE_BYTECODE_CACHE set, Jinja's compiled code for each template
+is written to TEMPLATE_BYTECODE_CACHE_DIR (instance/template_cache by
+default), and loaded from there by every process instead of compiling the
+template again. Each entry holds a hash of the template's source, so
+changing a template makes its entry stale. Entries are written to a
+temporary file and renamed into place, so processes sharing the directory
+never read a half written one.
+
+precompile_templates.py fills the cache at deploy time, and warm_up makes
+the first requests of a new process before it takes any traffic."""
+
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+# The process's umask, read once at import as it can only be read by
+# setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class AtomicFileSystemBytecodeCache(FileSystemBytecodeCache):
+    """FileSystemBytecodeCache which replaces entries atomically. Entries
+    get the same permissions as FileSystemBytecodeCache gives them, rather
+    than mkstemp's owner only ones, so that processes running as other
+    users can read them."""
+
+    def dump_bytecode(self, bucket):
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.chmod(temporary, 0o666 & ~_UMASK)
+            os.rename(temporary, self._get_cache_filename(bucket))
+        except Exception:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+
+def cache_directory(app):
+    return (app.config['TEMPLATE_BYTECODE_CACHE_DIR']
+            or os.path.join(app.instance_path, 'template_cache'))
+
+def cache_templates(app):
+    """Use the bytecode cache for the app's templates, if
+    TEMPLATE_BYTECODE_CACHE is set"""
+    if not app.config['TEMPLATE_BYTECODE_CACHE']:
+        return
+    directory = cache_directory(app)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    app.jinja_env.bytecode_cache = AtomicFileSystemBytecodeCache(directory)
+
+def compile_templates(app):
+    """Load every template, compiling those missing from the bytecode cache
+    (and adding them to it). Returns the number of templates."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def warm_up(app):
+    """Compile the templates, then request each of WARMUP_PATHS, so that
+    the templates, database connections and caches a process's first
+    requests need are ready. Returns the paths which failed."""
+    compile_templates(app)
+    client = app.test_client()
+    failed = []
+    for path in app.config['WARMUP_PATHS']:
+        try:
+            status = client.get(path).status_code
+        except Exception:
+            app.logger.exception('Warm up request for %s failed', path)
+            status = 500
+        if status >= 400:
+            failed.append(path)
+    return failed
@@ -1,53 +1,104 @@
 from flask import (render_template, abort, request, session, redirect,
-                   url_for, jsonify, flash)
+                   url_for, jsonify)
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.exc import IntegrityError
-from werkzeug.contrib.atom import AtomFeed
+from werkzeug.datastructures import MultiDict
 
 from . import app
 
-from .forms import TagForm, ItemForm, BlankForm, LoginCSRFForm
+from .forms import TagForm, ItemForm, BlankForm
 
 # Imports for dealing with database / models
-from .database import db_session
-from .models import Item, Tag, User
-
-# Imports for oauth views - gconnect and gdisconnect
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
-import httplib2
-import json
-from flask import make_response
-import requests
-
-# Other auth related imports
-from auth_helpers import (login_required, make_url_relative, owner_only,
-                          admin_only, activated_user_required)
+from .database import db_session, primary_only
+from .models import Item, Tag, association_table
+from .pagination import paginate_request, page_limit
+from .loading import with_strategy
+from .streaming import (iter_rows, iter_batches, iter_json_object,
+                        stream_json, stream_ndjson, EncodedJSON)
+from .cache import cached_page, invalidate, item_namespaces, tag_namespaces
+from .conditional import conditional
+from .search import search_item_ids
+from .batch import Batch, BatchError
+from .counters import get_catalog_counts, get_user_item_count
+from .facets import get_tag_bitmaps, bit_count, bit_ids
+
+from .lazyviews import lazy_url
+
+from auth_helpers import (login_required, owner_only, activated_user_required,
+                          get_current_user_flags)
+
+def page_variant():
+    """Identifies how cached pages vary for the logged in user"""
+    user = get_current_user_flags(session, db_session)
+    if user is None:
+        return 'anonymous'
+    return 'user%s-%d%d' % (user.id, user.activated, user.admin)
 
 @app.route('/')
 @app.route('/catalog/')
+@cached_page(lambda: ['catalog'], page_variant)
 def index():
     """View to provide a main index page for our site"""
-    tags = db_session.query(Tag).all()
-    items = db_session.query(Item).all()
+    tags = paginate_tags('tags_cursor')
+    items = paginate_items('items_cursor', strategy='items_with_tags')
 
     # Check if user logged in
     logged_in = 'user_id' in session
 
     # If logged in, check if activated:
-    user = None
-    if logged_in:
-        user = db_session.query(User).filter_by(id=session['user_id']).one()
+    user = get_current_user_flags(session, db_session)
+    user_item_count = None
+    if user is not None:
+        user_item_count = get_user_item_count(db_session, user.id)
 
     return render_template('catalog.html',
                             tags=tags,
                             items=items,
+                            counts=get_catalog_counts(db_session),
+                            user_item_count=user_item_count,
                             logged_in=logged_in,
                             user=user)
 
+def paginate_tags(cursor_arg='cursor', strategy=None):
+    """Get the requested page of tags, in alphabetical order"""
+    return paginate_request(with_strategy(db_session.query(Tag), strategy),
+                            (Tag.name, Tag.id),
+                            cursor_arg=cursor_arg)
+
+def paginate_items(cursor_arg='cursor', strategy=None):
+    """Get the requested page of items, most recently updated first"""
+    return paginate_request(with_strategy(db_session.query(Item), strategy),
+                            (Item.updated_on, Item.id),
+                            cursor_arg=cursor_arg,
+                            descending=True)
+
+def tag_items_query(tag, strategy=None):
+    """Query for a tag's items, to be ordered by association_table's
+    item_id so that it walks the tag's entries in the item_tag index"""
+    return with_strategy(db_session.query(Item), strategy) \
+               .join(association_table,
+                     association_table.c.item_id == Item.id) \
+               .filter(association_table.c.tag_id == tag.id)
+
+def paginate_tag_items(tag, strategy=None):
+    """Get the requested page of a tag's items, in the order they were
+    created. Pages cost the same however many items the tag has."""
+    return paginate_request(tag_items_query(tag, strategy),
+                            (association_table.c.item_id,),
+                            row_key=lambda item: [item.id])
+
+def tag_summary(tag):
+    """Tag in serializeable format for tag lists, with a link to its items
+    rather than the items themselves, which could be any number"""
+    result = tag.serialize()
+    result['items_url'] = url_for('viewTagJSON', tag_name=tag.name,
+                                  _external=True)
+    return result
+
 # Views for viewing data in web page form
 
 @app.route('/catalog/tags/view/<tag_name>/')
+@cached_page(lambda tag_name: ['tag:' + tag_name], page_variant)
 def viewTag(tag_name):
     """View to allow users to view tag information and associated
     items."""
@@ -68,17 +119,17 @@ def viewTag(tag_name):
         owner = False
 
     # Determine if logged in user is an admin
-    user = None
-    if session.get('user_id'):
-        user = User.getByID(session.get('user_id'), db_session)
+    user = get_current_user_flags(session, db_session)
 
     return render_template('viewtag.html',
                             tag=tag,
+                            items=paginate_tag_items(tag, 'items_with_tags'),
                             logged_in=logged_in,
                             owner=owner,
                             user=user)
 
 @app.route('/catalog/items/view/<item_name>-<int:item_id>/')
+@cached_page(lambda item_name, item_id: ['item:%s' % item_id], page_variant)
 def viewItem(item_name, item_id):
     """View to allow users to view information about individual
     items."""
@@ -100,9 +151,7 @@ def viewItem(item_name, item_id):
         owner = False
 
     # Determine if logged in user is an admin
-    user = None
-    if session.get('user_id'):
-        user = User.getByID(session.get('user_id'), db_session)
+    user = get_current_user_flags(session, db_session)
 
     return render_template('viewitem.html',
                             item=item,
@@ -111,9 +160,130 @@ def viewItem(item_name, item_id):
                             user=user)
 
 
+# Views for searching
+
+def search_items():
+    """Returns (query, page number, matching items, has more) for the
+    search requested, in order of relevance. Results are paged with the
+    page and limit parameters."""
+    query = request.args.get('q', u'').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = page_limit()
+    if not query or not app.config['SEARCH_ENABLED']:
+        return query, page, [], False
+
+    # Fetch one extra id to find out if there is another page
+    item_ids = search_item_ids(db_session.connection(), query,
+                               limit + 1, (page - 1) * limit)
+    has_more = len(item_ids) > limit
+    item_ids = item_ids[:limit]
+
+    items = []
+    if item_ids:
+        items = with_strategy(db_session.query(Item), 'items_with_tags') \
+                    .filter(Item.id.in_(item_ids)).all()
+        items.sort(key=lambda item: item_ids.index(item.id))
+    return query, page, items, has_more
+
+@app.route('/catalog/search/')
+def search():
+    """View to search items by name, description and tags"""
+    query, page, items, has_more = search_items()
+    logged_in = 'user_id' in session
+    return render_template('search.html',
+                            query=query,
+                            page=page,
+                            items=items,
+                            has_more=has_more,
+                            logged_in=logged_in)
+
+@app.route('/catalog/search.json')
+def searchJSON():
+    """View to search items by name, description and tags, as JSON"""
+    query, page, items, has_more = search_items()
+    return jsonify(Items=[i.serialize(include_tags=True) for i in items],
+                   paging={'page': page,
+                           'next': page + 1 if has_more else None,
+                           'prev': page - 1 if page > 1 else None,
+                           'limit': page_limit()})
+
+
+# Views for browsing items by tag
+
+def browse_items():
+    """Returns the items with every tag named by the tag parameters and
+    none of those named by the exclude parameters, most recently created
+    first, as a dict which also holds the number of matching items and the
+    facet counts: the number of matching items in each of the other tags.
+    Results are paged with the page and limit parameters."""
+    include = request.args.getlist('tag')
+    exclude = request.args.getlist('exclude')
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = page_limit()
+
+    bitmaps = get_tag_bitmaps(db_session)
+    # A tag which doesn't exist has no items, so an unknown included tag
+    # matches nothing, while an unknown excluded tag changes nothing
+    bits = bitmaps.matching(
+        include=[bitmaps.tag_ids.get(name, -1) for name in include],
+        exclude=[bitmaps.tag_ids[name] for name in exclude
+                 if name in bitmaps.tag_ids])
+
+    # Fetch one extra id to find out if there is another page
+    item_ids = bit_ids(bits, (page - 1) * limit, limit + 1)
+    has_more = len(item_ids) > limit
+    item_ids = item_ids[:limit]
+    items = []
+    if item_ids:
+        items = with_strategy(db_session.query(Item), 'items_with_tags') \
+                    .filter(Item.id.in_(item_ids)).all()
+        items.sort(key=lambda item: item.id, reverse=True)
+
+    tag_names = dict((tag_id, name)
+                     for name, tag_id in bitmaps.tag_ids.items())
+    chosen = set(include) | set(exclude)
+    facets = [(tag_names[tag_id], count)
+              for tag_id, count in bitmaps.facet_counts(bits).items()
+              if tag_id in tag_names and tag_names[tag_id] not in chosen]
+    facets.sort(key=lambda facet: (-facet[1], facet[0]))
+
+    return {'include': include,
+            'exclude': exclude,
+            'items': items,
+            'count': bit_count(bits),
+            'facets': facets[:app.config['BROWSE_FACETS']],
+            'page': page,
+            'has_more': has_more}
+
+@app.route('/catalog/browse/')
+def browse():
+    """View to browse items by the tags they have and don't have"""
+    logged_in = 'user_id' in session
+    return render_template('browse.html',
+                            logged_in=logged_in,
+                            **browse_items())
+
+@app.route('/catalog/browse.json')
+@conditional
+def browseJSON():
+    """View to browse items by the tags they have and don't have, as JSON"""
+    result = browse_items()
+    page = result['page']
+    return jsonify(Items=[i.serialize(include_tags=True)
+                          for i in result['items']],
+                   Count=result['count'],
+                   Facets=[{'name': name, 'count': count}
+                           for name, count in result['facets']],
+                   paging={'page': page,
+                           'next': page + 1 if result['has_more'] else None,
+                           'prev': page - 1 if page > 1 else None,
+                           'limit': page_limit()})
+
+
 # Views for creating new data entities
 
 @app.route('/catalog/tags/new/', methods=['GET', 'POST'])
+@primary_only
 @login_required(session)
 @activated_user_required(session, db_session)
 def newTag():
@@ -128,11 +298,13 @@ def newTag():
                           user_id=session['user_id'])
             db_session.add(new_tag)
             db_session.commit()
+            invalidate('catalog')
 
             # Log creation of new tag
             app.logger.info(
                 "Created {}, user IP address: {}".format(new_tag,
-                                                         request.remote_addr))
+                                                         request.remote_addr),
+                extra={'object_id': new_tag.id})
 
             return redirect(url_for('index'))
         except IntegrityError:
@@ -148,6 +320,7 @@ def newTag():
                             logged_in=True)
 
 @app.route('/catalog/items/new/', methods=['GET', 'POST'])
+@primary_only
 @login_required(session)
 @activated_user_required(session, db_session)
 def newItem():
@@ -179,11 +352,13 @@ def newItem():
                         user_id=session['user_id'])
         db_session.add(new_item)
         db_session.commit()
+        invalidate(*item_namespaces(new_item))
 
         # Log creation of new item
         app.logger.info(
             "Created {}, user IP address: {}".format(new_item,
-                                                     request.remote_addr))
+                                                     request.remote_addr),
+            extra={'object_id': new_item.id})
 
         return redirect(url_for('index'))
 
@@ -196,6 +371,7 @@ def newItem():
 # Views for editing existing entities
 
 @app.route('/catalog/tags/edit/<tag_name>/', methods=['GET', 'POST'])
+@primary_only
 @login_required(session)
 @owner_only(session, db_session, Tag)
 @activated_user_required(session, db_session)
@@ -214,13 +390,17 @@ def editTag(tag_name):
     
     if request.method == 'POST' and form.validate():
         try:
+            stale_pages = tag_namespaces(db_session, tag)
             tag.name = form.tag_name.data
+            stale_pages.append('tag:' + tag.name)
             db_session.commit()
+            invalidate(*stale_pages)
             
             # Log tag editing
             app.logger.info(
                 "Edited {}, user IP address: {}".format(tag,
-                                                        request.remote_addr))
+                                                        request.remote_addr),
+                extra={'object_id': tag.id})
 
             return redirect(url_for('viewTag', tag_name = tag.name))
 
@@ -244,6 +424,7 @@ def editTag(tag_name):
 
 @app.route('/catalog/items/edit/<item_name>-<int:item_id>/',
            methods=['GET', 'POST'])
+@primary_only
 @login_required(session)
 @owner_only(session, db_session, Item)
 @activated_user_required(session, db_session)
@@ -271,16 +452,20 @@ def editItem(item_name, item_id):
         new_tags = db_session.query(Tag).filter(Tag.id.in_(new_tag_ids)).all()
         
         # Edit item.
+        stale_pages = item_namespaces(item)
         item.tags = new_tags
         item.name = form.name.data
         item.description = form.description.data
         item.picture_url = form.picture_url.data
+        stale_pages.extend(item_namespaces(item))
         db_session.commit()
+        invalidate(*stale_pages)
 
         # Log item editing
         app.logger.info(
             "Edited {}, user IP address: {}".format(item,
-                                                    request.remote_addr))
+                                                    request.remote_addr),
+            extra={'object_id': item.id})
 
         return redirect(url_for('viewItem',
                                 item_name = item.name,
@@ -302,6 +487,7 @@ def editItem(item_name, item_id):
 # Views for deleting existing entities
 
 @app.route('/catalog/tags/delete/<tag_name>/', methods=['GET', 'POST'])
+@primary_only
 @login_required(session)
 @owner_only(session, db_session, Tag)
 @activated_user_required(session, db_session)
@@ -319,13 +505,16 @@ def deleteTag(tag_name):
     form = BlankForm(request.form, meta={'csrf_context': session})
 
     if request.method == 'POST' and form.validate():
+        stale_pages = tag_namespaces(db_session, tag)
         db_session.delete(tag)
         db_session.commit()
+        invalidate(*stale_pages)
 
         # Log tag deletion
         app.logger.info(
             "Deleted {}, user IP address: {}".format(tag,
-                                                     request.remote_addr))
+                                                     request.remote_addr),
+            extra={'object_id': tag.id})
 
         return redirect(url_for('index'))
 
@@ -337,6 +526,7 @@ def deleteTag(tag_name):
 
 @app.route('/catalog/items/delete/<item_name>-<int:item_id>/',
            methods=['GET', 'POST'])
+@primary_only
 @login_required(session)
 @owner_only(session, db_session, Item)
 @activated_user_required(session, db_session)
@@ -354,13 +544,16 @@ def deleteItem(item_name, item_id):
     form = BlankForm(request.form, meta={'csrf_context': session})
 
     if request.method == 'POST' and form.validate():
+        stale_pages = item_namespaces(item)
         db_session.delete(item)
         db_session.commit()
+        invalidate(*stale_pages)
 
         # Log item deletion
         app.logger.info(
             "Deleted {}, user IP address: {}".format(item,
-                                                    request.remote_addr))
+                                                    request.remote_addr),
+            extra={'object_id': item.id})
 
         return redirect(url_for('index'))
 
@@ -373,29 +566,111 @@ def deleteItem(item_name, item_id):
 
 # Views for JSON API
 
+@app.route('/catalog/items/batch.json', methods=['POST'])
+@login_required(session)
+@activated_user_required(session, db_session)
+def batchItemsJSON():
+    """View to create, update and delete many items in one request. Takes
+    a JSON object holding a list of operations (see the batch module) and
+    a csrf_token, which can also be sent in an X-CSRFToken header. Returns
+    the result of each operation, which are only applied if they are all
+    valid."""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error='Expected a JSON object'), 400
+
+    token = payload.get('csrf_token') or request.headers.get('X-CSRFToken')
+    form = BlankForm(MultiDict({'csrf_token': token or u''}),
+                     meta={'csrf_context': session})
+    if not form.validate():
+        return jsonify(error='Invalid CSRF token'), 400
+
+    try:
+        batch = Batch(db_session,
+                      payload.get('operations'),
+                      get_current_user_flags(session, db_session),
+                      app.config['BATCH_MAX_OPERATIONS'])
+    except BatchError as e:
+        return jsonify(error=str(e)), 400
+
+    success, results = batch.apply()
+    if not success:
+        return jsonify(results=results), 400
+
+    # Log batch
+    app.logger.info(
+        "Applied batch of {} operations, user IP address: {}".format(
+            len(results), request.remote_addr))
+
+    return jsonify(results=results)
+
 @app.route('/catalog.json')
+@conditional
 def indexJSON():
-    """View main catalog index as JSON"""
-    tags = db_session.query(Tag).all()
-    items = db_session.query(Item).all()
-    return jsonify(Tags=[tag.serialize(include_items=True) for tag in tags],
-                   Items=[i.serialize(include_tags=True) for i in items])
+    """View main catalog index as JSON. The tags and items are paged
+    separately, using the tags_cursor and items_cursor parameters, unless
+    the whole catalog is requested with the all parameter."""
+    if request.args.get('all'):
+        return stream_json([('Tags', stream_tags()), ('Items', stream_items())])
+
+    tags = paginate_tags('tags_cursor')
+    items = paginate_items('items_cursor', strategy='items_with_tags')
+    return jsonify(Tags=[tag_summary(tag) for tag in tags],
+                   Items=[i.serialize(include_tags=True) for i in items],
+                   Counts=get_catalog_counts(db_session),
+                   paging={'Tags': tags.paging(),
+                           'Items': items.paging()})
 
 @app.route('/catalog/tags.json')
+@conditional
 def indexTagsJSON():
     """View main catalog index as JSON, but only the Tags section"""
-    tags = db_session.query(Tag).all()
-    return jsonify(Tags=[tag.serialize(include_items=True) for tag in tags])
+    tags = paginate_tags()
+    return jsonify(Tags=[tag_summary(tag) for tag in tags],
+                   paging=tags.paging())
 
 @app.route('/catalog/items.json')
+@conditional
 def indexItemsJSON():
     """View main catalog index as JSON, but only the Items section"""
-    items = db_session.query(Item).all()
-    return jsonify(Items=[i.serialize(include_tags=True) for i in items])
+    if request.args.get('all'):
+        return stream_json([('Items', stream_items())])
+
+    items = paginate_items(strategy='items_with_tags')
+    return jsonify(Items=[i.serialize(include_tags=True) for i in items],
+                   paging=items.paging())
+
+@app.route('/catalog/items.ndjson')
+@conditional
+def indexItemsNDJSON():
+    """Stream every item as newline delimited JSON, one item per line"""
+    return stream_ndjson(stream_items())
+
+def stream_tags():
+    """Generator of every tag, with its items, for streaming. Each tag's
+    items are streamed in batches too, as a tag can have any number."""
+    for tag in iter_rows(Tag):
+        yield EncodedJSON(iter_json_object([('items', stream_tag_items(tag))],
+                                           fields=tag.serialize()))
+
+def stream_tag_items(tag):
+    """Generator of a tag's items in serializeable format, for streaming"""
+    for batch in iter_batches(tag_items_query(tag),
+                              association_table.c.item_id,
+                              lambda item: item.id):
+        for item in batch:
+            yield item.serialize()
+
+def stream_items():
+    """Generator of every item in serializeable format, for streaming"""
+    for item in iter_rows(Item, strategy='items_with_tags'):
+        yield item.serialize(include_tags=True)
 
 @app.route('/catalog/tags/view/<tag_name>.json')
+@conditional
 def viewTagJSON(tag_name):
-    """View to allow users to retrieve tag information in JSON format"""
+    """View to allow users to retrieve tag information in JSON format,
+    with the tag's items paged"""
 
     try:
         tag = db_session.query(Tag).filter_by(name=tag_name).one()
@@ -404,9 +679,14 @@ def viewTagJSON(tag_name):
         # throw a 404
         abort(404) 
 
-    return jsonify(tag.serialize(include_items=True))
+    items = paginate_tag_items(tag)
+    result = tag.serialize()
+    result['items'] = [item.serialize() for item in items]
+    result['paging'] = items.paging()
+    return jsonify(result)
 
 @app.route('/catalog/items/view/<item_name>-<int:item_id>.json')
+@conditional
 def viewItemJSON(item_name, item_id):
     """View to allow users to retrieve information about individual
     items in JSON."""
@@ -422,230 +702,22 @@ def viewItemJSON(item_name, item_id):
     return jsonify(item.serialize(include_tags=True))
 
 
-# Views for Atom API
-
-@app.route('/catalog/recent.atom')
-def recentAtom():
-    feed = AtomFeed(title="Recent Items",
-                    feed_url=request.url,
-                    url=request.host_url,
-                    subtitle="The most recently created catalog items.",)
-    for item in db_session.query(Item)                      \
-                          .order_by(Item.updated_on.desc()) \
-                          .limit(10):
-        categories = [{'term': tag.name.lower(),
-                       'label': tag.name} for tag in item.tags]
-        feed.add(title=item.name,
-                 url=url_for('viewItem',
-                             item_name=item.name,
-                             item_id=item.id),
-                 updated=item.updated_on,
-                 published=item.created_on,
-                 content_type='text',
-                 content=unicode(item.description),
-                 categories=categories,
-                 author={'name':"Random dude",
-                         'email':'bob@example.com'})
-                         # Replace with user once auth in place
-    return feed.get_response()
-
-# Views for login and auth
-
-CLIENT_ID = json.loads(
-        open('instance/client_secrets.json', 'r').read()
-    )['web']['client_id']
-
-@app.route('/login/')
-def showLogin():
-    next = request.values.get('next')
-    if not next:
-        next = request.referrer
-    if not next:
-        next = url_for('index')
-    next = make_url_relative(next)
-    form = LoginCSRFForm(request.form, meta={'csrf_context': session})
-    return render_template('login.html',
-                            form=form,
-                            next=next,
-                            client_id=CLIENT_ID)
-
-@app.route('/logout/')
-@login_required(session)
-def showLogout():
-    return render_template('logout.html')
-
-@app.route('/gconnect', methods=['POST'])
-def gconnect():
-    """View to log in using Google's Oauth2 service"""
-    form = LoginCSRFForm(request.form, meta={'csrf_context': session})
-    form.validate()
-    if form.csrf_token.errors:
-        print "CSRF error detected"
-        response = make_response(json.dumps('Invalid CSRF token'), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-    code = form.code.data
-    try:
-        # Exchange authorisation code for credentials object
-        oauth_flow = flow_from_clientsecrets('instance/client_secrets.json',
-                                             scope='')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
-    except FlowExchangeError:
-        response = make_response(
-            json.dumps('Failed to upgrade the authorization code.'), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-    # Check that the access token is valid.
-    access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, 'GET')[1])
-
-        # If there was an error in the access token info, abort.
-    if result.get('error') is not None:
-        response = make_response(json.dumps(result.get('error')), 500)
-        response.headers['Content-Type'] = 'application/json'
-
-    # Verify that the access token is used for the intended user.
-    gplus_id = credentials.id_token['sub']
-    if result['user_id'] != gplus_id:
-        response = make_response(
-            json.dumps("Token's user ID doesn't match given user ID."), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    # Verify that the access token is valid for this app.
-    if result['issued_to'] != CLIENT_ID:
-        response = make_response(
-            json.dumps("Token's client ID does not match app's."), 401)
-        print "Token's client ID does not match app's."
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    stored_credentials = session.get('access_token')
-    stored_gplus_id = session.get('gplus_id')
-    if stored_credentials is not None and gplus_id == stored_gplus_id:
-        response = make_response(
-            json.dumps('Current user is already connected.'), 200)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    # Store the access token in the session for later use.
-    session['access_token'] = credentials.access_token
-    session['gplus_id'] = gplus_id
-
-    # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-
-    data = answer.json()
-
-    session['username'] = data['name']
-    session['picture'] = data['picture']
-    session['email'] = data['email']
-
-    # See if user exists in database, otherwise add them
-    user_id = User.getIDByEmail(session['email'], db_session)
-    if not user_id:
-        user_id = User.createForID(session, db_session)
-    session['user_id'] = user_id
-
-    output = ''
-    output += 'Welcome'
-    if session['username']:
-        output += ', '
-        output += session['username']
-    output += '.'
-    flash("you are now logged in as %s" % session['username'])
-    print "done!"
-    response = make_response(json.dumps(output))
-    response.headers['Content-Type'] = 'application/json'
-    return response
-
-
-@app.route('/gdisconnect')
-def gdisconnect():
-    access_token = session.get('access_token')
-    print 'In gdisconnect access token is %s', access_token
-    print 'User name is: ' 
-    print session.get('username')
-    if access_token is None:
-        print 'Access Token is None'
-        response = make_response(json.dumps('Current user not connected.'),
-                                 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-    url = ('https://accounts.google.com/o/oauth2/revoke?token=%s'
-           % session['access_token'])
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
-    print 'result is '
-    print result
-    if result['status'] == '200':
-        del session['access_token'] 
-        del session['gplus_id']
-        del session['username']
-        del session['email']
-        del session['picture']
-        del session['user_id']
-        response = make_response(json.dumps('Successfully disconnected.'),
-                                 200)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-    else:
-    
-        response = make_response(
-            json.dumps('Failed to revoke token for given user.', 400))
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-# Admin section
-@app.route('/admin/')
-@login_required(session)
-@admin_only(session, db_session)
-def admin():
-    users = db_session.query(User).all()
-    return render_template('admin.html', users=users, logged_in=True)
-
-@app.route('/admin/activation/<int:user_id>/', methods=['POST', 'GET'])
-@login_required(session)
-@admin_only(session, db_session)
-def user_activation(user_id):
-    try:
-        user = db_session.query(User).filter_by(id=user_id).one()
-    except (MultipleResultsFound, NoResultFound):
-        # If there are more or less than one items with this name and id,
-        # throw a 404.
-        abort(404)
-
-    # If user is an admin, then you aren't allowed to
-    # activate/deactivate them.
-    if user.admin:
-        abort(403)
-
-    form = BlankForm(request.form, meta={'csrf_context': session})
+# Views for the Atom feed, login and admin pages, and metrics, which are
+# only imported when first requested, along with what they depend on
 
-    # Determine whether form should activate or deactivate user
-    if user.activated:
-        action = "deactivate"
-    else:
-        action = "activate"
+lazy_url('/catalog/recent.atom', 'catalog.feed_views.recentAtom')
+lazy_url('/catalog/archive/<int:page>.atom', 'catalog.feed_views.archiveAtom')
 
-    if request.method == 'POST' and form.validate():
-        # Toggle user activation
-        user.activated = not user.activated
-        db_session.commit()
-
-        return redirect(url_for('admin'))
+lazy_url('/login/', 'catalog.auth_views.showLogin')
+lazy_url('/logout/', 'catalog.auth_views.showLogout')
+lazy_url('/gconnect', 'catalog.auth_views.gconnect', methods=['POST'])
+lazy_url('/gdisconnect', 'catalog.auth_views.gdisconnect')
 
-    return render_template('activationform.html',
-                            form=form,
-                            action=action,
-                            user=user,
-                            logged_in=True)
+lazy_url('/admin/', 'catalog.admin_views.admin')
+lazy_url('/admin/sql/', 'catalog.admin_views.admin_sql')
+lazy_url('/admin/activation/<int:user_id>/',
+         'catalog.admin_views.user_activation', methods=['POST', 'GET'])
+lazy_url('/metrics', 'catalog.admin_views.metrics')
 
 # Error pages
 
@@ -659,4 +731,4 @@ def page_not_found404(e):
 def page_unauthorised403(e):
     # Find if logged in, for template info
     logged_in = 'username' in session
-    return render_template('403.html', logged_in=logged_in), 403
\ No newline at end of file
+    return render_template('403.html', logged_in=logged_in), 403
@@ -0,0 +1,49 @@
+"""Script to bring an existing database up to date with the models, adding
+any missing tables, columns and indexes.
+
+Usage: python migratedb.py [--dry-run] [--explain]
+
+With --dry-run, lists the changes without making them. With --explain,
+prints the query plans and timings of the hot lookups before and after the
+changes, to show their effect."""
+
+from catalog.database import engine
+from catalog.schema import upgrade_schema, hot_queries, explain, time_query
+import sys
+
+def print_plans():
+    for description, query in hot_queries():
+        print "%s (%.3f ms)" % (description, time_query(engine, query))
+        for line in explain(engine, query):
+            print "    %s" % line
+    print
+
+if __name__ == "__main__":
+
+    dry_run = "--dry-run" in sys.argv
+    show_plans = "--explain" in sys.argv
+
+    print "Upgrading database: %s" % engine.url
+
+    if show_plans:
+        print "Query plans before upgrade:"
+        print_plans()
+
+    changes = upgrade_schema(engine, dry_run=dry_run)
+
+    if not changes:
+        print "Database is already up to date."
+    for description, error in changes:
+        if error:
+            print "FAILED: %s (%s)" % (description, error)
+        elif dry_run:
+            print "Would: %s" % description
+        else:
+            print "Done: %s" % description
+    print
+
+    if show_plans and not dry_run:
+        print "Query plans after upgrade:"
+        print_plans()
+
+    print "Goodbye"
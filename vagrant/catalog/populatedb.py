@@ -1,14 +1,25 @@
-from catalog.database import db_session, init_db, dbfilename
+"""Script to create the database and fill it with the sample tags and items
+in sample_catalog.ndjson, owned by the user with id 1 (the first user to
+sign in). An existing sqlite database is deleted first. Other databases
+can't be, so the samples are only imported into them if they hold no items
+yet.
 
-from catalog.models import Item, Tag
+For loading larger catalogs, use bulkdata.py."""
+
+from sqlalchemy import select
+
+from catalog.database import engine, init_db, dbfilename, db_url
+from catalog.models import Item
+from catalog.bulk import Importer, read_records
 
 import os
 
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
 # Remove database if it exists
 
-print "Checking for existing sqlite database."
-if dbfilename:
-    script_dir = os.path.dirname(os.path.realpath(__file__))
+if db_url.startswith('sqlite'):
+    print "Checking for existing sqlite database."
     db_file_path = os.path.join(script_dir, dbfilename)
 
     if os.path.isfile(db_file_path):
@@ -22,87 +33,13 @@ if dbfilename:
 print "Creating and initialising database."
 init_db()
 
-#Create tags
-
-print "Creating tags."
-
-books = Tag(name='Books', user_id=1)
-db_session.add(books)
-
-novels = Tag(name='Novels', user_id=1)
-db_session.add(novels)
-
-nonfiction = Tag(name='Non-fiction', user_id=1)
-db_session.add(nonfiction)
-
-furniture = Tag(name='Furniture', user_id=1)
-db_session.add(furniture)
-
-cars = Tag(name='Cars', user_id=1)
-db_session.add(cars)
-
-vehicles = Tag(name='Vehicles', user_id=1)
-db_session.add(vehicles)
-
-boats = Tag(name='Boats', user_id=1)
-db_session.add(boats)
-
-db_session.commit()
-
-
-# Create items
-
-print "Creating items."
-
-i1 = Item(name='Dictionary',
-		  description='The latest Oxford dictionary',
-		  tags=[books, nonfiction],
-		  user_id=1,
-		  picture_url = "http://ecx.images-amazon.com/images/I/51RmpdfuGRL._SX379_BO1,204,203,200_.jpg")
-db_session.add(i1)
-
-i2 = Item(name='Chair',
-		  description='An old antique chair',
-		  tags=[furniture],
-		  user_id=1,
-		  picture_url="https://upload.wikimedia.org/wikipedia/commons/5/52/Karin_larsson_schommelstoel.jpg")
-db_session.add(i2)
-
-i3 = Item(name='Coffee table',
-	      description='A perfectly ordinary coffee table',
-	      tags=[furniture],
-	      user_id=1,
-	      picture_url="https://upload.wikimedia.org/wikipedia/en/thumb/7/7b/Domestic_coffee_table_in_residential_setting.jpg/500px-Domestic_coffee_table_in_residential_setting.jpg")
-db_session.add(i3)
-
-i4 = Item(name='Landrover',
-		  description='Chelsea tractor',
-		  tags=[cars, vehicles],
-		  user_id=1,
-		  picture_url="https://upload.wikimedia.org/wikipedia/en/thumb/5/5e/Landrover2a.jpg/440px-Landrover2a.jpg")
-db_session.add(i4)
-
-i5 = Item(name='Sailing Boat',
-		  description='A beautiful sailing boat',
-		  tags=[vehicles, boats],
-		  user_id=1,
-		  picture_url="https://upload.wikimedia.org/wikipedia/commons/thumb/8/85/Nonsuch30.jpg/200px-Nonsuch30.jpg")
-db_session.add(i5)
-
-i6 = Item(name='Pride and Prejudice',
-		  description='Classic novel by Jane Austen',
-		  tags=[books, novels],
-		  user_id=1,
-		  picture_url="https://upload.wikimedia.org/wikipedia/commons/thumb/1/17/PrideAndPrejudiceTitlePage.jpg/440px-PrideAndPrejudiceTitlePage.jpg")
-db_session.add(i6)
-
-i7 = Item(name='Wolf Hall',
-	      description='Historical novel by Hilary Mantel',
-	      tags=[books, novels],
-	      user_id=1,
-	      picture_url="https://upload.wikimedia.org/wikipedia/en/e/ed/Wolf_Hall_cover.jpg")
-db_session.add(i7)
+# Create tags and items
 
-db_session.commit()
+if engine.execute(select([Item.__table__.c.id]).limit(1)).first():
+    print "The database already holds items, so the samples weren't imported."
+else:
+    print "Creating tags and items."
+    with open(os.path.join(script_dir, 'sample_catalog.ndjson'), 'rb') as f:
+        Importer(engine, user_id=1).run(read_records(f, 'ndjson'))
 
-print "Done."
\ No newline at end of file
+print "Done."
@@ -0,0 +1,26 @@
+"""Script to compile every template into the template bytecode cache (see
+catalog/template_cache.py), so that processes started afterwards load them
+instead of compiling them. Run it at deploy time, after updating the
+templates.
+
+Usage: python precompile_templates.py [--clear]
+
+With --clear, empties the cache first."""
+
+import sys
+import time
+
+from catalog import app
+from catalog.template_cache import cache_directory, compile_templates
+
+if __name__ == "__main__":
+    bytecode_cache = app.jinja_env.bytecode_cache
+    if bytecode_cache is None:
+        print "TEMPLATE_BYTECODE_CACHE is off: nothing to do."
+        sys.exit(1)
+    if '--clear' in sys.argv[1:]:
+        bytecode_cache.clear()
+    start = time.time()
+    count = compile_templates(app)
+    print "Compiled %d templates into %s in %.0f ms" % (
+        count, cache_directory(app), (time.time() - start) * 1000)
@@ -0,0 +1,29 @@
+"""Script to check the item counts held for each tag and user, and the
+catalog's total numbers of items and tags, against the real numbers, and
+correct any which have drifted.
+
+Usage: python reconcile_counts.py [--dry-run]
+
+With --dry-run, lists the wrong counts without correcting them."""
+
+from catalog.database import engine
+from catalog.counters import reconcile_counts
+import sys
+
+if __name__ == "__main__":
+
+    dry_run = "--dry-run" in sys.argv
+
+    print "Checking counts in database: %s" % engine.url
+
+    with engine.begin() as connection:
+        drift = reconcile_counts(connection, dry_run=dry_run)
+
+    if not drift:
+        print "All counts are correct."
+    for table, column, row_id, stored, actual in drift:
+        print "%s %s.%s of row %s: was %s, should be %s" % (
+            "Found" if dry_run else "Fixed",
+            table, column, row_id, stored, actual)
+    print
+    print "Goodbye"
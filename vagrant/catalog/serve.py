@@ -0,0 +1,26 @@
+"""Script to run the catalog in production, with several worker processes
+(see catalog/server.py)
+
+Usage:
+    python serve.py [--host HOST] [--port PORT] [--workers N] [--threads N]
+
+The defaults are taken from the SERVER_* settings in the config. Send the
+master process TERM to stop gracefully, HUP to restart the workers, and
+TTIN or TTOU to add or remove a worker."""
+
+import argparse
+
+from catalog import app
+from catalog.server import serve
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run the catalog with several worker processes.')
+    parser.add_argument('--host', help='Address to listen on')
+    parser.add_argument('--port', type=int, help='Port to listen on')
+    parser.add_argument('--workers', type=int,
+                        help='Number of worker processes')
+    parser.add_argument('--threads', type=int,
+                        help='Number of threads in each worker')
+    args = parser.parse_args()
+    serve(app, args.host, args.port, args.workers, args.threads)
@@ -0,0 +1,34 @@
+"""Tests for the catalog. Run them from vagrant/catalog with:
+
+    python -m unittest discover tests
+
+The app chooses its database when it is imported, so the tests point it at
+a new database in a temporary directory before importing it. Every test
+shares that database, so tests create the rows they need with names of
+their own."""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+directory = tempfile.mkdtemp(prefix='catalog-tests-')
+atexit.register(shutil.rmtree, directory, True)
+
+settings = {
+    'DB_FILE': os.path.join(directory, 'catalog.db'),
+    'DB_URL': '',
+    'CATALOG_LOGFILE': os.path.join(directory, 'catalog.log'),
+    'LOG_MAX_BYTES': 0,
+    'PAGE_CACHE_BACKEND': 'none',
+    'TEMPLATE_BYTECODE_CACHE': False,
+    'SERVER_WARMUP': False,
+}
+settings_file = os.path.join(directory, 'settings.cfg')
+with open(settings_file, 'w') as f:
+    for key, value in sorted(settings.items()):
+        f.write('%s = %r\n' % (key, value))
+os.environ['CATALOG_SETTINGS'] = settings_file
+
+from catalog.database import init_db
+init_db()
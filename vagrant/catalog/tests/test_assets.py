@@ -0,0 +1,31 @@
+import unittest
+
+import tests  # Points the app at the test database
+from catalog import app, assets
+
+
+class AssetUrlsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        self.asset_urls = app.jinja_env.globals['asset_urls']
+
+    def tearDown(self):
+        assets._manifest[0] = None
+        self.context.pop()
+
+    def test_built_bundle(self):
+        assets._manifest[0] = {'css/catalog.css': 'build/css/catalog.1.css'}
+        self.assertEqual(self.asset_urls('css/catalog.css'),
+                         [('/static/build/css/catalog.1.css', None)])
+
+    def test_unbuilt_bundle_uses_built_sources(self):
+        assets._manifest[0] = {'css/theme.css': 'build/css/theme.1.css'}
+        urls = self.asset_urls('css/catalog.css')
+        self.assertEqual(len(urls), len(assets.BUNDLES['css/catalog.css']))
+        self.assertEqual(urls[-1], ('/static/build/css/theme.1.css', None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import tests  # Points the app at the test database
+from catalog import app
+from catalog.auth_helpers import UserFlags
+from catalog.batch import Batch
+from catalog.database import db_session
+from catalog.models import Item, Tag, User
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        user = User(name='Batch', email='batch@example.com')
+        self.tag = Tag(name='Batch %s' % self.id().split('.')[-1])
+        db_session.add_all([user, self.tag])
+        db_session.commit()
+        self.user = UserFlags(user.id, True, False)
+
+    def tearDown(self):
+        db_session.remove()
+        self.context.pop()
+
+    def apply(self, **operation):
+        operation.setdefault('op', 'create')
+        operation.setdefault('name', 'Batch item')
+        return Batch(db_session, [operation], self.user, 10).apply()
+
+    def assertFieldError(self, field, **operation):
+        success, results = self.apply(**operation)
+        self.assertFalse(success)
+        self.assertEqual(results[0]['status'], 'invalid')
+        self.assertIn(field, results[0]['errors'])
+
+    def test_tags_not_a_list(self):
+        self.assertFieldError('tags', tags=5)
+
+    def test_tags_as_a_string(self):
+        self.assertFieldError('tags', tags=str(self.tag.id))
+
+    def test_name_not_a_string(self):
+        self.assertFieldError('name', name=123)
+
+    def test_description_not_a_string(self):
+        self.assertFieldError('description', description=['a'])
+
+    def test_repeated_tag(self):
+        success, results = self.apply(tags=[self.tag.id, self.tag.id])
+        self.assertTrue(success)
+        item = db_session.query(Item).get(results[0]['id'])
+        self.assertEqual(item.tags, [self.tag])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import unittest
+
+from sqlalchemy import func, select
+
+import tests  # Points the app at the test database
+from catalog.bulk import Checkpoint, Importer
+from catalog.database import engine
+from catalog.models import Item
+
+
+class Stop(Exception):
+    pass
+
+
+class StoppingCheckpoint(Checkpoint):
+    """Checkpoint which stops the import after the given number of saves"""
+
+    def __init__(self, path, source, saves):
+        Checkpoint.__init__(self, path, source)
+        self.saves = saves
+
+    def save(self, records, pending=None):
+        Checkpoint.save(self, records, pending)
+        self.saves -= 1
+        if self.saves == 0:
+            raise Stop()
+
+
+class ResumeTest(unittest.TestCase):
+
+    def import_records(self, name, checkpoint):
+        records = [{'name': name, 'tags': [name]} for _ in range(5)]
+        return Importer(engine, batch_size=2).run(records, checkpoint)
+
+    def count(self, name):
+        items = Item.__table__
+        return engine.execute(select([func.count()])
+                              .where(items.c.name == name)).scalar()
+
+    def resume(self, name, saves):
+        path = os.path.join(tests.directory, name + '.checkpoint')
+        with self.assertRaises(Stop):
+            self.import_records(name, StoppingCheckpoint(path, name, saves))
+        self.assertEqual(self.import_records(name, Checkpoint(path, name)), 5)
+        self.assertEqual(self.count(name), 5)
+
+    def test_stopped_before_commit(self):
+        # The first batch is saved as pending, then done; the second is
+        # stopped while pending
+        self.resume('Before commit', 3)
+
+    def test_stopped_after_commit(self):
+        # Stopped after the second batch was committed, before it was saved
+        # as done
+        self.resume('After commit', 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
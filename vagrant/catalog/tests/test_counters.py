@@ -0,0 +1,32 @@
+import unittest
+
+from sqlalchemy.exc import IntegrityError
+
+import tests  # Points the app at the test database
+from catalog.counters import get_catalog_counts
+from catalog.database import db_session
+from catalog.models import Tag
+
+
+class CountersTest(unittest.TestCase):
+
+    def tearDown(self):
+        db_session.remove()
+
+    def test_failed_flush_not_counted(self):
+        db_session.add(Tag(name='Counted'))
+        db_session.commit()
+        tags = get_catalog_counts(db_session)['tags']
+
+        db_session.add(Tag(name='Counted'))
+        with self.assertRaises(IntegrityError):
+            db_session.commit()
+        db_session.rollback()
+        db_session.add(Tag(name='Counted again'))
+        db_session.commit()
+
+        self.assertEqual(get_catalog_counts(db_session)['tags'], tags + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
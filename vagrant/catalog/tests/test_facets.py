@@ -0,0 +1,44 @@
+import unittest
+
+import tests  # Points the app at the test database
+from catalog.facets import TagBitmaps, bit_count, bit_ids
+
+
+class BitsTest(unittest.TestCase):
+
+    def test_bit_count(self):
+        self.assertEqual(bit_count(0), 0)
+        self.assertEqual(bit_count(0b1011), 3)
+        self.assertEqual(bit_count((1 << 100000) | 1), 2)
+
+    def test_bit_ids(self):
+        self.assertEqual(bit_ids(0b1011), [3, 1, 0])
+        self.assertEqual(bit_ids(0b1011, offset=1, limit=1), [1])
+
+
+class TagBitmapsTest(unittest.TestCase):
+
+    def setUp(self):
+        # Items 1 to 4; tag 1 has items 1 and 2, tag 2 has items 2 and 3
+        self.bitmaps = TagBitmaps(1, 0b11110, {1: 0b110, 2: 0b1100},
+                                  {'One': 1, 'Two': 2})
+
+    def test_facet_counts(self):
+        self.assertEqual(self.bitmaps.facet_counts(self.bitmaps.items),
+                         {1: 2, 2: 2})
+        self.assertEqual(self.bitmaps.facet_counts(
+            self.bitmaps.matching(include=[1])), {1: 2, 2: 1})
+
+    def test_counts_kept_up_to_date(self):
+        bitmaps = self.bitmaps.apply([('add_item', (5,)),
+                                      ('tag_item', (1, 5)),
+                                      ('untag_item', (2, 3)),
+                                      ('remove_item', (2,))], 2)
+        self.assertEqual(bitmaps.facet_counts(bitmaps.items), {1: 2})
+        self.assertEqual(bitmaps.counts,
+                         dict((tag_id, bit_count(bits))
+                              for tag_id, bits in bitmaps.members.items()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import shutil
+import unittest
+
+from flask import session
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.schema import CreateTable
+
+import tests  # Points the app at the test database
+from catalog import app
+from catalog import database
+from catalog.database import Base, db_session
+from catalog.feeds import archive_page, last_closed_page
+from catalog.models import Item, FeedArchive
+from catalog.schema import upgrade_schema
+
+
+class FeedArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.size = app.config['FEED_ARCHIVE_SIZE']
+        app.config['FEED_ARCHIVE_SIZE'] = 2
+        self.context = app.test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        db_session.remove()
+        self.context.pop()
+        app.config['FEED_ARCHIVE_SIZE'] = self.size
+
+    def add_items(self, count):
+        items = [Item(name='Feed item') for _ in range(count)]
+        db_session.add_all(items)
+        db_session.commit()
+        return items
+
+    def test_ids_not_reused(self):
+        item, = self.add_items(1)
+        deleted_id = item.id
+        db_session.delete(item)
+        db_session.commit()
+        item, = self.add_items(1)
+        self.assertGreater(item.id, deleted_id)
+
+    def test_stored_page_stays_closed(self):
+        items = self.add_items(5)
+        page = last_closed_page()
+        self.assertIsNotNone(archive_page(page))
+        for item in items[-3:]:
+            db_session.delete(item)
+        db_session.commit()
+        self.assertEqual(last_closed_page(), page)
+
+    def test_no_next_archive_link(self):
+        self.add_items(5)
+        body = archive_page(last_closed_page() - 1)
+        self.assertIn('prev-archive', body)
+        self.assertNotIn('next-archive', body)
+
+
+class ArchiveReplicaTest(unittest.TestCase):
+    """Storing archive pages when reads go to a replica"""
+
+    def setUp(self):
+        self.size = app.config['FEED_ARCHIVE_SIZE']
+        app.config['FEED_ARCHIVE_SIZE'] = 2
+        for item in range(5):
+            db_session.add(Item(name='Replica item'))
+        db_session.commit()
+        self.replica_file = os.path.join(tests.directory, 'replica.db')
+        shutil.copy(app.config['DB_FILE'], self.replica_file)
+        database.replica_engines.append(
+            create_engine('sqlite:///' + self.replica_file))
+
+    def tearDown(self):
+        db_session.remove()
+        replica = database.replica_engines.pop()
+        replica.dispose()
+        os.remove(self.replica_file)
+        app.config['FEED_ARCHIVE_SIZE'] = self.size
+
+    def test_stored_by_another_worker(self):
+        with app.test_request_context():
+            page = last_closed_page()
+        database.engine.execute(FeedArchive.__table__.insert(),
+                                page=page, body=u'stored')
+        with app.test_request_context():
+            self.assertEqual(archive_page(page), u'stored')
+            self.assertNotIn('db_written', session)
+
+    def test_stored_here(self):
+        with app.test_request_context():
+            page = last_closed_page()
+            body = archive_page(page)
+            self.assertNotIn('db_written', session)
+        with app.test_request_context():
+            self.assertEqual(archive_page(page), body)
+
+
+class AutoincrementMigrationTest(unittest.TestCase):
+
+    def test_rebuild_item_table(self):
+        engine = create_engine('sqlite:///' + os.path.join(tests.directory,
+                                                           'old.db'))
+        Base.metadata.create_all(engine)
+        ddl = unicode(CreateTable(Item.__table__).compile(
+            dialect=engine.dialect))
+        engine.execute(text('DROP TABLE item'))
+        engine.execute(text(ddl.replace(u'AUTOINCREMENT', u'')))
+        engine.execute(Item.__table__.insert(), [{'id': 1, 'name': 'One'},
+                                                 {'id': 2, 'name': 'Two'}])
+        engine.execute(FeedArchive.__table__.insert(), page=1, body=u'old')
+
+        changes = upgrade_schema(engine)
+
+        self.assertIn(('Rebuild table item with AUTOINCREMENT', None),
+                      changes)
+        self.assertEqual(engine.execute(text('SELECT id, name FROM item '
+                                             'ORDER BY id')).fetchall(),
+                         [(1, 'One'), (2, 'Two')])
+        self.assertEqual(engine.execute(
+            text('SELECT count(*) FROM feed_archive')).scalar(), 0)
+        engine.execute(text('DELETE FROM item WHERE id = 2'))
+        engine.execute(Item.__table__.insert(), name='Three')
+        self.assertEqual(engine.execute(text('SELECT max(id) FROM item'))
+                               .scalar(), 3)
+        self.assertIn('ix_item_updated_on_id',
+                      [index['name'] for index in
+                       inspect(engine).get_indexes('item')])
+        self.assertEqual(upgrade_schema(engine), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
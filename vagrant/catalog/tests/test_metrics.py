@@ -0,0 +1,22 @@
+import os
+import unittest
+
+import tests  # Points the app at the test database
+from catalog import app
+from catalog.database import engine
+from catalog.metrics import render_metrics
+
+
+class RenderMetricsTest(unittest.TestCase):
+
+    def test_worker_label(self):
+        app.test_client().get('/catalog/')
+        series = [line for line in render_metrics(engine).splitlines()
+                  if not line.startswith('#')]
+        self.assertTrue(series)
+        for line in series:
+            self.assertIn('worker="%d"' % os.getpid(), line)
+
+
+if __name__ == '__main__':
+    unittest.main()
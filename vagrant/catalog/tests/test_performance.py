@@ -0,0 +1,59 @@
+"""Checks that views' SQL statement counts don't grow with the catalog,
+and that importing the app stays quick and leaves the lazily imported
+modules alone. They run the app in fresh interpreters, as benchmark.py's
+queries and startup commands do."""
+
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import tests  # Points the app at the test database
+import benchmark
+
+# Numbers of items in the small and large catalogs
+SMALL_CATALOG = 500
+LARGE_CATALOG = 5000
+TAGS = 20
+
+# Most time importing the app may take, in seconds: well over the usual
+# time, so that only real regressions fail
+IMPORT_BUDGET = 2.0
+
+
+class QueryCountTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.mkdtemp(prefix='catalog-queries-')
+        try:
+            cls.small = benchmark.count_queries(directory, SMALL_CATALOG,
+                                                TAGS)
+            cls.large = benchmark.count_queries(directory, LARGE_CATALOG,
+                                                TAGS)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_list_routes(self):
+        for name, path in benchmark.QUERY_ROUTES:
+            small_status, small_count = self.small[name]
+            large_status, large_count = self.large[name]
+            self.assertEqual((small_status, large_status), (200, 200), name)
+            self.assertIsNotNone(small_count, name)
+            self.assertEqual(small_count, large_count, name)
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_import(self):
+        script = benchmark.STARTUP_SCRIPT % (benchmark.LAZY_MODULES,)
+        result = json.loads(subprocess.check_output(
+            [sys.executable, '-c', script]))
+        self.assertEqual(result['lazy'], [])
+        self.assertLess(result['import'], IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import tests  # Points the app at the test database
+from catalog import app
+from catalog.template_cache import AtomicFileSystemBytecodeCache
+
+
+class AtomicFileSystemBytecodeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=tests.directory)
+        self.environment = app.jinja_env.overlay(
+            bytecode_cache=AtomicFileSystemBytecodeCache(self.directory))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entries_readable_by_others(self):
+        self.environment.get_template('404.html')
+        entries = os.listdir(self.directory)
+        self.assertEqual(len(entries), 1)
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = os.stat(os.path.join(self.directory, entries[0])).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o666 & ~umask)
+
+
+if __name__ == '__main__':
+    unittest.main()